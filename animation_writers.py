@@ -0,0 +1,178 @@
+# animation_writers.py
+import os
+import shutil
+import itertools
+import subprocess
+import numpy as np
+import matplotlib
+from PIL import Image
+
+# Camada de saída das animações (GIFs de previsão): os renderizadores entregam cada frame
+# já pronto (buffer RGBA do canvas do matplotlib ou imagem PIL do fast_raster) a um writer
+# do formato escolhido. "gif" continua o padrão; "webp" e "apng" usam o Pillow e "mp4" envia
+# os frames brutos para um ffmpeg local (sem ffmpeg, cai para GIF com aviso).
+ANIMATION_FORMATS = ("gif", "webp", "apng", "mp4")
+DEFAULT_ANIMATION_FORMAT = "gif"
+ANIMATION_EXTENSIONS = {"gif": ".gif", "webp": ".webp", "apng": ".png", "mp4": ".mp4"}
+# Opções de gravação do Pillow por formato, priorizando o tempo de codificação: WebP sem perdas
+# (cores completas, sem a paleta de 256 do GIF) com method=0 e APNG com compressão zlib leve
+PILLOW_SAVE_OPTIONS = {
+    "gif": {"format": "GIF"},
+    "webp": {"format": "WEBP", "lossless": True, "method": 0},
+    "apng": {"format": "PNG", "compress_level": 1},
+}
+DEFAULT_FRAME_DURATION_MS = 500 # Mesmo ritmo do antigo writer 'pillow' do matplotlib com fps=2
+# Formatos cujo gravador do Pillow consome append_images uma única vez, frame a frame; o WebP
+# e o APNG percorrem a lista mais de uma vez (modos/tamanhos antes dos frames) e a recebem pronta
+PILLOW_LAZY_APPEND_FORMATS = ("gif",)
+# Memória aproximada (bytes por pixel de cada frame de saída) que a gravação pelo Pillow mantém
+# até o fim: GIF, os frames com paleta; WebP e APNG, a lista de frames RGB e as cópias do codificador
+PILLOW_RETAINED_BYTES_PER_PIXEL = {"gif": 1, "webp": 6, "apng": 8}
+MP4_CODEC_ARGS = ["-c:v", "libx264", "-preset", "medium", "-crf", "18", "-pix_fmt", "yuv420p",
+                  "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2"] # yuv420p exige largura/altura pares
+
+def find_ffmpeg():
+    """Caminho do ffmpeg configurado no matplotlib (animation.ffmpeg_path) ou no PATH; None se ausente."""
+    return shutil.which(matplotlib.rcParams.get("animation.ffmpeg_path", "ffmpeg")) or shutil.which("ffmpeg")
+
+def available_animation_formats():
+    """Formatos utilizáveis neste ambiente (mp4 só com ffmpeg)."""
+    return tuple(animation_format for animation_format in ANIMATION_FORMATS
+                 if animation_format != "mp4" or find_ffmpeg() is not None)
+
+def resolve_animation_format(animation_format):
+    """Valida o formato; desconhecido ou indisponível (mp4 sem ffmpeg) vira o padrão, com aviso."""
+    animation_format = (animation_format or DEFAULT_ANIMATION_FORMAT).lower()
+    if animation_format not in ANIMATION_FORMATS:
+        print(f"    Aviso: formato de animação '{animation_format}' desconhecido (opções: {', '.join(ANIMATION_FORMATS)}). "
+              f"Usando '{DEFAULT_ANIMATION_FORMAT}'.")
+        return DEFAULT_ANIMATION_FORMAT
+    if animation_format == "mp4" and find_ffmpeg() is None:
+        print(f"    Aviso: ffmpeg não encontrado; animações salvas como '{DEFAULT_ANIMATION_FORMAT}' em vez de mp4.")
+        return DEFAULT_ANIMATION_FORMAT
+    return animation_format
+
+def animation_format_from_path(path):
+    """Formato correspondente à extensão de 'path' (extensão desconhecida: o padrão)."""
+    extension = os.path.splitext(path)[1].lower()
+    for animation_format, format_extension in ANIMATION_EXTENSIONS.items():
+        if extension == format_extension:
+            return animation_format
+    return DEFAULT_ANIMATION_FORMAT
+
+def animation_path(output_path_base, hour=24, animation_format=DEFAULT_ANIMATION_FORMAT):
+    """Nome do arquivo da animação: <base>_<hora>h<extensão do formato>."""
+    return f"{output_path_base}_{hour}h{ANIMATION_EXTENSIONS[resolve_animation_format(animation_format)]}"
+
+def retained_frame_bytes(animation_format, size, num_frames):
+    """Memória que o writer do formato mantém para num_frames frames de 'size' (0 no mp4, que não guarda frames)."""
+    return PILLOW_RETAINED_BYTES_PER_PIXEL.get(animation_format, 0) * size[0] * size[1] * num_frames
+
+def canvas_frame(fig):
+    """Desenha a figura e devolve o buffer RGBA do canvas (visão (altura, largura, 4), sem cópia)."""
+    fig.canvas.draw()
+    return np.asarray(fig.canvas.buffer_rgba())
+
+class PillowAnimationWriter:
+    """
+    GIF, WebP ou APNG via Pillow. O Pillow só grava a animação inteira de uma vez, então
+    nenhum desses formatos é gravado de forma incremental: com add_frame(), cada frame é
+    guardado como uma imagem (uma única cópia do buffer do canvas; imagens PIL do fast_raster
+    são guardadas como estão) até close(); write_frames() entrega um iterável ao Pillow, que
+    ainda guarda os frames até o fim (ver PILLOW_RETAINED_BYTES_PER_PIXEL); no GIF, sem uma
+    segunda cópia no writer. Para animações longas, só o mp4 (FFmpegAnimationWriter) não acumula frames.
+    """
+
+    def __init__(self, path, animation_format, duration_ms):
+        self.path = path
+        self.animation_format = animation_format
+        self.duration_ms = duration_ms
+        self.frames = []
+
+    def _prepare_frame(self, frame):
+        if not isinstance(frame, Image.Image):
+            frame = np.asarray(frame)
+            frame = Image.fromarray(np.array(frame, copy=True), "RGBA" if frame.shape[-1] == 4 else "RGB")
+        if self.animation_format == "gif" and frame.mode == "RGB":
+            # Mesma conversão que o Pillow faz ao gravar o GIF, feita já aqui: o frame fica
+            # guardado com paleta (1 byte por pixel em vez de 3) até a gravação
+            frame = frame.convert("P", palette=Image.Palette.ADAPTIVE)
+        return frame
+
+    def add_frame(self, frame):
+        self.frames.append(self._prepare_frame(frame))
+
+    def write_frames(self, frames):
+        """
+        Grava os frames já adicionados seguidos dos de 'frames' (iterável; no GIF, consumido sob
+        demanda pelo Pillow) e fecha a animação. Retorna o caminho, ou None se não houver frames.
+        """
+        pending_frames = itertools.chain(self.frames, (self._prepare_frame(frame) for frame in frames))
+        self.frames = []
+        first_frame = next(pending_frames, None)
+        if first_frame is None:
+            return None
+        if self.animation_format not in PILLOW_LAZY_APPEND_FORMATS:
+            pending_frames = list(pending_frames)
+        first_frame.save(self.path, save_all=True, append_images=pending_frames, duration=self.duration_ms,
+                         loop=0, **PILLOW_SAVE_OPTIONS[self.animation_format])
+        return self.path
+
+    def close(self):
+        return self.write_frames(())
+
+class FFmpegAnimationWriter:
+    """
+    MP4 (H.264) via um processo ffmpeg: cada frame é escrito como vídeo bruto no stdin
+    assim que é renderizado, direto do buffer do canvas, sem ficar em memória.
+    """
+
+    def __init__(self, path, duration_ms, ffmpeg_path=None):
+        self.path = path
+        self.fps = 1000.0 / duration_ms
+        self.ffmpeg_path = ffmpeg_path or find_ffmpeg()
+        self.process = None
+        self.frame_shape = None
+
+    def _start(self, height, width, channels):
+        pix_fmt = "rgba" if channels == 4 else "rgb24"
+        self.process = subprocess.Popen(
+            [self.ffmpeg_path, "-y", "-loglevel", "error", "-f", "rawvideo", "-pix_fmt", pix_fmt,
+             "-s", f"{width}x{height}", "-r", f"{self.fps:g}", "-i", "-", *MP4_CODEC_ARGS, self.path],
+            stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.frame_shape = (height, width, channels)
+
+    def add_frame(self, frame):
+        if isinstance(frame, Image.Image):
+            frame = np.asarray(frame.convert("RGB"))
+        frame = np.ascontiguousarray(frame)
+        if self.process is None:
+            self._start(*frame.shape)
+        elif frame.shape != self.frame_shape:
+            raise ValueError(f"Frame com formato {frame.shape}, esperado {self.frame_shape}.")
+        self.process.stdin.write(memoryview(frame).cast("B"))
+
+    def write_frames(self, frames):
+        """Escreve cada frame de 'frames' assim que é produzido e fecha o vídeo (ver close())."""
+        for frame in frames:
+            self.add_frame(frame)
+        return self.close()
+
+    def close(self):
+        if self.process is None:
+            return None
+        self.process.stdin.close()
+        stderr = self.process.stderr.read()
+        if self.process.wait() != 0:
+            raise RuntimeError(f"ffmpeg falhou ({self.process.returncode}): {stderr.decode(errors='replace').strip()}")
+        return self.path
+
+def open_animation_writer(path, animation_format=DEFAULT_ANIMATION_FORMAT, duration_ms=DEFAULT_FRAME_DURATION_MS):
+    """
+    Writer do formato: add_frame(frame) para cada frame e close() ao final, ou write_frames(iterável),
+    que grava e fecha; ambos retornam o caminho.
+    """
+    animation_format = resolve_animation_format(animation_format)
+    if animation_format == "mp4":
+        return FFmpegAnimationWriter(path, duration_ms)
+    return PillowAnimationWriter(path, animation_format, duration_ms)
@@ -0,0 +1,338 @@
+# benchmark.py
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import tracemalloc
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from metrics import posprocessDataframe, calculate_model_metrics, accumulate_spatial_errors, DEFAULT_METRICS_BACKEND
+from processor import (load_model_data, read_model_pickle, select_visualization_sample, stream_model_metrics,
+                       fetch_sample_rows, PRECISION_DTYPES, DEFAULT_PRECISION)
+from chunked_forecast import export_chunked_forecast, CHUNKED_FORECAST_SUFFIX
+from visualizer import generate_visualizations, get_gif_forecasting, DEFAULT_RENDERER
+from animation_writers import ANIMATION_FORMATS, available_animation_formats
+from sample_fields import SampleFields
+from reporting import create_metrics_summary_table, plot_cumulative_metric_graph
+from instrumentation import PeakRSSSampler
+
+# Benchmark do pipeline com pickles sintéticos (mesmo esquema dos arquivos de /workspace/EXPORT),
+# sem depender de dados externos. Uso: python benchmark.py --samples 4 16 --compare anterior.json
+GRID_SHAPE = (354, 360) # (lat, lon) da grade de previsão
+NUM_DAYS_METRICS = 7
+DEFAULT_SAMPLE_COUNTS = [4, 16]
+DEFAULT_OUTPUT_DIR = "benchmark_results"
+REPORT_TASK_COUNT = 3 # Tarefas simuladas nos relatórios comparativos
+
+def make_synthetic_forecast_frame(n_samples, seed=0, grid_shape=GRID_SHAPE, n_days=NUM_DAYS_METRICS,
+                                  noise_scale=0.3, dtype=np.float32):
+    """
+    Gera um DataFrame com o esquema dos pickles de previsão: 'y_rol' e 'y_rol_pred' como
+    arrays planos de (lat x lon x dias) valores, 'lat'/'lon' como malhas 2D e 'dia_mes_ano'.
+    A previsão é o campo real somado a ruído gaussiano de desvio 'noise_scale'.
+    """
+    rng = np.random.default_rng(seed)
+    lat, lon = np.meshgrid(np.linspace(-35, 5, grid_shape[0]), np.linspace(-75, -30, grid_shape[1]), indexing='ij')
+    n_values = grid_shape[0] * grid_shape[1] * n_days
+    rows = []
+    for i_sample in range(n_samples):
+        y_rol = rng.standard_normal(n_values, dtype=np.float32).astype(dtype, copy=False)
+        y_rol_pred = (y_rol + rng.normal(scale=noise_scale, size=n_values)).astype(dtype)
+        rows.append({
+            "y_rol": y_rol,
+            "y_rol_pred": y_rol_pred,
+            "lat": lat,
+            "lon": lon,
+            "dia_mes_ano": (pd.Timestamp("2020-01-01") + pd.Timedelta(days=i_sample)).strftime("%Y-%m-%d")
+        })
+    return pd.DataFrame(rows)
+
+def write_synthetic_pickle(file_path, n_samples, seed=0, dtype=np.float32):
+    """Grava um pickle sintético com n_samples amostras e retorna seu tamanho em bytes."""
+    make_synthetic_forecast_frame(n_samples, seed=seed, dtype=dtype).to_pickle(file_path)
+    return os.path.getsize(file_path)
+
+def measure_stage(stage_name, func, *args, trace_allocations=False, **kwargs):
+    """
+    Executa func(*args, **kwargs) medindo tempo de parede, tempo de CPU e pico de RSS.
+    Com trace_allocations=True também registra (via tracemalloc, que deixa o código bem
+    mais lento) o pico de memória rastreada e o número de blocos alocados e não liberados.
+    Retorna (resultado, registro do estágio).
+    """
+    if trace_allocations:
+        tracemalloc.start()
+        snapshot_before = tracemalloc.take_snapshot()
+
+    with PeakRSSSampler() as rss_sampler:
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+        result = func(*args, **kwargs)
+        wall_seconds = time.perf_counter() - wall_start
+        cpu_seconds = time.process_time() - cpu_start
+
+    record = {
+        "stage": stage_name,
+        "wall_s": wall_seconds,
+        "cpu_s": cpu_seconds,
+        "peak_rss_mb": rss_sampler.peak_bytes / 1024**2 if rss_sampler.peak_bytes else None,
+        "rss_delta_mb": (rss_sampler.end_bytes - rss_sampler.start_bytes) / 1024**2
+                        if rss_sampler.end_bytes and rss_sampler.start_bytes else None
+    }
+
+    if trace_allocations:
+        _, peak_traced_bytes = tracemalloc.get_traced_memory()
+        snapshot_after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        block_diffs = snapshot_after.compare_to(snapshot_before, 'filename')
+        record["peak_traced_mb"] = peak_traced_bytes / 1024**2
+        record["net_allocated_blocks"] = int(sum(stat.count_diff for stat in block_diffs))
+
+    print(f"  {stage_name}: {record['wall_s']:.3f}s parede, {record['cpu_s']:.3f}s CPU, "
+          f"pico RSS {record['peak_rss_mb'] or float('nan'):.0f} MB")
+    return result, record
+
+def _reporting_stage(task_metrics_list, reports_dir):
+    """Gera os gráficos acumulados (RMSE, R², MSE) e a tabela de resumo, como o main.py."""
+    days_for_plotting = np.arange(1, NUM_DAYS_METRICS + 1)
+    for metric_key, metric_label in {"rmse": "RMSE", "r2": "R²", "mse": "MSE"}.items():
+        plot_cumulative_metric_graph(metric_key=metric_key, metric_label=metric_label,
+                                     all_tasks_metrics_data=task_metrics_list,
+                                     days_array=days_for_plotting, output_directory=reports_dir)
+    create_metrics_summary_table(task_metrics_list, os.path.join(reports_dir, "resumo_metricas_modelos.png"))
+
+def _animation_stages(sample_row, output_dir, renderer, animation_formats, trace_allocations=False):
+    """
+    Mede a gravação da animação do campo real em cada formato (tempo de renderização +
+    codificação); o registro de cada estágio ganha o tamanho do arquivo em "file_mb".
+    """
+    if renderer == "fast_raster":
+        import fast_raster
+        gif_func = fast_raster.write_forecast_gif
+    else:
+        gif_func = get_gif_forecasting
+    sample_fields = SampleFields.from_sample_row(sample_row)
+    usable_formats = available_animation_formats()
+    stages = []
+    for animation_format in animation_formats:
+        if animation_format not in usable_formats:
+            print(f"  animation_{animation_format}: formato indisponível neste ambiente (ffmpeg ausente?). Pulando.")
+            continue
+        output_path, record = measure_stage(f"animation_{animation_format}", gif_func, None,
+                                            os.path.join(output_dir, f"BENCH_{animation_format}"),
+                                            sample_fields=sample_fields, animation_format=animation_format,
+                                            trace_allocations=trace_allocations)
+        record["file_mb"] = os.path.getsize(output_path) / 1024**2 if output_path and os.path.exists(output_path) else None
+        if record["file_mb"] is not None:
+            print(f"    {os.path.basename(output_path)}: {record['file_mb']:.2f} MB")
+        stages.append(record)
+    return stages
+
+def _chunked_stages(pickle_path, metrics_backend, precision, trace_allocations=False):
+    """
+    Compara o pickle com o formato em blocos (chunked_forecast.py): exportação, métricas em
+    streaming sem cache e a leitura de uma única amostra (a última) em cada formato.
+    """
+    stages = []
+    chunked_path = os.path.splitext(pickle_path)[0] + CHUNKED_FORECAST_SUFFIX
+    _, record = measure_stage("export_chunked_forecast", export_chunked_forecast, pickle_path, chunked_path,
+                              trace_allocations=trace_allocations)
+    record["file_mb"] = os.path.getsize(chunked_path) / 1024**2
+    stages.append(record)
+    for format_name, file_path in (("pickle", pickle_path), ("chunked", chunked_path)):
+        (aggregated_metrics, _, _), record = measure_stage(f"stream_model_metrics_{format_name}", stream_model_metrics,
+                                                           file_path, "BENCH", 0, metrics_backend=metrics_backend,
+                                                           precision=precision, trace_allocations=trace_allocations)
+        stages.append(record)
+        last_position = len(aggregated_metrics['per_sample']['rmse']) - 1
+        _, record = measure_stage(f"fetch_sample_rows_{format_name}", fetch_sample_rows, file_path, "BENCH",
+                                  [last_position], aggregated_metrics['per_sample'], precision=precision,
+                                  trace_allocations=trace_allocations)
+        stages.append(record)
+    return stages
+
+def _precision_deviation(pickle_path, aggregated_metrics, metrics_backend):
+    """
+    Desvio das métricas agregadas por dia em relação ao caminho float64 do mesmo pickle:
+    {métrica: {"max_abs", "max_rel"}} (desvios máximos sobre os dias).
+    """
+    reference_df = load_model_data(pickle_path, "BENCH", metrics_backend=metrics_backend, precision="float64")
+    reference_metrics = calculate_model_metrics(reference_df)
+    del reference_df
+    deviation = {}
+    for metric_key in ("mse", "rmse", "r2"):
+        reference = np.asarray(reference_metrics[metric_key], dtype=np.float64)
+        abs_diff = np.abs(np.asarray(aggregated_metrics[metric_key], dtype=np.float64) - reference)
+        deviation[metric_key] = {"max_abs": float(abs_diff.max()),
+                                 "max_rel": float((abs_diff / np.maximum(np.abs(reference), np.finfo(np.float64).tiny)).max())}
+        print(f"  desvio {metric_key} vs. float64: máx. absoluto {deviation[metric_key]['max_abs']:.3e}, "
+              f"máx. relativo {deviation[metric_key]['max_rel']:.3e}")
+    return deviation
+
+def run_benchmark(n_samples, work_dir, metrics_backend=DEFAULT_METRICS_BACKEND, renderer=DEFAULT_RENDERER,
+                  render_workers=1, use_cache=False, skip_visualizations=False, trace_allocations=False, seed=0,
+                  animation_formats=(), precision=DEFAULT_PRECISION, pickle_dtype="float32", chunked=False):
+    """
+    Executa os estágios do pipeline para um pickle sintético de n_samples amostras e retorna
+    {"n_samples", "pickle_mb", "stages": [registros de measure_stage]}.
+    'animation_formats' acrescenta um estágio por formato de animação (tempo e tamanho do arquivo).
+    'precision' é a precisão dos campos no pipeline e 'pickle_dtype' a dos arrays gravados no
+    pickle; fora de float64, o resultado ganha "precision_deviation" (ver _precision_deviation).
+    'chunked' acrescenta os estágios do formato em blocos (ver _chunked_stages).
+    """
+    print(f"\n=== Benchmark com {n_samples} amostra(s) ===")
+    pickle_path = os.path.join(work_dir, f"synthetic_{n_samples}.pkl")
+    pickle_bytes = write_synthetic_pickle(pickle_path, n_samples, seed=seed, dtype=PRECISION_DTYPES[pickle_dtype])
+    cache_dir = os.path.join(work_dir, "cache") if use_cache else None
+    stage_kw = {"trace_allocations": trace_allocations}
+    stages = []
+
+    df_loaded, record = measure_stage("load_model_data", load_model_data, pickle_path, "BENCH",
+                                      metrics_backend=metrics_backend, cache_dir=cache_dir, precision=precision, **stage_kw)
+    stages.append(record)
+    if use_cache:
+        del df_loaded
+        df_loaded, record = measure_stage("load_model_data_cache_quente", load_model_data, pickle_path, "BENCH",
+                                          metrics_backend=metrics_backend, cache_dir=cache_dir, precision=precision,
+                                          **stage_kw)
+        stages.append(record)
+
+    df_raw, record = measure_stage("read_model_pickle", read_model_pickle, pickle_path, precision=precision, **stage_kw)
+    stages.append(record)
+    _, record = measure_stage("posprocessDataframe", posprocessDataframe, df_raw, backend=metrics_backend, **stage_kw)
+    stages.append(record)
+    del df_raw
+
+    aggregated_metrics, record = measure_stage("calculate_model_metrics", calculate_model_metrics, df_loaded, **stage_kw)
+    stages.append(record)
+    _, record = measure_stage("accumulate_spatial_errors", accumulate_spatial_errors, df_loaded, **stage_kw)
+    stages.append(record)
+
+    if not skip_visualizations:
+        (sample_row, _), record = measure_stage("select_visualization_sample", select_visualization_sample, df_loaded, 0, **stage_kw)
+        stages.append(record)
+        viz_dir = os.path.join(work_dir, f"viz_{n_samples}")
+        os.makedirs(viz_dir, exist_ok=True)
+        _, record = measure_stage("generate_visualizations", generate_visualizations, sample_row, "BENCH", viz_dir,
+                                  day_for_main_viz=0, render_workers=render_workers, renderer=renderer, **stage_kw)
+        stages.append(record)
+        if animation_formats:
+            stages.extend(_animation_stages(sample_row, viz_dir, renderer, animation_formats, **stage_kw))
+
+    reports_dir = os.path.join(work_dir, f"relatorios_{n_samples}")
+    os.makedirs(reports_dir, exist_ok=True)
+    task_metrics_list = [{"task_id": f"BENCH_{i_task + 1}", "model_type": "BENCH", "metrics_data": aggregated_metrics}
+                         for i_task in range(REPORT_TASK_COUNT)]
+    _, record = measure_stage("reporting", _reporting_stage, task_metrics_list, reports_dir, **stage_kw)
+    stages.append(record)
+
+    if chunked:
+        stages.extend(_chunked_stages(pickle_path, metrics_backend, precision, **stage_kw))
+
+    del df_loaded
+    run_result = {"n_samples": n_samples, "pickle_mb": pickle_bytes / 1024**2, "stages": stages}
+    if precision != "float64":
+        run_result["precision_deviation"] = _precision_deviation(pickle_path, aggregated_metrics, metrics_backend)
+    return run_result
+
+def compare_results(current, previous):
+    """Imprime, por número de amostras e estágio, o tempo de parede atual vs. o de uma execução anterior."""
+    previous_runs = {run["n_samples"]: {s["stage"]: s for s in run["stages"]} for run in previous.get("runs", [])}
+    print(f"\n=== Comparação com {previous.get('timestamp', 'execução anterior')} ===")
+    print(f"  {'amostras':>8}  {'estágio':<30} {'anterior':>10} {'atual':>10} {'razão':>7}")
+    for run in current["runs"]:
+        previous_stages = previous_runs.get(run["n_samples"], {})
+        for stage in run["stages"]:
+            previous_stage = previous_stages.get(stage["stage"])
+            if previous_stage is None:
+                print(f"  {run['n_samples']:>8}  {stage['stage']:<30} {'-':>10} {stage['wall_s']:>9.3f}s {'-':>7}")
+                continue
+            ratio = stage["wall_s"] / previous_stage["wall_s"] if previous_stage["wall_s"] > 0 else float('nan')
+            print(f"  {run['n_samples']:>8}  {stage['stage']:<30} {previous_stage['wall_s']:>9.3f}s {stage['wall_s']:>9.3f}s {ratio:>6.2f}x")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark do pipeline com pickles de previsão sintéticos.")
+    parser.add_argument("--samples", type=int, nargs="+", default=DEFAULT_SAMPLE_COUNTS,
+                        help="Números de amostras dos pickles sintéticos (um benchmark por valor).")
+    parser.add_argument("--metrics-backend", default=DEFAULT_METRICS_BACKEND, help="Backend das métricas diárias.")
+    parser.add_argument("--renderer", default=DEFAULT_RENDERER, help="Renderizador dos GIFs e do grid.")
+    parser.add_argument("--render-workers", type=int, default=1, help="Processos de renderização por tarefa.")
+    parser.add_argument("--cache", action="store_true", help="Usa o cache de previsões (mede também a carga com cache quente).")
+    parser.add_argument("--precision", default=DEFAULT_PRECISION, choices=list(PRECISION_DTYPES),
+                        help="Precisão dos campos no pipeline (fora de float64, mede também o desvio das métricas).")
+    parser.add_argument("--pickle-dtype", default="float32", choices=list(PRECISION_DTYPES),
+                        help="Tipo dos arrays gravados no pickle sintético (float32, como os modelos emitem).")
+    parser.add_argument("--animation-formats", nargs="+", default=[], choices=ANIMATION_FORMATS,
+                        help="Formatos de animação a comparar (tempo de codificação e tamanho do arquivo).")
+    parser.add_argument("--chunked", action="store_true",
+                        help="Mede também o formato em blocos (exportação, métricas em streaming e leitura de uma amostra).")
+    parser.add_argument("--skip-visualizations", action="store_true", help="Não mede generate_visualizations.")
+    parser.add_argument("--tracemalloc", action="store_true", help="Registra alocações com tracemalloc (mais lento).")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Arquivo JSON de saída (padrão: benchmark_results/benchmark_<data>.json).")
+    parser.add_argument("--compare", default=None, help="JSON de uma execução anterior para comparação.")
+    parser.add_argument("--keep-files", action="store_true", help="Mantém o diretório temporário com pickles e figuras.")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    work_dir = tempfile.mkdtemp(prefix="meteo_benchmark_")
+    print(f"Diretório de trabalho do benchmark: {work_dir}")
+
+    results = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": {
+            "samples": args.samples,
+            "metrics_backend": args.metrics_backend,
+            "renderer": args.renderer,
+            "render_workers": args.render_workers,
+            "cache": args.cache,
+            "precision": args.precision,
+            "pickle_dtype": args.pickle_dtype,
+            "skip_visualizations": args.skip_visualizations,
+            "animation_formats": args.animation_formats,
+            "chunked": args.chunked,
+            "tracemalloc": args.tracemalloc,
+            "seed": args.seed
+        },
+        "runs": []
+    }
+    try:
+        for n_samples in args.samples:
+            results["runs"].append(run_benchmark(
+                n_samples, work_dir, metrics_backend=args.metrics_backend, renderer=args.renderer,
+                render_workers=args.render_workers, use_cache=args.cache,
+                skip_visualizations=args.skip_visualizations, trace_allocations=args.tracemalloc, seed=args.seed,
+                animation_formats=args.animation_formats, precision=args.precision, pickle_dtype=args.pickle_dtype,
+                chunked=args.chunked))
+    finally:
+        if args.keep_files:
+            print(f"Arquivos do benchmark mantidos em: {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    output_path = args.output or os.path.join(script_dir, DEFAULT_OUTPUT_DIR,
+                                              f"benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResultados do benchmark salvos em: {output_path}")
+
+    if args.compare:
+        try:
+            with open(args.compare, 'r') as f:
+                compare_results(results, json.load(f))
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"AVISO: Não foi possível ler o arquivo de comparação {args.compare}: {e}")
+    return results
+
+if __name__ == "__main__":
+    main()
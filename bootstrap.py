@@ -0,0 +1,186 @@
+# bootstrap.py
+import os
+import json
+from itertools import combinations
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from manifest import to_jsonable
+
+# Intervalos de confiança bootstrap e testes pareados entre tarefas a partir das métricas por
+# amostra ('per_sample' do resumo de process_model, ver metrics.stack_sample_metrics), sem
+# reabrir os campos. Cada reamostragem é representada pelas contagens multinomiais das
+# amostras, de modo que um lote de B reamostragens é um único produto (B, n) @ (n, dias).
+DEFAULT_BOOTSTRAP_RESAMPLES = 2000
+DEFAULT_BOOTSTRAP_CONFIDENCE = 0.95
+DEFAULT_BOOTSTRAP_SEED = 12345
+BOOTSTRAP_BLOCK_SIZE = 500 # Reamostragens por unidade de trabalho (cada uma com sua semente derivada)
+BOOTSTRAP_METRICS = ("rmse", "r2", "mse")
+LOWER_IS_BETTER = {"rmse": True, "mse": True, "r2": False}
+BOOTSTRAP_REPORT_FILENAME = "bootstrap_significancia.json"
+
+def _resample_means_block(values, n_resamples, seed_sequence):
+    """Médias (n_resamples, colunas) de reamostragens com reposição das linhas de values (n, colunas)."""
+    rng = np.random.default_rng(seed_sequence)
+    num_samples = values.shape[0]
+    counts = rng.multinomial(num_samples, np.full(num_samples, 1.0 / num_samples), size=n_resamples)
+    return (counts @ values) / num_samples
+
+def resample_means(values_list, n_resamples=DEFAULT_BOOTSTRAP_RESAMPLES, seed=DEFAULT_BOOTSTRAP_SEED, workers=1):
+    """
+    Distribuição bootstrap da média de cada array (n, colunas) de values_list.
+    Retorna uma lista de arrays (n_resamples, colunas). As reamostragens são divididas em
+    blocos de BOOTSTRAP_BLOCK_SIZE com sementes derivadas de 'seed' (SeedSequence.spawn),
+    então o resultado é o mesmo com qualquer número de 'workers' (processos).
+    """
+    block_sizes = [min(BOOTSTRAP_BLOCK_SIZE, n_resamples - start) for start in range(0, n_resamples, BOOTSTRAP_BLOCK_SIZE)]
+    array_seeds = np.random.SeedSequence(seed).spawn(len(values_list))
+    jobs = [(values, block_size, block_seed)
+            for values, array_seed in zip(values_list, array_seeds)
+            for block_size, block_seed in zip(block_sizes, array_seed.spawn(len(block_sizes)))]
+
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as executor:
+            block_means = list(executor.map(_resample_means_block, *zip(*jobs)))
+    else:
+        block_means = [_resample_means_block(*job) for job in jobs]
+
+    num_blocks = len(block_sizes)
+    return [np.vstack(block_means[i * num_blocks:(i + 1) * num_blocks]) for i in range(len(values_list))]
+
+def _percentile_interval(resampled, confidence):
+    alpha = (1.0 - confidence) / 2
+    low, high = np.percentile(resampled, [100 * alpha, 100 * (1 - alpha)], axis=0)
+    return low, high
+
+def _per_sample_values(task_data, metric_key):
+    """(valores (n, dias) sem amostras com NaN, datas correspondentes ou None) de uma tarefa."""
+    per_sample = (task_data.get("metrics_data") or {}).get("per_sample") or {}
+    if metric_key not in per_sample:
+        return None, None
+    values = np.atleast_2d(np.asarray(per_sample[metric_key], dtype=np.float64))
+    dates = per_sample.get("dates")
+    valid = np.isfinite(values).all(axis=1)
+    if dates is not None and len(dates) == len(values):
+        dates = [date for date, keep in zip(dates, valid) if keep]
+    else:
+        dates = None
+    return values[valid], dates
+
+def _paired_differences(values_a, dates_a, values_b, dates_b):
+    """Diferenças por amostra (a - b) nas datas comuns; sem datas, exige o mesmo número de amostras."""
+    if dates_a is not None and dates_b is not None:
+        positions_b = {date: position for position, date in enumerate(dates_b) if date is not None}
+        pairs = [(position_a, positions_b[date]) for position_a, date in enumerate(dates_a) if date in positions_b]
+        if not pairs:
+            return None
+        rows_a, rows_b = (np.array(rows) for rows in zip(*pairs))
+        return values_a[rows_a] - values_b[rows_b]
+    if len(values_a) == len(values_b):
+        return values_a - values_b
+    return None
+
+def compute_bootstrap_summary(all_tasks_metrics_data, metrics=BOOTSTRAP_METRICS, n_resamples=DEFAULT_BOOTSTRAP_RESAMPLES,
+                              confidence=DEFAULT_BOOTSTRAP_CONFIDENCE, seed=DEFAULT_BOOTSTRAP_SEED, workers=1):
+    """
+    Calcula, a partir de 'per_sample' de cada tarefa, os ICs bootstrap das médias diárias e
+    das médias acumuladas e os testes pareados entre todas as tarefas (na mesma distribuição
+    de reamostragens, que roda em 'workers' processos).
+
+    Returns:
+    --------
+    dict
+        {'n_resamples', 'confidence',
+         'intervals': {task_id: {métrica: {'n_samples', 'ci_low', 'ci_high',
+                                           'cumulative_ci_low', 'cumulative_ci_high': (dias,)}}},
+         'tests': {métrica: [{'task_a', 'task_b', 'n_pairs', 'mean_diff', 'ci_low', 'ci_high',
+                              'p_value': (dias,), 'overall': {...} (média dos dias)}, ...]},
+         'ranking': {métrica: [{'task_id', 'rank', 'mean', 'p_vs_best'}, ...]}}
+        O p-valor é bilateral, do bootstrap centrado da média das diferenças pareadas.
+    """
+    task_ids = [task_data.get("task_id", f"Modelo_{i+1}") for i, task_data in enumerate(all_tasks_metrics_data)]
+    jobs = [] # (tipo, chave, valores)
+    for metric_key in metrics:
+        sample_values = {}
+        for task_id, task_data in zip(task_ids, all_tasks_metrics_data):
+            values, dates = _per_sample_values(task_data, metric_key)
+            if values is None or len(values) < 2:
+                continue
+            sample_values[task_id] = (values, dates)
+            jobs.append(("interval", (task_id, metric_key), values))
+        for task_a, task_b in combinations(sample_values, 2):
+            differences = _paired_differences(*sample_values[task_a], *sample_values[task_b])
+            if differences is None or len(differences) < 2:
+                print(f"  AVISO: '{task_a}' e '{task_b}' sem amostras pareáveis para o teste de {metric_key}.")
+                continue
+            # Última coluna: diferença da média dos dias de cada amostra
+            jobs.append(("test", (task_a, task_b, metric_key), np.column_stack([differences, differences.mean(axis=1)])))
+
+    summary = {"n_resamples": n_resamples, "confidence": confidence, "intervals": {}, "tests": {}, "ranking": {}}
+    if not jobs:
+        print("  AVISO: Nenhuma tarefa com métricas por amostra suficientes para o bootstrap.")
+        return summary
+
+    resampled_list = resample_means([values for _, _, values in jobs], n_resamples=n_resamples, seed=seed, workers=workers)
+    for (job_kind, job_key, values), resampled in zip(jobs, resampled_list):
+        if job_kind == "interval":
+            task_id, metric_key = job_key
+            ci_low, ci_high = _percentile_interval(resampled, confidence)
+            cumulative_low, cumulative_high = _percentile_interval(np.cumsum(resampled, axis=1), confidence)
+            summary["intervals"].setdefault(task_id, {})[metric_key] = {
+                "n_samples": len(values), "ci_low": ci_low, "ci_high": ci_high,
+                "cumulative_ci_low": cumulative_low, "cumulative_ci_high": cumulative_high}
+        else:
+            task_a, task_b, metric_key = job_key
+            observed = values.mean(axis=0)
+            ci_low, ci_high = _percentile_interval(resampled, confidence)
+            # Bootstrap centrado: quão frequente é um desvio tão grande quanto o observado sob H0 (média 0)
+            extreme_count = (np.abs(resampled - observed) >= np.abs(observed)).sum(axis=0)
+            p_value = (extreme_count + 1) / (n_resamples + 1)
+            summary["tests"].setdefault(metric_key, []).append({
+                "task_a": task_a, "task_b": task_b, "n_pairs": len(values),
+                "mean_diff": observed[:-1], "ci_low": ci_low[:-1], "ci_high": ci_high[:-1], "p_value": p_value[:-1],
+                "overall": {"mean_diff": float(observed[-1]), "ci_low": float(ci_low[-1]),
+                            "ci_high": float(ci_high[-1]), "p_value": float(p_value[-1])}})
+
+    for metric_key in metrics:
+        summary["ranking"][metric_key] = rank_tasks(all_tasks_metrics_data, metric_key, summary["tests"].get(metric_key, []))
+    return summary
+
+def rank_tasks(all_tasks_metrics_data, metric_key, metric_tests):
+    """
+    Ordena as tarefas pela média dos dias de 'metric_key' (menor é melhor para RMSE/MSE,
+    maior para R²) e anexa o p-valor do teste pareado (média dos dias) contra a primeira.
+    """
+    task_means = []
+    for i, task_data in enumerate(all_tasks_metrics_data):
+        daily_values = (task_data.get("metrics_data") or {}).get(metric_key)
+        if daily_values is None or len(daily_values) == 0:
+            continue
+        task_means.append((task_data.get("task_id", f"Modelo_{i+1}"), float(np.nanmean(np.asarray(daily_values, dtype=float)))))
+    task_means.sort(key=lambda item: item[1], reverse=not LOWER_IS_BETTER.get(metric_key, True))
+
+    p_values = {}
+    if task_means:
+        best_task_id = task_means[0][0]
+        for test in metric_tests:
+            if best_task_id in (test["task_a"], test["task_b"]):
+                other_task_id = test["task_b"] if test["task_a"] == best_task_id else test["task_a"]
+                p_values[other_task_id] = test["overall"]["p_value"]
+    return [{"task_id": task_id, "rank": position + 1, "mean": mean, "p_vs_best": p_values.get(task_id)}
+            for position, (task_id, mean) in enumerate(task_means)]
+
+def write_bootstrap_report(bootstrap_summary, reports_output_dir, filename=BOOTSTRAP_REPORT_FILENAME):
+    """Grava o resumo do bootstrap em JSON e imprime o ranking de cada métrica. Retorna o caminho."""
+    report_path = os.path.join(reports_output_dir, filename)
+    with open(report_path, 'w') as f:
+        json.dump(to_jsonable(bootstrap_summary), f, indent=2)
+
+    print(f"  ICs bootstrap ({bootstrap_summary['n_resamples']} reamostragens, {bootstrap_summary['confidence']:.0%}) "
+          f"e testes pareados salvos em: {report_path}")
+    for metric_key, ranking in bootstrap_summary["ranking"].items():
+        ranking_str = ", ".join(f"{entry['rank']}º {entry['task_id']}" +
+                                ("" if entry['p_vs_best'] is None else
+                                 " (p<0.001)" if entry['p_vs_best'] < 0.001 else f" (p={entry['p_vs_best']:.3f})")
+                                for entry in ranking)
+        print(f"    {metric_key.upper()}: {ranking_str}")
+    return report_path
@@ -0,0 +1,373 @@
+# chunked_forecast.py
+import os
+import sys
+import json
+import time
+import zlib
+import zipfile
+import argparse
+import threading
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from forecast_cache import writer_suffix
+
+# Formato nativo, em blocos e comprimido, das previsões de um modelo (no estilo do Zarr, em um
+# único arquivo .zip): 'y_rol' e 'y_rol_pred' já redimensionados para (n_amostras, N, dias) e
+# divididos em blocos de amostras x dias, cada bloco um membro DEFLATE independente; 'lat'/'lon'
+# (gravados uma única vez quando todas as amostras usam a mesma grade) e as demais colunas
+# (FRAME_MEMBER) ficam separados dos blocos. A leitura descomprime apenas os blocos pedidos,
+# então as métricas percorrem o arquivo bloco a bloco e uma amostra é uma leitura direta.
+# Exportação: python chunked_forecast.py modelo.pkl [-o modelo.fcz]
+CHUNKED_FORMAT_NAME = "meteo-chunked-forecast"
+CHUNKED_FORMAT_VERSION = 1
+CHUNKED_FORECAST_SUFFIX = ".fcz"
+METADATA_MEMBER = "meta.json"
+FRAME_MEMBER = "frame.pkl"
+CHUNKED_COLUMNS = ['y_rol', 'y_rol_pred'] # Divididos em blocos de amostras x dias
+GRID_COLUMNS = ['lat', 'lon'] # Gravados uma vez (grade compartilhada) ou em blocos de amostras
+DEFAULT_SAMPLES_PER_CHUNK = 1
+DEFAULT_DAYS_PER_CHUNK = 1
+DEFAULT_COMPRESSION_LEVEL = 6
+ZIP_MAGIC = b"PK\x03\x04"
+# Erros de um arquivo ilegível ou corrompido (contêiner, metadados ou blocos)
+CHUNKED_READ_ERRORS = (OSError, ValueError, KeyError, zipfile.BadZipFile, zlib.error)
+
+def is_chunked_forecast(file_path):
+    """True se file_path for um arquivo no formato em blocos (contêiner zip), e não um pickle."""
+    try:
+        with open(file_path, 'rb') as f:
+            return f.read(len(ZIP_MAGIC)) == ZIP_MAGIC
+    except OSError:
+        return False
+
+def _shuffle_bytes(values):
+    """Filtro 'shuffle' (como no Blosc/HDF5): agrupa o k-ésimo byte de todos os valores, o que comprime melhor campos suaves."""
+    return np.ascontiguousarray(np.ascontiguousarray(values).view(np.uint8).reshape(-1, values.dtype.itemsize).T).tobytes()
+
+def _unshuffle_bytes(raw, dtype, shape):
+    itemsize = np.dtype(dtype).itemsize
+    return np.ascontiguousarray(np.frombuffer(raw, dtype=np.uint8).reshape(itemsize, -1).T).view(dtype).reshape(shape)
+
+class ChunkedArray:
+    """
+    Array somente leitura (n_amostras, ..., dias) guardado em blocos de
+    chunks[0] amostras x chunks[-1] elementos do último eixo. Indexar o primeiro eixo (inteiro,
+    fatia ou lista de posições, como em um memmap) descomprime só os blocos dessas amostras;
+    com uma tupla, um inteiro ou fatia no último eixo restringe também os blocos de dias lidos.
+    O resultado é um ndarray em 'dtype'. O último bloco descomprimido de cada coluna de dias
+    é mantido, então fatias consecutivas não alinhadas aos blocos não o leem duas vezes.
+    """
+
+    def __init__(self, zip_file, name, info, dtype=None):
+        self._zip_file = zip_file
+        self.name = name
+        self.shape = tuple(info["shape"])
+        self.chunks = tuple(info["chunks"])
+        self.stored_dtype = np.dtype(info["dtype"])
+        self.dtype = np.dtype(dtype) if dtype is not None else self.stored_dtype
+        self.shuffle = "shuffle" in info.get("filters", [])
+        self.ndim = len(self.shape)
+        self._last_chunks = {} # {índice do bloco de dias: (índice do bloco de amostras, bloco)}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _chunk(self, i_samples, i_days):
+        with self._lock:
+            cached = self._last_chunks.get(i_days)
+            if cached is not None and cached[0] == i_samples:
+                return cached[1]
+        sample_start = i_samples * self.chunks[0]
+        day_start = i_days * self.chunks[-1]
+        chunk_shape = (min(self.chunks[0], self.shape[0] - sample_start),) + self.shape[1:-1] + \
+                      (min(self.chunks[-1], self.shape[-1] - day_start),)
+        raw = self._zip_file.read(f"{self.name}/{i_samples}.{i_days}")
+        if self.shuffle:
+            chunk = _unshuffle_bytes(raw, self.stored_dtype, chunk_shape)
+        else:
+            chunk = np.frombuffer(raw, dtype=self.stored_dtype).reshape(chunk_shape)
+        with self._lock:
+            self._last_chunks[i_days] = (i_samples, chunk)
+        return chunk
+
+    def read(self, positions, day_start=0, day_stop=None):
+        """Amostras 'positions' (sequência de inteiros), dias [day_start, day_stop): ndarray (len(positions), ..., dias)."""
+        day_stop = self.shape[-1] if day_stop is None else day_stop
+        positions = np.asarray(positions, dtype=np.intp)
+        out = np.empty((len(positions),) + self.shape[1:-1] + (max(day_stop - day_start, 0),), dtype=self.dtype)
+        if out.size == 0:
+            return out
+        samples_per_chunk, days_per_chunk = self.chunks[0], self.chunks[-1]
+        chunk_of_position = positions // samples_per_chunk
+        # Agrupa as posições por bloco de amostras, na ordem em que os blocos aparecem
+        for i_samples in dict.fromkeys(chunk_of_position.tolist()):
+            out_rows = np.flatnonzero(chunk_of_position == i_samples)
+            local_rows = positions[out_rows] - i_samples * samples_per_chunk
+            contiguous = np.array_equal(local_rows, np.arange(local_rows[0], local_rows[0] + len(local_rows))) and \
+                         np.array_equal(out_rows, np.arange(out_rows[0], out_rows[0] + len(out_rows)))
+            for i_days in range(day_start // days_per_chunk, (day_stop - 1) // days_per_chunk + 1):
+                chunk = self._chunk(i_samples, i_days)
+                chunk_day_start = i_days * days_per_chunk
+                lo, hi = max(day_start, chunk_day_start), min(day_stop, chunk_day_start + chunk.shape[-1])
+                source = chunk[..., lo - chunk_day_start:hi - chunk_day_start]
+                if contiguous:
+                    out[out_rows[0]:out_rows[-1] + 1, ..., lo - day_start:hi - day_start] = \
+                        source[local_rows[0]:local_rows[-1] + 1]
+                else:
+                    out[out_rows, ..., lo - day_start:hi - day_start] = source[local_rows]
+        return out
+
+    def __getitem__(self, key):
+        rest = ()
+        if isinstance(key, tuple):
+            key, rest = (key[0], key[1:]) if key else (slice(None), ())
+        day_start, day_stop = 0, self.shape[-1]
+        if len(rest) == self.ndim - 1 and isinstance(rest[-1], (int, np.integer, slice)):
+            day_range = range(self.shape[-1])[rest[-1]]
+            if isinstance(day_range, range) and day_range.step == 1:
+                day_start, day_stop = (day_range.start, day_range.stop) if len(day_range) else (0, 0)
+                rest = rest[:-1] + (slice(None),)
+            elif isinstance(day_range, int):
+                day_start, day_stop = day_range, day_range + 1
+                rest = rest[:-1] + (0,)
+        if isinstance(key, (int, np.integer)):
+            position = int(key) + self.shape[0] if key < 0 else int(key)
+            if not 0 <= position < self.shape[0]:
+                raise IndexError(f"Amostra {key} fora do intervalo (0 a {self.shape[0] - 1}).")
+            values = self.read([position], day_start, day_stop)[0]
+        elif isinstance(key, slice):
+            values = self.read(range(*key.indices(self.shape[0])), day_start, day_stop)
+            rest = (slice(None),) + rest if rest else rest
+        else:
+            values = self.read(np.arange(self.shape[0])[np.asarray(key)], day_start, day_stop)
+            rest = (slice(None),) + rest if rest else rest
+        return values[rest] if rest else values
+
+    def __array__(self, dtype=None, copy=None):
+        values = self.read(range(self.shape[0]))
+        return values if dtype is None else values.astype(dtype, copy=False)
+
+class ChunkedForecastReader:
+    """
+    Leitor de um arquivo no formato em blocos. open_arrays() devolve (frame, arrays, metadata)
+    como ForecastCache.open_arrays: 'frame' com as colunas que não são arrays e
+    'arrays' = {coluna: ChunkedArray, ou a grade compartilhada repetida com np.broadcast_to}.
+    load() monta o DataFrame completo (todas as amostras), como ForecastCache.load.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._zip_file = zipfile.ZipFile(file_path, 'r')
+        try:
+            self.metadata = json.loads(self._zip_file.read(METADATA_MEMBER))
+        except KeyError:
+            self._zip_file.close()
+            raise ValueError(f"{file_path} não contém {METADATA_MEMBER}; não é um arquivo no formato em blocos.")
+        except Exception:
+            self._zip_file.close()
+            raise
+        if self.metadata.get("format") != CHUNKED_FORMAT_NAME or \
+           self.metadata.get("format_version") != CHUNKED_FORMAT_VERSION:
+            self._zip_file.close()
+            raise ValueError(f"{file_path}: formato '{self.metadata.get('format')}' versão "
+                             f"{self.metadata.get('format_version')} não suportado.")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._zip_file.close()
+
+    @property
+    def n_samples(self):
+        return self.metadata["n_samples"]
+
+    def read_frame(self):
+        with self._zip_file.open(FRAME_MEMBER) as f:
+            return pd.read_pickle(f)
+
+    def open_arrays(self, dtype=None):
+        """(frame, arrays, metadata); os ChunkedArray de CHUNKED_COLUMNS devolvem blocos em 'dtype' (padrão: o gravado)."""
+        arrays = {}
+        for col_name, array_info in self.metadata["arrays"].items():
+            if array_info.get("shared"):
+                raw = self._zip_file.read(array_info["member"])
+                block = np.frombuffer(raw, dtype=array_info["dtype"]).reshape(array_info["shape"][1:])
+                arrays[col_name] = np.broadcast_to(block, tuple(array_info["shape"]))
+            else:
+                arrays[col_name] = ChunkedArray(self._zip_file, col_name, array_info,
+                                                dtype=dtype if col_name in CHUNKED_COLUMNS else None)
+        return self.read_frame(), arrays, self.metadata
+
+    def load(self, dtype=None):
+        """DataFrame com todas as amostras (uma célula por amostra, como o de processor.read_model_pickle)."""
+        df, arrays, metadata = self.open_arrays(dtype=dtype)
+        for col_name, block in arrays.items():
+            if metadata["arrays"][col_name].get("shared"):
+                df[col_name] = [block[0]] * len(block)
+            else:
+                df[col_name] = list(block[:])
+        return df[metadata["columns"]]
+
+def _write_chunks(zip_file, name, values, start, days_per_chunk, samples_per_chunk, shuffle, compression_level):
+    """Grava values (amostras [start, start + len(values)), alinhado aos blocos de amostras) como membros <name>/<i>.<j>."""
+    for chunk_start in range(0, len(values), samples_per_chunk):
+        i_samples = (start + chunk_start) // samples_per_chunk
+        sample_block = values[chunk_start:chunk_start + samples_per_chunk]
+        for i_days, day_start in enumerate(range(0, values.shape[-1], days_per_chunk)):
+            chunk = np.ascontiguousarray(sample_block[..., day_start:day_start + days_per_chunk])
+            zip_file.writestr(f"{name}/{i_samples}.{i_days}", _shuffle_bytes(chunk) if shuffle else chunk.tobytes(),
+                              compress_type=zipfile.ZIP_DEFLATED, compresslevel=compression_level)
+
+def write_chunked_forecast(df, output_path, num_days, samples_per_chunk=DEFAULT_SAMPLES_PER_CHUNK,
+                           days_per_chunk=DEFAULT_DAYS_PER_CHUNK, dtype=None, compression_level=DEFAULT_COMPRESSION_LEVEL,
+                           shuffle=True, source_path=None, consume=False):
+    """
+    Grava df (como o de processor.read_raw_model_pickle: 'y_rol'/'y_rol_pred' planos) no
+    formato em blocos. Apenas as amostras com 'y_rol' e 'y_rol_pred' são gravadas, redimensionadas
+    para (N, num_days) em 'dtype' (padrão: o tipo dos arrays de df). Com consume=True, as células
+    'y_rol'/'y_rol_pred' de df são liberadas (viram None) à medida que cada bloco de amostras é
+    gravado; df não deve ser usado depois. A gravação é atômica (temporário + os.replace).
+    Retorna os metadados gravados.
+    """
+    valid_rows = np.flatnonzero(df['y_rol'].notna().to_numpy() & df['y_rol_pred'].notna().to_numpy())
+    if len(valid_rows) == 0:
+        raise ValueError("Nenhuma amostra com 'y_rol' e 'y_rol_pred' para exportar.")
+    first_value = np.asarray(df['y_rol'].iloc[valid_rows[0]])
+    dtype = np.dtype(dtype) if dtype is not None else first_value.dtype
+    num_points = first_value.size // num_days
+    array_shape = [len(valid_rows), num_points, num_days]
+    chunks = [samples_per_chunk, num_points, days_per_chunk]
+    filters = ["shuffle"] if shuffle else []
+    arrays_info = {col_name: {"dtype": dtype.str, "shape": array_shape, "chunks": chunks, "filters": filters}
+                   for col_name in CHUNKED_COLUMNS}
+
+    valid_df = df.iloc[valid_rows]
+    grid_columns = []
+    for col_name in GRID_COLUMNS:
+        if col_name not in valid_df.columns:
+            continue
+        first_grid = valid_df[col_name].iloc[0]
+        if not isinstance(first_grid, np.ndarray) or \
+           any(not isinstance(v, np.ndarray) or v.shape != first_grid.shape for v in valid_df[col_name]):
+            continue # Formatos heterogêneos: a coluna fica no frame
+        grid_columns.append(col_name)
+        grid_info = {"dtype": first_grid.dtype.str, "shape": [len(valid_rows)] + list(first_grid.shape)}
+        if all(v is first_grid or np.array_equal(v, first_grid) for v in valid_df[col_name]):
+            grid_info.update({"shared": True, "member": f"{col_name}/grade"})
+        else:
+            grid_info.update({"chunks": [samples_per_chunk] + list(first_grid.shape), "filters": filters})
+        arrays_info[col_name] = grid_info
+
+    metadata = {
+        "format": CHUNKED_FORMAT_NAME,
+        "format_version": CHUNKED_FORMAT_VERSION,
+        "n_samples": len(valid_rows),
+        "columns": list(df.columns),
+        "arrays": arrays_info,
+        "compression": {"method": "deflate", "level": compression_level},
+        "created": datetime.now().isoformat(timespec="seconds")
+    }
+    if source_path is not None:
+        stat = os.stat(source_path)
+        metadata.update({"source_path": os.path.abspath(source_path), "source_size": stat.st_size,
+                         "source_mtime_ns": stat.st_mtime_ns})
+
+    tmp_path = f"{output_path}.tmp-{writer_suffix()}"
+    try:
+        with zipfile.ZipFile(tmp_path, 'w', allowZip64=True) as zip_file:
+            zip_file.writestr(METADATA_MEMBER, json.dumps(metadata, indent=2), compress_type=zipfile.ZIP_DEFLATED)
+            with zip_file.open(FRAME_MEMBER, 'w') as f:
+                valid_df.drop(columns=CHUNKED_COLUMNS + grid_columns).to_pickle(f)
+            for col_name in grid_columns:
+                grid_info = arrays_info[col_name]
+                if grid_info.get("shared"):
+                    zip_file.writestr(grid_info["member"], np.ascontiguousarray(valid_df[col_name].iloc[0]).tobytes(),
+                                      compress_type=zipfile.ZIP_DEFLATED, compresslevel=compression_level)
+                else:
+                    for start in range(0, len(valid_rows), samples_per_chunk):
+                        block = np.stack(list(valid_df[col_name].iloc[start:start + samples_per_chunk]))
+                        _write_chunks(zip_file, col_name, block, start, block.shape[-1], samples_per_chunk,
+                                      shuffle, compression_level)
+            for col_name in CHUNKED_COLUMNS:
+                col_position = df.columns.get_loc(col_name)
+                for start in range(0, len(valid_rows), samples_per_chunk):
+                    rows = valid_rows[start:start + samples_per_chunk]
+                    block = np.empty((len(rows), num_points, num_days), dtype=dtype)
+                    for k, row in enumerate(rows):
+                        block[k] = np.asarray(df.iat[row, col_position], dtype=dtype).reshape(num_points, num_days)
+                        if consume:
+                            df.iat[row, col_position] = None # Libera o array original assim que é gravado
+                    _write_chunks(zip_file, col_name, block, start, days_per_chunk, samples_per_chunk,
+                                  shuffle, compression_level)
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return metadata
+
+def export_chunked_forecast(pickle_path, output_path=None, samples_per_chunk=DEFAULT_SAMPLES_PER_CHUNK,
+                            days_per_chunk=DEFAULT_DAYS_PER_CHUNK, precision=None,
+                            compression_level=DEFAULT_COMPRESSION_LEVEL, shuffle=True):
+    """
+    Converte um pickle de previsões para o formato em blocos (ver write_chunked_forecast), com
+    a mesma normalização de colunas da leitura do pickle. 'output_path' padrão: o pickle com a
+    extensão CHUNKED_FORECAST_SUFFIX; 'precision' (ex: "float32") converte os campos.
+    Retorna o caminho gravado, ou None se o pickle não puder ser lido.
+    """
+    from processor import read_raw_model_pickle, PRECISION_DTYPES, NUM_DAYS_METRICS
+
+    output_path = output_path or os.path.splitext(pickle_path)[0] + CHUNKED_FORECAST_SUFFIX
+    print(f"Exportando {pickle_path} -> {output_path}")
+    df = read_raw_model_pickle(pickle_path)
+    if df is None or df.empty:
+        print(f"  ERRO: Nada a exportar de {pickle_path}.")
+        return None
+    start_time = time.perf_counter()
+    metadata = write_chunked_forecast(df, output_path, NUM_DAYS_METRICS, samples_per_chunk=samples_per_chunk,
+                                      days_per_chunk=days_per_chunk,
+                                      dtype=PRECISION_DTYPES[precision] if precision else None,
+                                      compression_level=compression_level, shuffle=shuffle, source_path=pickle_path,
+                                      consume=True)
+    pickle_mb, output_mb = os.path.getsize(pickle_path) / 1024**2, os.path.getsize(output_path) / 1024**2
+    print(f"  {metadata['n_samples']} amostras em blocos de {samples_per_chunk} amostra(s) x {days_per_chunk} dia(s): "
+          f"{pickle_mb:.1f} MB -> {output_mb:.1f} MB em {time.perf_counter() - start_time:.1f}s.")
+    return output_path
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Converte pickles de previsão para o formato em blocos comprimido.")
+    parser.add_argument("pickles", nargs="+", help="Arquivos .pkl de previsões.")
+    parser.add_argument("-o", "--output", default=None,
+                        help=f"Arquivo de saída (apenas com um pickle; padrão: <pickle>{CHUNKED_FORECAST_SUFFIX}).")
+    parser.add_argument("--samples-per-chunk", type=int, default=DEFAULT_SAMPLES_PER_CHUNK, help="Amostras por bloco.")
+    parser.add_argument("--days-per-chunk", type=int, default=DEFAULT_DAYS_PER_CHUNK, help="Dias de previsão por bloco.")
+    parser.add_argument("--precision", default=None, choices=["float32", "float64"],
+                        help="Tipo dos campos gravados (padrão: o do pickle).")
+    parser.add_argument("--compression-level", type=int, default=DEFAULT_COMPRESSION_LEVEL, choices=range(0, 10),
+                        metavar="0-9", help="Nível de compressão DEFLATE.")
+    parser.add_argument("--no-shuffle", action="store_true", help="Desativa o filtro de bytes 'shuffle' antes da compressão.")
+    args = parser.parse_args(argv)
+    if args.output and len(args.pickles) > 1:
+        parser.error("--output só pode ser usado com um único pickle.")
+    if args.samples_per_chunk < 1 or args.days_per_chunk < 1:
+        parser.error("--samples-per-chunk e --days-per-chunk devem ser >= 1.")
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    failures = 0
+    for pickle_path in args.pickles:
+        output_path = export_chunked_forecast(pickle_path, args.output, samples_per_chunk=args.samples_per_chunk,
+                                              days_per_chunk=args.days_per_chunk, precision=args.precision,
+                                              compression_level=args.compression_level, shuffle=not args.no_shuffle)
+        failures += output_path is None
+    return failures
+
+if __name__ == "__main__":
+    sys.exit(main())
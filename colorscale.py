@@ -0,0 +1,299 @@
+# colorscale.py
+import os
+import json
+from contextlib import contextmanager
+import numpy as np
+from forecast_cache import ForecastCache, writer_suffix
+from chunked_forecast import is_chunked_forecast
+from manifest import to_jsonable
+from processor import open_model_arrays, read_raw_model_pickle, DEFAULT_PRECISION
+from comparison import sample_dates
+from sample_fields import COLOR_PERCENTILES
+
+# Escala de cores (vmin/vmax dos campos real e previsto) comum a todas as tarefas do lote.
+# "sample" (padrão) mantém a escala de cada tarefa: percentis COLOR_PERCENTILES do campo real
+# da amostra visualizada (sample_fields.SampleFields). "batch" usa os mesmos percentis sobre
+# a verdade de campo de todas as datas do lote (cada data uma vez, compartilhada pelos modelos),
+# estimados com um sketch de quantis mesclável (QuantileSketch, erro relativo limitado): cada
+# arquivo é percorrido no máximo uma vez, em blocos, e seu sketch fica guardado em
+# <forecast_cache_dir>/COLOR_SKETCH_DIRNAME/<hash do conteúdo>.json.
+COLOR_SCALES = ("sample", "batch")
+DEFAULT_COLOR_SCALE = "sample"
+DEFAULT_SKETCH_RELATIVE_ACCURACY = 0.005 # Erro relativo máximo de cada quantil estimado
+SKETCH_MIN_INDEXABLE = 1e-9 # |valor| abaixo disso conta como zero
+COLOR_SKETCH_DIRNAME = "colorscale"
+COLOR_SKETCH_CHUNK_SIZE = 8 # Amostras por bloco ao percorrer os arrays do cache
+COLOR_SCALE_FILENAME = "escala_cores.json"
+
+class _BucketStore:
+    """Contagens densas (int64) dos índices de bucket [offset, offset + len(counts))."""
+
+    def __init__(self, offset=0, counts=None):
+        self.offset = int(offset)
+        self.counts = np.zeros(0, dtype=np.int64) if counts is None else np.asarray(counts, dtype=np.int64)
+
+    def add_counts(self, offset, counts):
+        if counts.size == 0:
+            return
+        if self.counts.size == 0:
+            self.offset, self.counts = int(offset), counts.astype(np.int64, copy=True)
+            return
+        start = min(self.offset, offset)
+        stop = max(self.offset + self.counts.size, offset + counts.size)
+        if start != self.offset or stop != self.offset + self.counts.size:
+            merged = np.zeros(stop - start, dtype=np.int64)
+            merged[self.offset - start:self.offset - start + self.counts.size] = self.counts
+            self.offset, self.counts = start, merged
+        self.counts[offset - start:offset - start + counts.size] += counts
+
+    def add_indices(self, indices):
+        if indices.size:
+            index_min = int(indices.min())
+            self.add_counts(index_min, np.bincount(indices - index_min))
+
+    def to_dict(self):
+        return {"offset": self.offset, "counts": self.counts.tolist()}
+
+class QuantileSketch:
+    """
+    Sketch de quantis mesclável com erro relativo limitado (no estilo do DDSketch): cada
+    valor cai no bucket ceil(log_gamma(|x|)), gamma = (1 + a) / (1 - a), com contagens
+    separadas para positivos, negativos e zeros. quantile() devolve o valor representativo
+    do bucket, a no máximo 'relative_accuracy' (a) do quantil exato. add() recebe blocos de
+    qualquer formato (não finitos são ignorados) e merge() soma as contagens de outro sketch
+    com a mesma precisão, então sketches por arquivo podem ser combinados em qualquer ordem.
+    """
+
+    def __init__(self, relative_accuracy=DEFAULT_SKETCH_RELATIVE_ACCURACY):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = np.log(self.gamma)
+        self.zero_count = 0
+        self.positive = _BucketStore()
+        self.negative = _BucketStore()
+
+    @property
+    def count(self):
+        return int(self.zero_count + self.positive.counts.sum() + self.negative.counts.sum())
+
+    def _indices(self, magnitudes):
+        return np.ceil(np.log(magnitudes) / self._log_gamma).astype(np.int64)
+
+    def _value(self, index):
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def add(self, values):
+        values = np.asarray(values).ravel()
+        values = values[np.isfinite(values)]
+        magnitudes = np.abs(values)
+        nonzero = magnitudes >= SKETCH_MIN_INDEXABLE
+        self.zero_count += int(values.size - np.count_nonzero(nonzero))
+        self.positive.add_indices(self._indices(magnitudes[nonzero & (values > 0)]))
+        self.negative.add_indices(self._indices(magnitudes[nonzero & (values < 0)]))
+
+    def merge(self, other):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError(f"Sketches com precisões diferentes ({self.relative_accuracy} e {other.relative_accuracy}).")
+        self.zero_count += other.zero_count
+        self.positive.add_counts(other.positive.offset, other.positive.counts)
+        self.negative.add_counts(other.negative.offset, other.negative.counts)
+        return self
+
+    def quantile(self, q):
+        """Quantil q (0 a 1) estimado; None se o sketch estiver vazio."""
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        # Ordem crescente: negativos (do maior |x| ao menor), zeros, positivos
+        negative_cumulative = np.cumsum(self.negative.counts[::-1])
+        negative_total = int(negative_cumulative[-1]) if negative_cumulative.size else 0
+        if rank < negative_total:
+            k = int(np.searchsorted(negative_cumulative, rank, side='right'))
+            return -float(self._value(self.negative.offset + self.negative.counts.size - 1 - k))
+        rank -= negative_total
+        if rank < self.zero_count or self.positive.counts.size == 0:
+            return 0.0
+        rank -= self.zero_count
+        positive_cumulative = np.cumsum(self.positive.counts)
+        k = min(int(np.searchsorted(positive_cumulative, rank, side='right')), self.positive.counts.size - 1)
+        return float(self._value(self.positive.offset + k))
+
+    def to_dict(self):
+        return {"relative_accuracy": self.relative_accuracy, "zero_count": self.zero_count,
+                "positive": self.positive.to_dict(), "negative": self.negative.to_dict()}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data["relative_accuracy"])
+        sketch.zero_count = int(data["zero_count"])
+        sketch.positive = _BucketStore(data["positive"]["offset"], data["positive"]["counts"])
+        sketch.negative = _BucketStore(data["negative"]["offset"], data["negative"]["counts"])
+        return sketch
+
+@contextmanager
+def open_truth_samples(file_path, cache_dir=None, precision=DEFAULT_PRECISION):
+    """
+    Gerenciador de contexto que fornece (datas, y_true) das amostras válidas de um arquivo, ou
+    None em caso de erro: 'datas' como em comparison.sample_dates (None sem coluna de data) e
+    y_true indexável por amostra. Com 'cache_dir', y_true são os memmaps do cache em disco
+    (populando-o, se preciso, para a própria tarefa); no formato em blocos (chunked_forecast.py),
+    só os blocos de 'y_rol' lidos são descomprimidos; sem cache, a lista das células do pickle.
+    """
+    if cache_dir or is_chunked_forecast(file_path):
+        with open_model_arrays(file_path, cache_dir, precision=precision) as opened:
+            if opened is None:
+                yield None
+            else:
+                frame, arrays = opened
+                yield sample_dates(frame), arrays['y_rol']
+        return
+
+    df = read_raw_model_pickle(file_path)
+    if df is None or df.empty:
+        yield None
+        return
+    valid_df = df.loc[df['y_rol'].notna() & df['y_rol_pred'].notna()]
+    del df
+    yield sample_dates(valid_df), list(valid_df['y_rol'])
+
+def build_truth_sketch(y_true, rows=None, relative_accuracy=DEFAULT_SKETCH_RELATIVE_ACCURACY):
+    """Sketch dos valores de y_true (de open_truth_samples) nas amostras 'rows' (padrão: todas), em blocos."""
+    sketch = QuantileSketch(relative_accuracy)
+    n_rows = len(y_true) if rows is None else len(rows)
+    for start in range(0, n_rows, COLOR_SKETCH_CHUNK_SIZE):
+        stop = min(start + COLOR_SKETCH_CHUNK_SIZE, n_rows)
+        if isinstance(y_true, list):
+            for row in (range(start, stop) if rows is None else rows[start:stop]):
+                sketch.add(y_true[row])
+        else:
+            sketch.add(y_true[start:stop] if rows is None else y_true[np.asarray(rows[start:stop])])
+    return sketch
+
+def file_sketch(file_path, y_true, cache_dir=None, precision=DEFAULT_PRECISION, relative_accuracy=DEFAULT_SKETCH_RELATIVE_ACCURACY):
+    """
+    Sketch de todas as amostras de um arquivo já aberto (y_true de open_truth_samples), reaproveitado
+    de <cache_dir>/COLOR_SKETCH_DIRNAME/<hash do conteúdo>.json quando existir (a precisão dos
+    campos não entra na chave: a diferença entre float32 e float64 fica muito abaixo do erro do
+    sketch). Sem 'cache_dir', é sempre recalculado.
+    """
+    sketch_path = None
+    if cache_dir:
+        content_hash = ForecastCache(cache_dir, precision=precision).content_hash(file_path)
+        sketch_path = os.path.join(cache_dir, COLOR_SKETCH_DIRNAME, f"{content_hash}.json")
+        try:
+            with open(sketch_path, 'r') as f:
+                sketch = QuantileSketch.from_dict(json.load(f))
+            if sketch.relative_accuracy == relative_accuracy:
+                print(f"    Sketch da escala de cores reaproveitado do cache: {sketch_path}")
+                return sketch
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError) as e:
+            print(f"    AVISO: Sketch em cache ilegível ({sketch_path}): {e}. Recalculando.")
+
+    sketch = build_truth_sketch(y_true, relative_accuracy=relative_accuracy)
+    if sketch_path is not None:
+        try:
+            os.makedirs(os.path.dirname(sketch_path), exist_ok=True)
+            tmp_path = f"{sketch_path}.tmp-{writer_suffix()}"
+            with open(tmp_path, 'w') as f:
+                json.dump(sketch.to_dict(), f)
+            os.replace(tmp_path, sketch_path)
+        except OSError as e:
+            print(f"    AVISO: Não foi possível gravar o sketch da escala de cores em {sketch_path}: {e}")
+    return sketch
+
+def _distinct_model_files(task_params_list):
+    """Tarefas com arquivos distintos (a primeira de cada arquivo), na ordem dada."""
+    distinct_tasks = {}
+    for task_params in task_params_list:
+        distinct_tasks.setdefault(os.path.abspath(task_params["model_file"]), task_params)
+    return distinct_tasks
+
+def compute_batch_color_scale(task_params_list, percentiles=COLOR_PERCENTILES,
+                              relative_accuracy=DEFAULT_SKETCH_RELATIVE_ACCURACY):
+    """
+    Escala de cores comum às tarefas: percentis 'percentiles' do campo real, pela mescla dos
+    sketches por arquivo. A verdade de campo é a mesma para todos os modelos avaliados contra as
+    mesmas observações, então cada data entra uma única vez: de cada arquivo, só as amostras de
+    datas ainda não vistas são lidas, e um arquivo sem datas novas não é percorrido.
+
+    Returns:
+    --------
+    dict or None
+        {'vmin', 'vmax', 'percentiles', 'n_values', 'relative_accuracy', 'task_ids', 'model_files'}
+        ('task_ids': tarefas cujos arquivos contribuíram; 'model_files': todos os arquivos
+        considerados) ou None se nenhum arquivo puder ser lido.
+    """
+    merged_sketch = QuantileSketch(relative_accuracy)
+    distinct_tasks = _distinct_model_files(task_params_list)
+    task_ids, seen_dates = [], set()
+    for task_params in distinct_tasks.values():
+        print(f"  Escala de cores: lendo '{task_params['task_id']}' ({task_params['model_file']})")
+        cache_dir = task_params.get("cache_dir")
+        precision = task_params.get("precision", DEFAULT_PRECISION)
+        try:
+            with open_truth_samples(task_params["model_file"], cache_dir=cache_dir, precision=precision) as opened:
+                if opened is None:
+                    continue
+                dates, y_true = opened
+                new_rows = None
+                if dates is not None:
+                    new_rows = [row for row, date in enumerate(dates) if date not in seen_dates]
+                    seen_dates.update(dates)
+                    if not new_rows:
+                        print(f"    Verdade de campo já incluída (mesmas datas de arquivos anteriores); arquivo não percorrido.")
+                        continue
+                if new_rows is None or len(new_rows) == len(y_true):
+                    sketch = file_sketch(task_params["model_file"], y_true, cache_dir=cache_dir, precision=precision,
+                                         relative_accuracy=relative_accuracy)
+                else:
+                    print(f"    {len(new_rows)} de {len(y_true)} amostra(s) com datas ainda não incluídas.")
+                    sketch = build_truth_sketch(y_true, rows=new_rows, relative_accuracy=relative_accuracy)
+        except Exception as e:
+            print(f"    AVISO: Falha ao calcular o sketch de '{task_params['task_id']}': {e}")
+            continue
+        if sketch.count == 0:
+            continue
+        merged_sketch.merge(sketch)
+        task_ids.append(task_params["task_id"])
+
+    if merged_sketch.count == 0:
+        print("  AVISO: Nenhum dado para a escala de cores comum; cada tarefa usará a escala da sua amostra.")
+        return None
+    vmin, vmax = (merged_sketch.quantile(percentile / 100) for percentile in percentiles)
+    return {"vmin": vmin, "vmax": vmax, "percentiles": list(percentiles), "n_values": merged_sketch.count,
+            "relative_accuracy": relative_accuracy, "task_ids": task_ids, "model_files": sorted(distinct_tasks)}
+
+def read_color_scale(reports_output_dir, task_params_list, percentiles=COLOR_PERCENTILES,
+                     relative_accuracy=DEFAULT_SKETCH_RELATIVE_ACCURACY, filename=COLOR_SCALE_FILENAME):
+    """
+    Escala de cores gravada por write_color_scale em uma execução anterior, se tiver sido calculada
+    sobre os mesmos arquivos e com os mesmos percentis e precisão; senão None. Não confere o
+    conteúdo dos arquivos: quem a reaproveita deve garantir que não mudaram (ver main.py).
+    """
+    report_path = os.path.join(reports_output_dir, filename)
+    try:
+        with open(report_path, 'r') as f:
+            color_scale = json.load(f)
+        vmin, vmax = float(color_scale["vmin"]), float(color_scale["vmax"])
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        print(f"  AVISO: Escala de cores gravada ilegível ({report_path}): {e}. Será recalculada.")
+        return None
+    if color_scale.get("model_files") != sorted(_distinct_model_files(task_params_list)) or \
+       color_scale.get("percentiles") != list(percentiles) or color_scale.get("relative_accuracy") != relative_accuracy:
+        return None
+    color_scale.update({"vmin": vmin, "vmax": vmax})
+    return color_scale
+
+def write_color_scale(color_scale, reports_output_dir, filename=COLOR_SCALE_FILENAME):
+    """Grava a escala de cores comum em JSON e a imprime. Retorna o caminho."""
+    report_path = os.path.join(reports_output_dir, filename)
+    with open(report_path, 'w') as f:
+        json.dump(to_jsonable(color_scale), f, indent=2)
+    low, high = color_scale["percentiles"]
+    print(f"  Escala de cores comum: vmin={color_scale['vmin']:.4g} (p{low:g}), vmax={color_scale['vmax']:.4g} (p{high:g}) "
+          f"sobre {color_scale['n_values']} valores de {len(color_scale['task_ids'])} tarefa(s). Salva em: {report_path}")
+    return report_path
@@ -0,0 +1,283 @@
+# comparison.py
+import os
+import json
+from contextlib import ExitStack
+from itertools import combinations
+import numpy as np
+import pandas as pd
+from metrics import _r2_from_sums, _iso_date
+from processor import open_model_arrays, read_raw_model_pickle, NUM_DAYS_METRICS
+from chunked_forecast import is_chunked_forecast
+from instrumentation import instrumented
+
+# Comparação entre modelos avaliados contra as mesmas observações: as amostras de cada .pkl
+# são alinhadas pela data, a verdade de campo (y_rol) é lida uma única vez (do primeiro
+# modelo) e as previsões de todos os modelos são avaliadas contra ela na mesma passada,
+# bloco a bloco, junto com as estatísticas pareadas entre modelos.
+# Cada bloco ocupa ~(modelos + 2) x chunk x 127440 x 7 x 8 bytes
+DEFAULT_COMPARISON_CHUNK_SIZE = 4
+COMPARISON_REPORT_FILENAME = "comparacao_modelos.json"
+TRUTH_CHECK_ATOL = 1e-6 # Tolerância ao conferir se os modelos compartilham a mesma verdade de campo
+MODEL_METRICS = ("mse", "rmse", "r2", "bias")
+PAIRWISE_METRICS = ("rmsd", "mad", "error_correlation", "rmse_diff_mean", "rmse_diff_std", "fraction_a_better", "fraction_b_better")
+
+def sample_dates(frame):
+    """Datas das amostras: coluna 'data' ou, na falta dela, 'dia_mes_ano' + 12h (como em read_raw_model_pickle)."""
+    if 'data' in frame.columns:
+        return pd.to_datetime(frame['data']).reset_index(drop=True)
+    if 'dia_mes_ano' in frame.columns:
+        return (pd.to_datetime(frame['dia_mes_ano']) + pd.Timedelta(hours=12)).reset_index(drop=True)
+    return None
+
+class _PickleColumn:
+    """
+    Células de uma coluna de campos ('y_rol'/'y_rol_pred') de um pickle lido sem cache, indexáveis
+    como o array (amostras, N, dias) do cache: cada índice de linhas empilha só as células pedidas.
+    """
+
+    def __init__(self, cells, num_days=NUM_DAYS_METRICS):
+        self.cells = cells
+        first_value = np.asarray(cells[0])
+        self.shape = (len(cells), first_value.size // num_days, num_days)
+
+    def __len__(self):
+        return len(self.cells)
+
+    def __getitem__(self, rows):
+        return np.stack([np.asarray(self.cells[row]).reshape(self.shape[1:]) for row in rows])
+
+def _read_pickle_columns(file_path, with_truth):
+    """
+    Lê um .pkl sem cache e retorna (frame só com as datas, {'y_rol_pred': ..., 'y_rol': ...}) das
+    amostras válidas, ou None. 'y_rol' só é mantida com with_truth=True (modelo de referência):
+    as demais colunas do pickle são liberadas assim que as células de interesse são separadas.
+    """
+    df = read_raw_model_pickle(file_path)
+    if df is None or df.empty:
+        return None
+    valid_df = df.loc[df['y_rol'].notna() & df['y_rol_pred'].notna()].reset_index(drop=True)
+    del df
+    if valid_df.empty:
+        return None
+    frame = valid_df[[col_name for col_name in ('data', 'dia_mes_ano') if col_name in valid_df.columns]]
+    col_names = ('y_rol_pred', 'y_rol') if with_truth else ('y_rol_pred',)
+    return frame, {col_name: _PickleColumn(list(valid_df[col_name])) for col_name in col_names}
+
+def align_model_samples(dates_by_model):
+    """
+    Alinha as amostras dos modelos pela data. 'dates_by_model' = {chave: Series de datas, na
+    ordem das linhas dos arrays}. Datas repetidas em um modelo mantêm a primeira ocorrência.
+    Retorna (datas comuns ordenadas, {chave: posições das linhas correspondentes}).
+    """
+    positions_by_date = {}
+    for model_key, dates in dates_by_model.items():
+        valid = dates.notna().to_numpy()
+        unique_dates = dates[valid].drop_duplicates(keep='first')
+        if len(unique_dates) < valid.sum():
+            print(f"    AVISO: {valid.sum() - len(unique_dates)} amostra(s) com data repetida em '{model_key}'; mantida a primeira ocorrência.")
+        positions_by_date[model_key] = pd.Series(unique_dates.index.to_numpy(), index=pd.DatetimeIndex(unique_dates))
+
+    common_dates = None
+    for positions in positions_by_date.values():
+        common_dates = positions.index if common_dates is None else common_dates.intersection(positions.index)
+    common_dates = common_dates.sort_values()
+    return common_dates, {model_key: positions.loc[common_dates].to_numpy()
+                          for model_key, positions in positions_by_date.items()}
+
+def _pairwise_summary(per_model, pair_sums, model_a, model_b):
+    """Estatísticas diárias de um par de modelos a partir das somas por amostra da passada."""
+    rmse_diff = per_model[model_a]["rmse"] - per_model[model_b]["rmse"] # (n, dias); negativo: 'a' melhor
+    return {
+        "model_a": model_a,
+        "model_b": model_b,
+        # Distância entre as previsões (média das amostras da raiz do desvio quadrático médio na grade)
+        "rmsd": np.mean(pair_sums["rmsd"], axis=0),
+        "mad": np.mean(pair_sums["mad"], axis=0),
+        # Correlação (não centrada) entre os campos de erro dos dois modelos
+        "error_correlation": np.nanmean(pair_sums["error_correlation"], axis=0),
+        "rmse_diff_mean": np.mean(rmse_diff, axis=0),
+        "rmse_diff_std": np.std(rmse_diff, axis=0, ddof=1) if len(rmse_diff) > 1 else np.zeros(rmse_diff.shape[1]),
+        "fraction_a_better": np.mean(rmse_diff < 0, axis=0),
+        "fraction_b_better": np.mean(rmse_diff > 0, axis=0),
+        "per_sample_rmsd": pair_sums["rmsd"]
+    }
+
+@instrumented()
+def compare_models(model_entries, chunk_size=DEFAULT_COMPARISON_CHUNK_SIZE, cache_dir=None):
+    """
+    Avalia vários modelos contra a verdade de campo compartilhada em uma única passada.
+
+    Parameters:
+    -----------
+    model_entries : list of dict
+        Um dict por modelo com 'task_id', 'model_type' e 'model_file' (e, opcionalmente,
+        'cache_dir'). A verdade de campo é lida do primeiro modelo; a dos demais é conferida
+        no primeiro bloco e, se diferir, um aviso é impresso.
+    chunk_size : int
+        Amostras (datas) por bloco.
+    cache_dir : str or None
+        Cache em disco (forecast_cache.py) de onde os arrays dos pickles são lidos como memmaps.
+        Arquivos no formato em blocos (chunked_forecast.py) são lidos diretamente. Um pickle sem
+        cache (nem 'cache_dir' próprio) é lido uma vez, mantendo só as datas e 'y_rol_pred' (e
+        'y_rol', se for o modelo de referência); as células são empilhadas bloco a bloco.
+
+    Returns:
+    --------
+    dict or None
+        {'models': [...], 'dates': [ISO], 'n_samples': n,
+         'per_model': {task_id: {'mse', 'rmse', 'r2', 'bias': (n, dias)}},
+         'daily': {task_id: {'mse', 'rmse', 'r2', 'bias': (dias,)}},
+         'pairwise': [{'model_a', 'model_b', 'rmsd', 'mad', 'error_correlation',
+                       'rmse_diff_mean', 'rmse_diff_std', 'fraction_a_better',
+                       'fraction_b_better': (dias,),
+                       'per_sample_rmsd': (n, dias)}, ...]}
+        ou None se menos de dois modelos tiverem amostras em comum.
+    """
+    open_files = ExitStack() # Mantém abertos os arquivos em blocos até o fim da comparação
+    try:
+        opened_models = {}
+        dates_by_model = {}
+        for entry in model_entries:
+            model_key = entry["task_id"]
+            model_cache_dir = entry.get("cache_dir") or cache_dir
+            if model_cache_dir or is_chunked_forecast(entry["model_file"]):
+                print(f"  Abrindo arrays de '{model_key}' ({entry['model_type']}): {entry['model_file']}")
+                opened = open_files.enter_context(open_model_arrays(entry["model_file"], model_cache_dir))
+            else:
+                print(f"  Lendo '{model_key}' ({entry['model_type']}) do pickle, sem cache: {entry['model_file']}")
+                opened = _read_pickle_columns(entry["model_file"], with_truth=not opened_models)
+            if opened is None:
+                print(f"    AVISO: '{model_key}' sem dados válidos; fora da comparação.")
+                continue
+            frame, arrays = opened
+            dates = sample_dates(frame)
+            if dates is None or 'y_rol_pred' not in arrays or (not opened_models and 'y_rol' not in arrays):
+                print(f"    AVISO: '{model_key}' sem datas ou sem arrays y_rol/y_rol_pred; fora da comparação.")
+                continue
+            opened_models[model_key] = (entry, frame, arrays)
+            dates_by_model[model_key] = dates
+
+        if len(opened_models) < 2:
+            print("  AVISO: São necessários ao menos dois modelos válidos para a comparação.")
+            return None
+
+        common_dates, rows_by_model = align_model_samples(dates_by_model)
+        model_keys = list(opened_models)
+        n_samples = len(common_dates)
+        for model_key in model_keys:
+            total = len(dates_by_model[model_key])
+            if total != n_samples:
+                print(f"    '{model_key}': {n_samples} de {total} amostra(s) com data comum aos demais modelos.")
+        if n_samples == 0:
+            print("  AVISO: Nenhuma data em comum entre os modelos; comparação não realizada.")
+            return None
+
+        reference_key = model_keys[0]
+        y_true_all = opened_models[reference_key][2]['y_rol']
+        num_points, num_days = y_true_all.shape[1], y_true_all.shape[2]
+        for model_key in model_keys[1:]:
+            pred_shape = opened_models[model_key][2]['y_rol_pred'].shape[1:]
+            if pred_shape != (num_points, num_days):
+                print(f"  ERRO: Previsões de '{model_key}' com formato {pred_shape}, esperado {(num_points, num_days)}.")
+                return None
+        print(f"  Comparando {len(model_keys)} modelos em {n_samples} data(s) comuns (verdade de campo de '{reference_key}').")
+
+        num_models = len(model_keys)
+        block_size = min(chunk_size, n_samples)
+        y_true = np.empty((block_size, num_points, num_days))
+        residuals = np.empty((num_models, block_size, num_points, num_days)) # Previsões e, depois, erros
+        pair_buffer = np.empty((block_size, num_points, num_days))
+        model_pairs = list(combinations(range(num_models), 2))
+
+        sums = {metric: np.empty((num_models, n_samples, num_days)) for metric in ("ss_res", "bias")}
+        ss_tot = np.empty((n_samples, num_days))
+        pair_sums = {pair: {metric: np.empty((n_samples, num_days)) for metric in ("rmsd", "mad", "error_correlation")}
+                     for pair in model_pairs}
+
+        for start in range(0, n_samples, block_size):
+            stop = min(start + block_size, n_samples)
+            count = stop - start
+            truth_block = y_true[:count]
+            truth_block[:] = y_true_all[rows_by_model[reference_key][start:stop]]
+            if start == 0:
+                for model_key in model_keys[1:]:
+                    if 'y_rol' not in opened_models[model_key][2]:
+                        continue # Pickle sem cache: só as previsões foram mantidas
+                    other_truth = opened_models[model_key][2]['y_rol'][rows_by_model[model_key][start:stop]]
+                    if not np.allclose(other_truth, truth_block, atol=TRUTH_CHECK_ATOL, equal_nan=True):
+                        print(f"  AVISO: A verdade de campo de '{model_key}' difere da de '{reference_key}' nas mesmas datas; "
+                              f"todos os modelos são avaliados contra a de '{reference_key}'.")
+                    del other_truth
+
+            block_residuals = residuals[:, :count]
+            for model_idx, model_key in enumerate(model_keys):
+                block_residuals[model_idx] = opened_models[model_key][2]['y_rol_pred'][rows_by_model[model_key][start:stop]]
+            block_residuals -= truth_block[np.newaxis]
+
+            sums["ss_res"][:, start:stop] = np.einsum('mcnd,mcnd->mcd', block_residuals, block_residuals)
+            sums["bias"][:, start:stop] = block_residuals.sum(axis=2) / num_points
+            deviations = pair_buffer[:count]
+            np.subtract(truth_block, truth_block.mean(axis=1, keepdims=True), out=deviations)
+            ss_tot[start:stop] = np.einsum('cnd,cnd->cd', deviations, deviations)
+
+            for model_a, model_b in model_pairs:
+                # Diferença entre as previsões = diferença entre os erros
+                np.subtract(block_residuals[model_a], block_residuals[model_b], out=deviations)
+                sq_diff = np.einsum('cnd,cnd->cd', deviations, deviations)
+                pair_sums[(model_a, model_b)]["rmsd"][start:stop] = np.sqrt(sq_diff / num_points)
+                np.abs(deviations, out=deviations)
+                pair_sums[(model_a, model_b)]["mad"][start:stop] = deviations.sum(axis=1) / num_points
+                # sum(ea*eb) = (sum(ea²) + sum(eb²) - sum((ea-eb)²)) / 2
+                ss_a, ss_b = sums["ss_res"][model_a, start:stop], sums["ss_res"][model_b, start:stop]
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    pair_sums[(model_a, model_b)]["error_correlation"][start:stop] = \
+                        (ss_a + ss_b - sq_diff) / (2.0 * np.sqrt(ss_a * ss_b))
+
+        per_model = {}
+        for model_idx, model_key in enumerate(model_keys):
+            mse = sums["ss_res"][model_idx] / num_points
+            per_model[model_key] = {"mse": mse, "rmse": np.sqrt(mse), "r2": _r2_from_sums(sums["ss_res"][model_idx], ss_tot),
+                                    "bias": sums["bias"][model_idx]}
+
+        return {
+            "models": [{"task_id": model_key, "model_type": opened_models[model_key][0]["model_type"],
+                        "model_file": opened_models[model_key][0]["model_file"],
+                        "n_samples_total": len(dates_by_model[model_key])} for model_key in model_keys],
+            "reference_model": reference_key,
+            "dates": [_iso_date(value) for value in common_dates],
+            "n_samples": n_samples,
+            "per_model": per_model,
+            "daily": {model_key: {metric: np.mean(values, axis=0) for metric, values in metrics.items()}
+                      for model_key, metrics in per_model.items()},
+            "pairwise": [_pairwise_summary(per_model, pair_sums[(model_a, model_b)], model_keys[model_a], model_keys[model_b])
+                         for model_a, model_b in model_pairs]
+        }
+    finally:
+        open_files.close()
+
+def write_comparison_report(comparison, reports_output_dir, filename=COMPARISON_REPORT_FILENAME):
+    """
+    Grava o resumo da comparação em JSON (métricas diárias por modelo e estatísticas
+    pareadas, sem os arrays por amostra) e imprime a média dos dias por par. Retorna o caminho.
+    """
+    report = {
+        "models": comparison["models"],
+        "reference_model": comparison["reference_model"],
+        "n_samples": comparison["n_samples"],
+        "dates": comparison["dates"],
+        "daily": {model_key: {metric: np.asarray(values).tolist() for metric, values in metrics.items()}
+                  for model_key, metrics in comparison["daily"].items()},
+        "pairwise": [{key: (np.asarray(value).tolist() if key in PAIRWISE_METRICS else value)
+                      for key, value in pair.items() if key != "per_sample_rmsd"}
+                     for pair in comparison["pairwise"]]
+    }
+    report_path = os.path.join(reports_output_dir, filename)
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(f"  Comparação entre modelos salva em: {report_path}")
+    for pair in comparison["pairwise"]:
+        print(f"    {pair['model_a']} x {pair['model_b']}: RMSD entre previsões {np.mean(pair['rmsd']):.4f}, "
+              f"dif. de RMSE {np.mean(pair['rmse_diff_mean']):+.4f}, "
+              f"'{pair['model_a']}' melhor em {100 * np.mean(pair['fraction_a_better']):.0f}% das amostras/dias")
+    return report_path
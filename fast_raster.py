@@ -0,0 +1,317 @@
+# fast_raster.py
+from datetime import timedelta
+from functools import lru_cache
+import numpy as np
+import matplotlib
+from matplotlib import font_manager
+from PIL import Image, ImageDraw, ImageFont
+from visualizer import NUM_DAYS_METRICS, SPATIAL_ERROR_COLUMNS, get_basemap_layers, get_grid_extent, spatial_error_scales
+from instrumentation import instrumented
+from sample_fields import resolve_sample_fields
+from animation_writers import DEFAULT_ANIMATION_FORMAT, DEFAULT_FRAME_DURATION_MS, animation_path, open_animation_writer
+
+# Renderizador "fast_raster": a grade lat/lon é regular e o eixo é PlateCarree, então a
+# projeção do cartopy é a identidade. Cada campo vira diretamente uma imagem RGB (LUT do
+# colormap + normalização vmin/vmax em NumPy), composta sobre as camadas de terra e
+# costa/fronteiras já rasterizadas (visualizer.get_basemap_layers) e gravada pelo Pillow.
+GIF_CELL_PIXELS = 2 # Pixels por célula (na direção da longitude) em cada frame do GIF
+GRID_CELL_PIXELS = 1 # Pixels por célula (na direção da longitude) em cada painel do grid
+BASEMAP_DPI = 100 # dpi usado ao rasterizar costa/fronteiras (define a espessura das linhas)
+LUT_SIZE = 256 # Número de cores das LUTs (como os colormaps do matplotlib)
+BACKGROUND_RGB = (255, 255, 255)
+TEXT_RGB = (0, 0, 0)
+COLORBAR_WIDTH = 18
+COLORBAR_TICKS = 5
+
+@lru_cache(maxsize=None)
+def colormap_lut(cmap_name, n_colors=LUT_SIZE):
+    """LUT (n_colors, 3) uint8 do colormap do matplotlib 'cmap_name'."""
+    cmap = matplotlib.colormaps[cmap_name].resampled(n_colors)
+    return np.round(cmap(np.arange(n_colors))[:, :3] * 255).astype(np.uint8)
+
+def apply_colormap(field, cmap_name, vmin, vmax):
+    """
+    Converte um campo 2D em RGB uint8 com a mesma regra do matplotlib (Normalize + índice
+    int(x * N), valores fora de [vmin, vmax] saturam nas cores extremas).
+    Retorna (rgb, valid), com 'valid' = máscara dos pontos finitos.
+    """
+    lut = colormap_lut(cmap_name)
+    valid = np.isfinite(field)
+    scale = len(lut) / (vmax - vmin) if vmax > vmin else 0.0
+    with np.errstate(invalid='ignore'):
+        lut_index = np.where(valid, (field - vmin) * scale, 0.0)
+    lut_index = np.clip(lut_index, 0, len(lut) - 1).astype(np.intp)
+    return lut[lut_index], valid
+
+def _orient_north_up(field, lat, lon):
+    """Reordena o campo para linhas de norte a sul e colunas de oeste a leste (como o fundo)."""
+    if lat[0, 0] < lat[-1, 0]:
+        field = field[::-1]
+    if lon[0, 0] > lon[0, -1]:
+        field = field[:, ::-1]
+    return field
+
+@lru_cache(maxsize=None)
+def _basemap_overlays(style, extent, width_px, height_px):
+    """
+    Pré-calcula, por estilo/extensão/tamanho, o fundo (branco + terra) em RGB e a camada de
+    costa/fronteiras como (alfa, cor pré-multiplicada), prontos para compor cada painel.
+    """
+    land_layer, lines_layer = get_basemap_layers(style, extent, width_px, height_px, BASEMAP_DPI)
+    if land_layer.shape[:2] != (height_px, width_px): # Arredondamento do tamanho da figura
+        land_layer = np.array(Image.fromarray(land_layer).resize((width_px, height_px), Image.NEAREST))
+        lines_layer = np.array(Image.fromarray(lines_layer).resize((width_px, height_px), Image.NEAREST))
+
+    land_alpha = land_layer[..., 3:4].astype(np.float32) / 255
+    background = np.array(BACKGROUND_RGB, dtype=np.float32) * (1 - land_alpha) + land_layer[..., :3] * land_alpha
+    lines_alpha = lines_layer[..., 3:4].astype(np.float32) / 255
+    lines_premultiplied = lines_layer[..., :3].astype(np.float32) * lines_alpha
+    return background.astype(np.uint8), lines_alpha, lines_premultiplied
+
+def panel_size(lat, lon, cell_pixels):
+    """
+    Tamanho (largura, altura) em pixels de um painel: cell_pixels por célula na direção da
+    longitude e altura com a mesma razão graus/pixel (aspecto igual do eixo PlateCarree).
+    """
+    lon_min, lon_max, lat_min, lat_max = get_grid_extent(lon, lat)
+    width_px = lon.shape[1] * cell_pixels
+    return width_px, max(1, int(round(width_px * (lat_max - lat_min) / (lon_max - lon_min))))
+
+@lru_cache(maxsize=None)
+def _resample_index(n_cells, n_pixels):
+    """Índice da célula (vizinho mais próximo) de cada pixel ao longo de um eixo."""
+    return (np.arange(n_pixels) * n_cells // n_pixels).astype(np.intp)
+
+def render_field_panel(field, lat, lon, cmap_name, vmin, vmax, style, cell_pixels):
+    """
+    Renderiza um campo da grade como imagem RGB uint8 (altura, largura, 3): cores do campo
+    nos pontos finitos, terra/fundo nos demais e costa/fronteiras por cima.
+    """
+    extent = get_grid_extent(lon, lat)
+    width_px, height_px = panel_size(lat, lon, cell_pixels)
+    rgb, valid = apply_colormap(_orient_north_up(field, lat, lon), cmap_name, vmin, vmax)
+    rows = _resample_index(field.shape[0], height_px)[:, None]
+    cols = _resample_index(field.shape[1], width_px)[None, :]
+    rgb, valid = rgb[rows, cols], valid[rows, cols]
+
+    background, lines_alpha, lines_premultiplied = _basemap_overlays(style, extent, width_px, height_px)
+    panel = np.where(valid[..., None], rgb, background)
+    return (panel * (1 - lines_alpha) + lines_premultiplied).astype(np.uint8)
+
+@lru_cache(maxsize=None)
+def _font(size):
+    """Fonte padrão do matplotlib (DejaVu Sans, com acentos) no tamanho dado em pixels."""
+    try:
+        return ImageFont.truetype(font_manager.findfont(font_manager.FontProperties()), size)
+    except Exception:
+        return ImageFont.load_default()
+
+def _draw_centered_text(draw, center_x, top_y, text, font):
+    """Escreve um texto (possivelmente multilinha) centralizado horizontalmente em center_x."""
+    left, _, right, _ = draw.multiline_textbbox((0, 0), text, font=font)
+    draw.multiline_text((center_x - (right - left) / 2, top_y), text, fill=TEXT_RGB, font=font, align="center")
+
+def _text_bbox(text, font):
+    return ImageDraw.Draw(Image.new("RGB", (1, 1))).multiline_textbbox((0, 0), text, font=font)
+
+def _text_width(text, font):
+    left, _, right, _ = _text_bbox(text, font)
+    return right - left
+
+def _text_height(text, font):
+    return _text_bbox(text, font)[3]
+
+def _colorbar_ticks(vmin, vmax):
+    """Valores e rótulos dos COLORBAR_TICKS marcadores da colorbar."""
+    tick_values = np.linspace(vmin, vmax, COLORBAR_TICKS)
+    return tick_values, [f"{tick_value:.3g}" for tick_value in tick_values]
+
+def colorbar_width(vmin, vmax, label, font):
+    """Largura total ocupada por _draw_colorbar (barra, marcadores, rótulos e título girado)."""
+    _, tick_labels = _colorbar_ticks(vmin, vmax)
+    max_tick_width = max(_text_width(tick_text, font) for tick_text in tick_labels)
+    return COLORBAR_WIDTH + 6 + max_tick_width + 6 + _text_height(label, font) + 2 + 12
+
+def _draw_colorbar(image, x, y, height, cmap_name, vmin, vmax, label, font):
+    """Desenha uma colorbar vertical com COLORBAR_TICKS rótulos e o título 'label' girado."""
+    lut = colormap_lut(cmap_name)
+    gradient = lut[np.linspace(len(lut) - 1, 0, height).astype(np.intp)]
+    image.paste(Image.fromarray(np.repeat(gradient[:, None, :], COLORBAR_WIDTH, axis=1)), (x, y))
+    draw = ImageDraw.Draw(image)
+    draw.rectangle([x, y, x + COLORBAR_WIDTH - 1, y + height - 1], outline=TEXT_RGB)
+
+    label_x = x + COLORBAR_WIDTH + 6
+    tick_values, tick_labels = _colorbar_ticks(vmin, vmax)
+    for tick_text, tick_y in zip(tick_labels, np.linspace(y + height - 1, y, len(tick_values))):
+        draw.line([x + COLORBAR_WIDTH, tick_y, x + COLORBAR_WIDTH + 3, tick_y], fill=TEXT_RGB)
+        _, top, _, bottom = draw.textbbox((0, 0), tick_text, font=font)
+        draw.text((label_x, tick_y - (bottom + top) / 2), tick_text, fill=TEXT_RGB, font=font)
+    max_tick_width = max(_text_width(tick_text, font) for tick_text in tick_labels)
+
+    left, _, right, bottom = draw.textbbox((0, 0), label, font=font)
+    label_image = Image.new("RGB", (right - left + 2, bottom + 2), BACKGROUND_RGB)
+    ImageDraw.Draw(label_image).text((-left + 1, 0), label, fill=TEXT_RGB, font=font)
+    label_image = label_image.rotate(90, expand=True)
+    image.paste(label_image, (label_x + max_tick_width + 6, y + (height - label_image.height) // 2))
+
+@instrumented()
+def write_forecast_gif(df_single_row, output_path_base, prefix="", pos=0, hour=24, day_to_highlight=0,
+                       sample_fields=None, animation_format=DEFAULT_ANIMATION_FORMAT):
+    """
+    Equivalente rápido de visualizer.get_gif_forecasting (mesma assinatura, mesmo nome de
+    arquivo e mesmos títulos), sem matplotlib/cartopy por frame. Cada frame vai para o
+    writer de 'animation_format' assim que é montado.
+    """
+    fields = resolve_sample_fields(df_single_row, pos, sample_fields)
+    lon = fields.lon
+    lat = fields.lat
+    if lon is None or lat is None:
+        print(f"    Erro ao salvar GIF {output_path_base}: Dados de lon/lat ausentes.")
+        return None
+    shape = lon.shape
+
+    if prefix == '_diff':
+        kind, cmap_name, vmin, vmax = 'diff', 'coolwarm', -2, 2
+        title_prefix_str = 'Diferença Abs.'
+    else:
+        kind, cmap_name = ('pred', 'jet') if prefix == '_pred' else ('real', 'jet')
+        vmin, vmax = fields.vmin, fields.vmax
+        if fields.real is None:
+            print("Aviso em write_forecast_gif: y_rol é None ou vazio. Usando vmin/vmax padrão.")
+        title_prefix_str = 'Previsão' if prefix == '_pred' else 'Real'
+
+    title_font, tick_font = _font(14), _font(11)
+    panel_w, panel_h = panel_size(lat, lon, GIF_CELL_PIXELS)
+    margin = 20
+    title_h = _text_height("Ag\nAg", title_font) + 12
+    frame_size = (margin + panel_w + margin + colorbar_width(vmin, vmax, 'Intensidade', tick_font), title_h + panel_h + margin)
+    colorbar_h = int(panel_h * 0.8)
+
+    gif_file = animation_path(output_path_base, hour, animation_format)
+    writer = open_animation_writer(gif_file, animation_format, duration_ms=DEFAULT_FRAME_DURATION_MS)
+    for frame_idx in range(NUM_DAYS_METRICS):
+        frame = Image.new("RGB", frame_size, BACKGROUND_RGB)
+        draw = ImageDraw.Draw(frame)
+        field = fields.field(kind, frame_idx)
+        if field is None:
+            field = np.full(shape, np.nan)
+            col_label = 'diff' if prefix == '_diff' else f'y_rol{prefix}'
+            title = f'Erro: Dados ausentes para {col_label} (Frame {frame_idx+1})'
+        elif fields.date is not None:
+            frame_date_str = (fields.date + timedelta(hours=hour * frame_idx)).strftime("%Y-%m-%d %H:%M:%S")
+            title_highlight = " (Dia Principal)" if frame_idx == day_to_highlight else ""
+            title = f'{title_prefix_str}, Dia {frame_idx+1}{title_highlight}\n{frame_date_str}'
+        else:
+            title = f'Erro: Data base ausente (Frame {frame_idx+1})'
+
+        frame.paste(Image.fromarray(render_field_panel(field, lat, lon, cmap_name, vmin, vmax, "gif", GIF_CELL_PIXELS)),
+                    (margin, title_h))
+        draw.rectangle([margin - 1, title_h - 1, margin + panel_w, title_h + panel_h], outline=TEXT_RGB)
+        _draw_centered_text(draw, margin + panel_w / 2, 6, title, title_font)
+        _draw_colorbar(frame, margin + panel_w + margin, title_h + (panel_h - colorbar_h) // 2, colorbar_h,
+                       cmap_name, vmin, vmax, 'Intensidade', tick_font)
+        writer.add_frame(frame)
+
+    try:
+        writer.close()
+        print(f"    GIF salvo: {gif_file}")
+    except Exception as e:
+        print(f"    Erro ao salvar GIF {gif_file}: {e}")
+    return gif_file
+
+@instrumented()
+def write_forecast_grid(df_single_row, rows, cols, pos, prefix, output_path, vmin=None, vmax=None, hour=24, day_to_highlight=0,
+                        sample_fields=None):
+    """
+    Equivalente rápido de visualizer.plot_images_in_grid (mesma assinatura e layout: uma
+    linha por dia, colunas Real/Previsão/Diferença Abs., colorbar do campo à direita).
+    """
+    num_days_to_plot_in_grid = min(rows, NUM_DAYS_METRICS)
+    fields = resolve_sample_fields(df_single_row, pos, sample_fields)
+    lon = fields.lon
+    lat = fields.lat
+    if lon is None or lat is None:
+        print("    Aviso: Dados de lon/lat ausentes para write_forecast_grid. Grid não gerado.")
+        return None
+
+    vmin = vmin if vmin is not None else fields.vmin
+    vmax = vmax if vmax is not None else fields.vmax
+
+    column_config = [('real', 'Real'), ('pred', 'Previsão'), ('diff', 'Diferença Abs.')][:cols]
+    suptitle_font, title_font, tick_font = _font(22), _font(12), _font(11)
+    panel_w, panel_h = panel_size(lat, lon, GRID_CELL_PIXELS)
+    gap = 16
+    suptitle_h = _text_height("Ag", suptitle_font) + 20
+    title_h = _text_height("Ag\nAg", title_font) + 8
+    cell_w, cell_h = panel_w + gap, title_h + panel_h + gap
+    grid_w = gap + cell_w * len(column_config)
+    image = Image.new("RGB", (grid_w + colorbar_width(vmin, vmax, 'Intensidade', tick_font), suptitle_h + cell_h * num_days_to_plot_in_grid), BACKGROUND_RGB)
+    draw = ImageDraw.Draw(image)
+
+    for i_day in range(num_days_to_plot_in_grid):
+        if fields.date is not None:
+            plot_date_str = (fields.date + timedelta(hours=hour * i_day)).strftime("%Y-%m-%d %H:%M")
+        else:
+            plot_date_str = "Data N/A"
+        title_highlight_str = " (Dia Destaque)" if i_day == day_to_highlight else ""
+        for j_type, (kind, title_part_str) in enumerate(column_config):
+            x0 = gap + j_type * cell_w
+            y0 = suptitle_h + i_day * cell_h
+            field = fields.field(kind, i_day)
+            if field is not None:
+                cmap_name, panel_vmin, panel_vmax = ('coolwarm', -2, 2) if kind == 'diff' else ('jet', vmin, vmax)
+                panel = render_field_panel(field, lat, lon, cmap_name, panel_vmin, panel_vmax, "grid", GRID_CELL_PIXELS)
+                image.paste(Image.fromarray(panel), (x0, y0 + title_h))
+            else:
+                _draw_centered_text(draw, x0 + panel_w / 2, y0 + title_h + panel_h / 2, 'Dados Indisp.', tick_font)
+            draw.rectangle([x0 - 1, y0 + title_h - 1, x0 + panel_w, y0 + title_h + panel_h], outline=TEXT_RGB)
+            _draw_centered_text(draw, x0 + panel_w / 2, y0, f'{title_part_str}, Dia {i_day+1}{title_highlight_str}\n{plot_date_str}', title_font)
+
+    colorbar_h = int((image.height - suptitle_h) * 0.7)
+    _draw_colorbar(image, grid_w, suptitle_h + (image.height - suptitle_h - colorbar_h) // 2, colorbar_h,
+                   'jet', vmin, vmax, 'Intensidade', tick_font)
+    _draw_centered_text(draw, image.width / 2, 8, f'Comparativo Diário - {prefix} (Dia Destaque: {day_to_highlight+1})', suptitle_font)
+
+    image.save(output_path)
+    print(f"    Grid de imagens salvo: {output_path}")
+    return output_path
+
+@instrumented()
+def write_spatial_error_grid(error_maps, lat, lon, model_type, output_path):
+    """
+    Equivalente rápido de visualizer.plot_spatial_error_maps (mesmo layout: uma linha por dia,
+    colunas viés/MAE/RMSE, colorbars do viés e de MAE/RMSE à direita).
+    """
+    num_days = min(error_maps['bias'].shape[0], NUM_DAYS_METRICS)
+    bias_limit, error_vmax = spatial_error_scales(error_maps)
+    suptitle_font, title_font, tick_font = _font(22), _font(12), _font(11)
+    panel_w, panel_h = panel_size(lat, lon, GRID_CELL_PIXELS)
+    gap = 16
+    suptitle_h = _text_height("Ag", suptitle_font) + 20
+    title_h = _text_height("Ag", title_font) + 8
+    cell_w, cell_h = panel_w + gap, title_h + panel_h + gap
+    grid_w = gap + cell_w * len(SPATIAL_ERROR_COLUMNS)
+    colorbars = [("coolwarm", -bias_limit, bias_limit, 'Viés'), ("viridis", 0, error_vmax, 'MAE / RMSE')]
+    colorbars_w = max(colorbar_width(cbar_vmin, cbar_vmax, cbar_label, tick_font) for _, cbar_vmin, cbar_vmax, cbar_label in colorbars)
+    image = Image.new("RGB", (grid_w + colorbars_w, suptitle_h + cell_h * num_days), BACKGROUND_RGB)
+    draw = ImageDraw.Draw(image)
+
+    for i_day in range(num_days):
+        for j_type, (map_key, title_part_str, cmap_name) in enumerate(SPATIAL_ERROR_COLUMNS):
+            x0 = gap + j_type * cell_w
+            y0 = suptitle_h + i_day * cell_h
+            panel_vmin, panel_vmax = (-bias_limit, bias_limit) if map_key == "bias" else (0, error_vmax)
+            panel = render_field_panel(error_maps[map_key][i_day], lat, lon, cmap_name, panel_vmin, panel_vmax, "grid", GRID_CELL_PIXELS)
+            image.paste(Image.fromarray(panel), (x0, y0 + title_h))
+            draw.rectangle([x0 - 1, y0 + title_h - 1, x0 + panel_w, y0 + title_h + panel_h], outline=TEXT_RGB)
+            _draw_centered_text(draw, x0 + panel_w / 2, y0, f'{title_part_str}, Dia {i_day+1}', title_font)
+
+    colorbar_h = int((image.height - suptitle_h) * 0.3)
+    for cbar_idx, (cmap_name, cbar_vmin, cbar_vmax, cbar_label) in enumerate(colorbars):
+        cbar_y = suptitle_h + (image.height - suptitle_h) * (0.15 + 0.5 * cbar_idx)
+        _draw_colorbar(image, grid_w, int(cbar_y), colorbar_h, cmap_name, cbar_vmin, cbar_vmax, cbar_label, tick_font)
+    _draw_centered_text(draw, image.width / 2, 8, f'Erro por Ponto de Grade - {model_type} ({error_maps["count"]} amostras)', suptitle_font)
+
+    image.save(output_path)
+    print(f"    Mapas de erro espacial salvos: {output_path}")
+    return output_path
@@ -0,0 +1,207 @@
+# forecast_cache.py
+import os
+import json
+import shutil
+import hashlib
+import threading
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+# Versão do layout em disco; entradas com outra versão são ignoradas (recalculadas).
+CACHE_FORMAT_VERSION = 1
+# Colunas armazenadas como blocos contíguos (n_amostras, ...) em arquivos .npy
+CACHED_ARRAY_COLUMNS = ['y_rol', 'y_rol_pred', 'lat', 'lon']
+METADATA_FILENAME = "meta.json"
+FRAME_FILENAME = "frame.pkl" # Demais colunas (datas, ids), tipicamente poucos KB
+HASH_BLOCK_SIZE = 8 * 1024 * 1024
+
+def file_content_hash(file_path, block_size=HASH_BLOCK_SIZE):
+    """Calcula o hash BLAKE2b (hex) do conteúdo de um arquivo, lendo em blocos."""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def writer_suffix():
+    """Sufixo dos temporários: processo e thread (o executor em pipeline lê tarefas em threads)."""
+    return f"{os.getpid()}-{threading.get_ident()}"
+
+def _stat_key(file_path):
+    """Chave barata (caminho absoluto, tamanho, mtime) usada para evitar re-hash do arquivo."""
+    stat = os.stat(file_path)
+    raw_key = f"{os.path.abspath(file_path)}|{stat.st_size}|{stat.st_mtime_ns}"
+    return hashlib.blake2b(raw_key.encode('utf-8'), digest_size=16).hexdigest(), stat
+
+class ForecastCache:
+    """
+    Cache em disco, endereçado por conteúdo, dos arrays já redimensionados de um
+    arquivo .pkl de previsões. Cada entrada é um diretório <hash_do_conteúdo>/ com
+    um .npy contíguo por coluna de arrays (reabertos com np.load(mmap_mode='r')),
+    as demais colunas em FRAME_FILENAME e um sidecar METADATA_FILENAME.
+    O índice stat/<chave>.json mapeia (caminho, tamanho, mtime) para o hash, de modo
+    que arquivos inalterados não precisem ser relidos nem para calcular o hash.
+    Com 'precision' diferente de "float64", a entrada é <hash_do_conteúdo>-<precisão>/,
+    com os campos gravados nessa precisão (processor.PRECISION_DTYPES).
+    Colunas em que todas as amostras apontam para o mesmo array (a grade lat/lon
+    canônica, ver grid_registry.py) são gravadas uma única vez ("shared" nos metadados).
+    """
+
+    def __init__(self, cache_dir, precision="float64"):
+        self.cache_dir = cache_dir
+        self.entry_suffix = "" if precision in (None, "float64") else f"-{precision}"
+        self.stat_index_dir = os.path.join(cache_dir, "stat")
+        os.makedirs(self.stat_index_dir, exist_ok=True)
+        self._content_hashes = {} # Hashes já calculados nesta execução, por chave stat
+
+    def _entry_dir(self, content_hash):
+        return os.path.join(self.cache_dir, content_hash + self.entry_suffix)
+
+    def _read_metadata(self, content_hash):
+        metadata_path = os.path.join(self._entry_dir(content_hash), METADATA_FILENAME)
+        try:
+            with open(metadata_path, 'r') as f:
+                metadata = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if metadata.get("format_version") != CACHE_FORMAT_VERSION:
+            return None
+        return metadata
+
+    def content_hash(self, file_path):
+        """Retorna o hash do conteúdo de file_path, consultando o índice stat antes de reler o arquivo."""
+        stat_key, stat = _stat_key(file_path)
+        if stat_key in self._content_hashes:
+            return self._content_hashes[stat_key]
+
+        stat_index_path = os.path.join(self.stat_index_dir, f"{stat_key}.json")
+        content_hash = None
+        try:
+            with open(stat_index_path, 'r') as f:
+                content_hash = json.load(f).get("content_hash")
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+
+        if content_hash is None:
+            content_hash = file_content_hash(file_path)
+            tmp_path = f"{stat_index_path}.tmp-{writer_suffix()}"
+            with open(tmp_path, 'w') as f:
+                json.dump({"source_path": os.path.abspath(file_path), "source_size": stat.st_size,
+                           "source_mtime_ns": stat.st_mtime_ns, "content_hash": content_hash}, f)
+            os.replace(tmp_path, stat_index_path)
+
+        self._content_hashes[stat_key] = content_hash
+        return content_hash
+
+    def lookup_metadata(self, file_path):
+        """Retorna o sidecar de metadados da entrada de file_path, ou None se não estiver em cache."""
+        return self._read_metadata(self.content_hash(file_path))
+
+    def open_arrays(self, file_path):
+        """
+        Abre a entrada em cache de file_path sem montar o DataFrame completo.
+        Retorna (frame, arrays, metadata): 'frame' com as colunas que não são blocos de
+        arrays e 'arrays' = {coluna: memmap somente leitura (n_amostras, ...)}; colunas
+        compartilhadas são o mesmo array repetido (np.broadcast_to, sem cópia).
+        Retorna None se não houver entrada válida.
+        """
+        content_hash = self.content_hash(file_path)
+        metadata = self._read_metadata(content_hash)
+        if metadata is None:
+            return None
+
+        entry_dir = self._entry_dir(content_hash)
+        frame = pd.read_pickle(os.path.join(entry_dir, FRAME_FILENAME))
+        arrays = {}
+        for col_name, array_info in metadata["arrays"].items():
+            block = np.load(os.path.join(entry_dir, array_info["file"]), mmap_mode='r')
+            arrays[col_name] = np.broadcast_to(block, tuple(array_info["shape"])) if array_info.get("shared") else block
+        return frame, arrays, metadata
+
+    def load(self, file_path):
+        """
+        Reabre a entrada em cache de file_path como DataFrame, com as colunas de arrays
+        apontando para visões (memmap, somente leitura) dos blocos .npy.
+        Retorna None se não houver entrada válida.
+        """
+        opened = self.open_arrays(file_path)
+        if opened is None:
+            return None
+
+        df, arrays, metadata = opened
+        for col_name, block in arrays.items():
+            if metadata["arrays"][col_name].get("shared"):
+                df[col_name] = [block[0]] * len(block) # O mesmo array em todas as linhas
+            else:
+                df[col_name] = list(block) # Cada célula é uma visão (sem cópia) do bloco mapeado
+        return df[metadata["columns"]]
+
+    def store(self, file_path, df):
+        """
+        Grava as colunas de arrays de df como blocos contíguos (n_amostras, ...) e o
+        restante do DataFrame, sob o hash do conteúdo de file_path.
+        Colunas de arrays com formatos heterogêneos ficam no FRAME_FILENAME; colunas em que
+        todas as linhas são o mesmo objeto são gravadas como um único array.
+        """
+        content_hash = self.content_hash(file_path)
+        if self._read_metadata(content_hash) is not None:
+            return self._entry_dir(content_hash)
+
+        entry_dir = self._entry_dir(content_hash)
+        tmp_dir = f"{entry_dir}.tmp-{writer_suffix()}"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+
+        arrays_info = {}
+        try:
+            for col_name in CACHED_ARRAY_COLUMNS:
+                if col_name not in df.columns:
+                    continue
+                first_value = df[col_name].iloc[0]
+                if not isinstance(first_value, np.ndarray) or \
+                   any(not isinstance(v, np.ndarray) or v.shape != first_value.shape for v in df[col_name]):
+                    continue
+                array_filename = f"{col_name}.npy"
+                if all(v is first_value for v in df[col_name]):
+                    np.save(os.path.join(tmp_dir, array_filename), first_value)
+                    arrays_info[col_name] = {"file": array_filename, "dtype": str(first_value.dtype),
+                                             "shape": [len(df)] + list(first_value.shape), "shared": True}
+                    continue
+                block = np.lib.format.open_memmap(os.path.join(tmp_dir, array_filename), mode='w+',
+                                                  dtype=first_value.dtype, shape=(len(df),) + first_value.shape)
+                for i_sample, value in enumerate(df[col_name]):
+                    block[i_sample] = value
+                block.flush()
+                del block
+                arrays_info[col_name] = {"file": array_filename, "dtype": str(first_value.dtype),
+                                         "shape": [len(df)] + list(first_value.shape)}
+
+            df.drop(columns=list(arrays_info)).to_pickle(os.path.join(tmp_dir, FRAME_FILENAME))
+
+            stat = os.stat(file_path)
+            metadata = {
+                "format_version": CACHE_FORMAT_VERSION,
+                "source_path": os.path.abspath(file_path),
+                "source_size": stat.st_size,
+                "source_mtime_ns": stat.st_mtime_ns,
+                "content_hash": content_hash,
+                "n_samples": len(df),
+                "columns": list(df.columns),
+                "arrays": arrays_info,
+                "created": datetime.now().isoformat(timespec="seconds")
+            }
+            with open(os.path.join(tmp_dir, METADATA_FILENAME), 'w') as f:
+                json.dump(metadata, f, indent=2)
+
+            if os.path.isdir(entry_dir):
+                shutil.rmtree(entry_dir, ignore_errors=True) # Entrada de outra versão do formato
+            try:
+                os.replace(tmp_dir, entry_dir)
+            except OSError:
+                # Outro processo gravou a mesma entrada primeiro; a dele é equivalente.
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        return entry_dir
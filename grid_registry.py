@@ -0,0 +1,153 @@
+# grid_registry.py
+import hashlib
+import threading
+import numpy as np
+
+# Registro das grades lat/lon: todas as amostras (e todos os modelos) usam a mesma grade
+# 354 x 360, mas cada linha do pickle traz sua própria cópia de 'lat' e 'lon'. Na leitura,
+# cada par é trocado pela cópia canônica (somente leitura) da grade com o mesmo conteúdo,
+# identificada por hash, e os renderizadores recebem essa referência junto com a extensão e
+# as bordas das células já calculadas para o pcolormesh.
+GRID_HASH_DIGEST_SIZE = 16
+
+def grid_key(lat, lon):
+    """Hash (hex) do conteúdo, do formato e do tipo de lat e lon."""
+    digest = hashlib.blake2b(digest_size=GRID_HASH_DIGEST_SIZE)
+    for coordinate in (lat, lon):
+        coordinate = np.ascontiguousarray(coordinate)
+        digest.update(f"{coordinate.dtype.str}{coordinate.shape}".encode('utf-8'))
+        digest.update(memoryview(coordinate).cast("B"))
+    return digest.hexdigest()
+
+def _read_only_copy(values):
+    values = np.array(values, copy=True)
+    values.flags.writeable = False
+    return values
+
+def _interp_cell_edges(centers):
+    """
+    Bordas das células ao longo das colunas de 'centers' (linhas, colunas + 1): pontos médios
+    entre os centros e meia célula além de cada extremidade, como o pcolormesh faz com
+    shading='auto'/'nearest' quando recebe os centros.
+    """
+    if centers.shape[1] == 1:
+        return np.hstack((centers, centers))
+    half_steps = np.diff(centers, axis=1) * 0.5
+    return np.hstack((centers[:, [0]] - half_steps[:, [0]], centers[:, :-1] + half_steps,
+                      centers[:, [-1]] + half_steps[:, [-1]]))
+
+class Grid:
+    """
+    Grade lat/lon canônica (arrays 2D somente leitura). 'extent' e 'mesh_edges' são
+    calculados uma vez por grade. Serializada (pickle) pelos arrays e registrada de novo no
+    processo que a recebe, de modo que os workers de renderização também compartilham a grade.
+    """
+
+    def __init__(self, key, lat, lon):
+        self.key = key
+        self.lat = lat
+        self.lon = lon
+        self._extent = None
+        self._mesh_edges = None
+
+    @property
+    def shape(self):
+        return self.lon.shape
+
+    @property
+    def extent(self):
+        """(lon_min, lon_max, lat_min, lat_max) da grade regular, com meia célula em cada borda."""
+        if self._extent is None:
+            lon, lat = self.lon, self.lat
+            half_dlon = (lon.max() - lon.min()) / max(lon.shape[1] - 1, 1) / 2
+            half_dlat = (lat.max() - lat.min()) / max(lat.shape[0] - 1, 1) / 2
+            self._extent = (float(lon.min() - half_dlon), float(lon.max() + half_dlon),
+                            float(lat.min() - half_dlat), float(lat.max() + half_dlat))
+        return self._extent
+
+    @property
+    def mesh_edges(self):
+        """
+        (lon_edges, lat_edges), cada um (ny + 1, nx + 1): as bordas das células para
+        pcolormesh(lon_edges, lat_edges, campo, shading='flat'), com o mesmo resultado de
+        pcolormesh(lon, lat, campo, shading='auto') sem recalcular as bordas a cada painel.
+        """
+        if self._mesh_edges is None:
+            edges = []
+            for centers in (self.lon, self.lat):
+                centers_edges = _interp_cell_edges(_interp_cell_edges(np.asarray(centers)).T).T
+                centers_edges.flags.writeable = False
+                edges.append(centers_edges)
+            self._mesh_edges = tuple(edges)
+        return self._mesh_edges
+
+    def __reduce__(self):
+        return (get_grid, (self.lat, self.lon))
+
+class GridRegistry:
+    """
+    Grades canônicas do processo, por hash do conteúdo. register(lat, lon) devolve a Grid
+    com o mesmo conteúdo, criando-a (com cópias somente leitura) na primeira vez. Os arrays
+    da própria grade e os iguais à última grade usada são reconhecidos sem calcular o hash.
+    """
+
+    def __init__(self):
+        self._grids = {}
+        self._last_grid = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._grids)
+
+    def register(self, lat, lon):
+        with self._lock:
+            for grid in self._grids.values():
+                if lat is grid.lat and lon is grid.lon:
+                    return grid
+            lat, lon = np.asarray(lat), np.asarray(lon)
+            last_grid = self._last_grid
+            if last_grid is not None and lat.shape == last_grid.lat.shape and lon.shape == last_grid.lon.shape and \
+               lat.dtype == last_grid.lat.dtype and lon.dtype == last_grid.lon.dtype and \
+               np.array_equal(lat, last_grid.lat) and np.array_equal(lon, last_grid.lon):
+                return last_grid
+            key = grid_key(lat, lon)
+            grid = self._grids.get(key)
+            if grid is None:
+                grid = Grid(key, _read_only_copy(lat), _read_only_copy(lon))
+                self._grids[key] = grid
+            self._last_grid = grid
+            return grid
+
+    def clear(self):
+        with self._lock:
+            self._grids.clear()
+            self._last_grid = None
+
+DEFAULT_GRID_REGISTRY = GridRegistry()
+
+def get_grid(lat, lon, registry=None):
+    """Grid canônica de (lat, lon) no registro do processo (ou em 'registry')."""
+    return (registry if registry is not None else DEFAULT_GRID_REGISTRY).register(lat, lon)
+
+def deduplicate_grid_columns(df, registry=None):
+    """
+    Troca, em cada linha de df, 'lat' e 'lon' pelos arrays da grade canônica correspondente,
+    liberando as cópias redundantes. Linhas sem lat/lon ficam como estão.
+    Retorna o número de grades distintas encontradas.
+    """
+    if df.empty or 'lat' not in df.columns or 'lon' not in df.columns:
+        return 0
+    registry = registry if registry is not None else DEFAULT_GRID_REGISTRY
+    lat_values, lon_values, grid_keys = [], [], set()
+    for lat, lon in zip(df['lat'], df['lon']):
+        if lat is None or lon is None:
+            lat_values.append(lat)
+            lon_values.append(lon)
+            continue
+        grid = get_grid(lat, lon, registry)
+        lat_values.append(grid.lat)
+        lon_values.append(grid.lon)
+        grid_keys.add(grid.key)
+    df['lat'] = lat_values
+    df['lon'] = lon_values
+    return len(grid_keys)
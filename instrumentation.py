@@ -0,0 +1,276 @@
+# instrumentation.py
+import os
+import json
+import glob
+import time
+import threading
+from contextlib import contextmanager
+from functools import wraps
+
+# Spans de instrumentação (tempo de parede, tempo de CPU e pico de RSS por estágio e por tarefa).
+# Cada processo (principal, workers do lote e de renderização) grava seus eventos, um JSON por
+# linha, em <trace_dir>/events_<pid>.jsonl; write_trace_reports junta tudo no fim do lote.
+RSS_SAMPLE_INTERVAL_S = 0.02
+TRACE_PARTS_DIRNAME = "trace_parts"
+TRACE_JSONL_FILENAME = "pipeline_trace.jsonl"
+TRACE_CHROME_FILENAME = "pipeline_trace_chrome.json" # Abrir em chrome://tracing ou ui.perfetto.dev
+TRACE_SUMMARY_FILENAME = "pipeline_trace_resumo.json"
+
+_STATE = {
+    "enabled": False,
+    "trace_dir": None,
+    "pid": None, # Processo dono do arquivo de eventos e da thread de amostragem
+    "events_file": None,
+    "sampler_thread": None,
+}
+_LOCK = threading.Lock()
+_ACTIVE_SPANS = {} # id(registro) -> registro dos spans abertos; a thread de amostragem atualiza seus picos de RSS
+_SPAN_DEPTH = threading.local()
+_TASK_LOCAL = threading.local() # Tarefa por thread (o executor em pipeline processa tarefas diferentes em paralelo)
+
+def read_current_rss_bytes():
+    """RSS atual do processo (via /proc/self/statm); None se indisponível."""
+    try:
+        with open("/proc/self/statm", 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+class PeakRSSSampler:
+    """
+    Mede o pico de RSS de um trecho de código amostrando /proc/self/statm em uma thread
+    a cada 'interval_s'. Uso: with PeakRSSSampler() as sampler: ...; sampler.peak_bytes
+    """
+
+    def __init__(self, interval_s=0.01):
+        self.interval_s = interval_s
+        self.start_bytes = None
+        self.peak_bytes = None
+        self.end_bytes = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        rss_bytes = read_current_rss_bytes()
+        if rss_bytes is not None and (self.peak_bytes is None or rss_bytes > self.peak_bytes):
+            self.peak_bytes = rss_bytes
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval_s):
+            self._sample()
+
+    def __enter__(self):
+        self.start_bytes = read_current_rss_bytes()
+        self.peak_bytes = self.start_bytes
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stop_event.set()
+        self._thread.join()
+        self._sample()
+        self.end_bytes = read_current_rss_bytes()
+        return False
+
+def _reset_after_fork():
+    """No processo filho: descarta o arquivo, a thread e os spans herdados do pai."""
+    global _LOCK
+    _LOCK = threading.Lock()
+    _ACTIVE_SPANS.clear()
+    _SPAN_DEPTH.value = 0
+    _STATE["pid"] = None
+    _STATE["events_file"] = None
+    _STATE["sampler_thread"] = None
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+def configure_instrumentation(trace_dir, enabled=True):
+    """
+    Ativa (ou desativa) os spans neste processo, gravando os eventos em trace_dir.
+    Processos criados por fork herdam a configuração.
+    """
+    _STATE["enabled"] = bool(enabled and trace_dir)
+    _STATE["trace_dir"] = trace_dir
+    if _STATE["enabled"]:
+        os.makedirs(trace_dir, exist_ok=True)
+
+def instrumentation_enabled():
+    return _STATE["enabled"]
+
+def set_current_task(task_id):
+    """Define a tarefa associada aos próximos spans desta thread (None para nenhuma)."""
+    _TASK_LOCAL.task_id = task_id
+
+def current_task():
+    return getattr(_TASK_LOCAL, "task_id", None)
+
+def _sampler_loop():
+    while True:
+        time.sleep(RSS_SAMPLE_INTERVAL_S)
+        rss_bytes = read_current_rss_bytes()
+        if rss_bytes is None:
+            return
+        with _LOCK:
+            for record in _ACTIVE_SPANS.values():
+                if rss_bytes > record["peak_rss_bytes"]:
+                    record["peak_rss_bytes"] = rss_bytes
+
+def _ensure_process_state():
+    """Abre o arquivo de eventos e inicia a thread de amostragem na primeira vez em cada processo."""
+    if _STATE["pid"] == os.getpid():
+        return
+    _STATE["pid"] = os.getpid()
+    events_path = os.path.join(_STATE["trace_dir"], f"events_{os.getpid()}.jsonl")
+    _STATE["events_file"] = open(events_path, 'a', buffering=1) # Uma linha por evento, gravada ao fechar o span
+    _STATE["sampler_thread"] = threading.Thread(target=_sampler_loop, name="rss-sampler", daemon=True)
+    _STATE["sampler_thread"].start()
+
+@contextmanager
+def span(name, category="pipeline", task_id=None, **attributes):
+    """
+    Mede um estágio: tempo de parede, tempo de CPU do processo e pico de RSS entre a entrada
+    e a saída do bloco. Spans aninhados registram a profundidade. Não faz nada se a
+    instrumentação estiver desativada. 'attributes' vão para o campo "args" do evento.
+    """
+    if not _STATE["enabled"]:
+        yield None
+        return
+
+    _ensure_process_state()
+    start_rss_bytes = read_current_rss_bytes() or 0
+    record = {"peak_rss_bytes": start_rss_bytes}
+    depth = getattr(_SPAN_DEPTH, "value", 0)
+    _SPAN_DEPTH.value = depth + 1
+    with _LOCK:
+        _ACTIVE_SPANS[id(record)] = record
+    start_time = time.time()
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    status = "ok"
+    try:
+        yield record
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        wall_seconds = time.perf_counter() - wall_start
+        cpu_seconds = time.process_time() - cpu_start
+        end_rss_bytes = read_current_rss_bytes() or 0
+        _SPAN_DEPTH.value = depth
+        with _LOCK:
+            _ACTIVE_SPANS.pop(id(record), None)
+        event = {
+            "name": name,
+            "category": category,
+            "task_id": task_id if task_id is not None else current_task(),
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "depth": depth,
+            "start": start_time,
+            "wall_s": wall_seconds,
+            "cpu_s": cpu_seconds,
+            "start_rss_mb": start_rss_bytes / 1024**2,
+            "end_rss_mb": end_rss_bytes / 1024**2,
+            "peak_rss_mb": max(record["peak_rss_bytes"], end_rss_bytes) / 1024**2,
+            "status": status,
+            "args": attributes
+        }
+        try:
+            _STATE["events_file"].write(json.dumps(event, default=str) + "\n")
+        except Exception as e:
+            print(f"    AVISO: Não foi possível registrar o span '{name}': {e}")
+
+def instrumented(name=None, category=None):
+    """Decorador: executa a função dentro de um span (nome e categoria padrão: função e módulo)."""
+    def decorator(func):
+        span_name = name or func.__name__
+        span_category = category or func.__module__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _STATE["enabled"]:
+                return func(*args, **kwargs)
+            with span(span_name, category=span_category):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def reset_trace_dir(trace_dir):
+    """Remove eventos de execuções anteriores de trace_dir."""
+    for events_path in glob.glob(os.path.join(trace_dir, "events_*.jsonl")):
+        os.remove(events_path)
+
+def load_trace_events(trace_dir):
+    """Lê e ordena (por início) os eventos de todos os processos gravados em trace_dir."""
+    events = []
+    for events_path in sorted(glob.glob(os.path.join(trace_dir, "events_*.jsonl"))):
+        with open(events_path, 'r') as f:
+            for line in f:
+                try:
+                    events.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue # Linha incompleta de um processo encerrado à força
+    events.sort(key=lambda e: e["start"])
+    return events
+
+def to_chrome_trace(events):
+    """Converte os eventos para o formato Chrome Trace (eventos completos 'X', tempos em µs)."""
+    trace_events = []
+    for event in events:
+        trace_events.append({
+            "name": event["name"],
+            "cat": event["category"],
+            "ph": "X",
+            "ts": event["start"] * 1e6,
+            "dur": event["wall_s"] * 1e6,
+            "pid": event["pid"],
+            "tid": event["tid"],
+            "args": dict(event["args"], task_id=event["task_id"], cpu_s=round(event["cpu_s"], 4),
+                         peak_rss_mb=round(event["peak_rss_mb"], 1), status=event["status"])
+        })
+    return {"traceEvents": trace_events, "displayTimeUnit": "ms"}
+
+def summarize_trace_events(events):
+    """
+    Agrega os eventos por (tarefa, estágio): contagem, tempo de parede e de CPU somados e
+    maior pico de RSS. Retorna uma lista ordenada pelo tempo de parede total.
+    """
+    summary = {}
+    for event in events:
+        key = (event["task_id"], event["category"], event["name"])
+        entry = summary.setdefault(key, {"task_id": event["task_id"], "category": event["category"], "stage": event["name"],
+                                         "count": 0, "wall_s": 0.0, "cpu_s": 0.0, "peak_rss_mb": 0.0})
+        entry["count"] += 1
+        entry["wall_s"] += event["wall_s"]
+        entry["cpu_s"] += event["cpu_s"]
+        entry["peak_rss_mb"] = max(entry["peak_rss_mb"], event["peak_rss_mb"])
+    return sorted(summary.values(), key=lambda e: e["wall_s"], reverse=True)
+
+def write_trace_reports(trace_dir, reports_output_dir, top_n=10):
+    """
+    Junta os eventos de todos os processos e grava, em reports_output_dir, o trace em JSON
+    lines, o trace no formato Chrome e o resumo por tarefa/estágio. Retorna o resumo.
+    """
+    events = load_trace_events(trace_dir)
+    if not events:
+        print("  Nenhum evento de instrumentação registrado.")
+        return []
+
+    with open(os.path.join(reports_output_dir, TRACE_JSONL_FILENAME), 'w') as f:
+        for event in events:
+            f.write(json.dumps(event, default=str) + "\n")
+    with open(os.path.join(reports_output_dir, TRACE_CHROME_FILENAME), 'w') as f:
+        json.dump(to_chrome_trace(events), f)
+    summary = summarize_trace_events(events)
+    with open(os.path.join(reports_output_dir, TRACE_SUMMARY_FILENAME), 'w') as f:
+        json.dump(summary, f, indent=2)
+
+    print(f"  Trace de instrumentação ({len(events)} eventos) salvo em: {os.path.join(reports_output_dir, TRACE_JSONL_FILENAME)}")
+    print(f"  Trace no formato Chrome salvo em: {os.path.join(reports_output_dir, TRACE_CHROME_FILENAME)}")
+    print("  Estágios mais caros (tempo de parede somado):")
+    for entry in summary[:top_n]:
+        print(f"    [{entry['task_id'] or '-'}] {entry['category']}.{entry['stage']}: {entry['wall_s']:.2f}s parede, "
+              f"{entry['cpu_s']:.2f}s CPU, pico RSS {entry['peak_rss_mb']:.0f} MB (x{entry['count']})")
+    return summary
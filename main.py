@@ -1,16 +1,51 @@
 # main.py
+import time
+_STARTUP_T0 = time.perf_counter() # Início da medição do custo de import do pipeline
 import os
+import sys
 import json
+import sqlite3
+import subprocess
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
 import numpy as np # Adicionado para np.arange
-from processor import process_model
+from processor import (process_model, resolve_precision, DEFAULT_STREAM_CHUNK_SIZE, DEFAULT_PRECISION,
+                       PRECISION_DTYPES)
+from visualizer import DEFAULT_RENDER_WORKERS, DEFAULT_RENDERER, combine_gifs
+from animation_writers import DEFAULT_ANIMATION_FORMAT, DEFAULT_FRAME_DURATION_MS, animation_path
+from forecast_cache import ForecastCache
+from chunked_forecast import ChunkedForecastReader, is_chunked_forecast
+from manifest import RunManifest, compute_code_version, MANIFEST_FILENAME
+from metrics_store import MetricsStore
+from bootstrap import (compute_bootstrap_summary, write_bootstrap_report, DEFAULT_BOOTSTRAP_CONFIDENCE,
+                       DEFAULT_BOOTSTRAP_SEED)
+from pipeline import (run_tasks_pipeline, write_pipeline_stats, DEFAULT_PIPELINE_LOAD_WORKERS,
+                      DEFAULT_PIPELINE_COMPUTE_WORKERS, DEFAULT_PIPELINE_RENDER_WORKERS, DEFAULT_PIPELINE_QUEUE_SIZE)
+from sample_index import primary_label, SELECTION_METRICS, DEFAULT_SELECTION_METRIC
+from colorscale import (compute_batch_color_scale, read_color_scale, write_color_scale, COLOR_SCALES, DEFAULT_COLOR_SCALE,
+                        COLOR_SCALE_FILENAME)
+from comparison import compare_models, write_comparison_report, DEFAULT_COMPARISON_CHUNK_SIZE, COMPARISON_REPORT_FILENAME
+from instrumentation import (configure_instrumentation, reset_trace_dir, set_current_task, span,
+                             write_trace_reports, TRACE_PARTS_DIRNAME)
 # Importar ambas as funções de reporting.py
-from reporting import create_metrics_summary_table, plot_cumulative_metric_graph 
+from reporting import create_metrics_summary_table, plot_cumulative_metric_graph, plot_pairwise_comparison
+_STARTUP_IMPORT_SECONDS = time.perf_counter() - _STARTUP_T0
 # Se NUM_DAYS_METRICS está definido em reporting.py e você quer usá-lo:
 # from reporting import NUM_DAYS_METRICS 
 
 # NOME E CAMINHO FIXOS PARA O ARQUIVO JSON DE CONFIGURAÇÃO
 DEFAULT_CONFIG_FILENAME = "job_config.json"
 NUM_DAYS_METRICS = 7 # Definir aqui ou importar de reporting.py
+GRID_POINTS = 354 * 360 # Pontos de grade por dia de previsão
+# Módulos do pipeline cujo custo de import é medido a cada execução do lote
+STARTUP_PROFILE_MODULES = ["processor", "reporting"]
+STARTUP_PROFILE_FILENAME = "startup_importtime.json"
+STARTUP_PROFILE_HISTORY_FILENAME = "startup_importtime_history.jsonl"
+# "sequential": tarefas uma a uma (ou em processos, com max_workers > 1); "pipeline": leitura,
+# cálculo e renderização de tarefas diferentes sobrepostos (ver pipeline.py)
+EXECUTION_MODES = ("sequential", "pipeline")
 
 def load_config_from_json(json_file_path):
     """Carrega a configuração de um arquivo JSON."""
@@ -29,6 +64,412 @@ def load_config_from_json(json_file_path):
         print(f"ERRO CRÍTICO: Ocorreu um erro inesperado ao carregar o JSON: {e}")
         return None
 
+def measure_import_times(module_names, working_dir, top_n=20):
+    """
+    Mede o custo de import dos módulos em um subprocesso com 'python -X importtime'
+    e retorna um dicionário com o detalhamento (tempos em microssegundos).
+    """
+    command = [sys.executable, "-X", "importtime", "-c", "import " + ", ".join(module_names)]
+    result = subprocess.run(command, cwd=working_dir, capture_output=True, text=True, timeout=600)
+
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        try:
+            self_us, cumulative_us, module_field = line.split(":", 1)[1].split("|", 2)
+            module_name = module_field.strip()
+            entries.append({
+                "module": module_name,
+                "self_us": int(self_us),
+                "cumulative_us": int(cumulative_us),
+                "depth": (len(module_field) - len(module_field.lstrip()) - 1) // 2
+            })
+        except ValueError:
+            continue
+
+    top_level_entries = sorted((e for e in entries if e["depth"] == 0), key=lambda e: e["cumulative_us"], reverse=True)
+    return {
+        "modules": module_names,
+        "returncode": result.returncode,
+        "total_us": sum(e["cumulative_us"] for e in top_level_entries),
+        "top_level": top_level_entries[:top_n],
+        "top_cumulative": sorted(entries, key=lambda e: e["cumulative_us"], reverse=True)[:top_n]
+    }
+
+def record_startup_profile(script_dir, reports_output_dir):
+    """
+    Registra o tempo de import do próprio processo e o detalhamento via -X importtime
+    em STARTUP_PROFILE_FILENAME, acrescentando um resumo ao histórico (JSON lines)
+    para que regressões no tempo de inicialização fiquem visíveis entre execuções.
+    """
+    print(f"  Tempo de import dos módulos do pipeline neste processo: {_STARTUP_IMPORT_SECONDS:.2f}s")
+    try:
+        profile = measure_import_times(STARTUP_PROFILE_MODULES, script_dir)
+    except Exception as e:
+        print(f"  AVISO: Não foi possível medir o tempo de import com -X importtime: {e}")
+        return None
+
+    profile["timestamp"] = datetime.now().isoformat(timespec="seconds")
+    profile["python"] = sys.version.split()[0]
+    profile["in_process_import_seconds"] = _STARTUP_IMPORT_SECONDS
+
+    profile_path = os.path.join(reports_output_dir, STARTUP_PROFILE_FILENAME)
+    with open(profile_path, 'w') as f:
+        json.dump(profile, f, indent=2)
+    with open(os.path.join(reports_output_dir, STARTUP_PROFILE_HISTORY_FILENAME), 'a') as f:
+        f.write(json.dumps({
+            "timestamp": profile["timestamp"],
+            "in_process_import_seconds": profile["in_process_import_seconds"],
+            "total_us": profile["total_us"],
+            "top_level": {e["module"]: e["cumulative_us"] for e in profile["top_level"][:5]}
+        }) + "\n")
+
+    print(f"  Detalhamento de import (-X importtime) salvo em: {profile_path}")
+    for entry in profile["top_level"][:5]:
+        print(f"    {entry['module']}: {entry['cumulative_us'] / 1e6:.2f}s")
+    return profile_path
+
+def prepare_model_task(task_index, total_tasks, task_config, batch_config_data):
+    """
+    Valida uma tarefa do JSON e resolve suas opções (valores da tarefa sobrescrevem os globais).
+    Retorna (status, task_params): status é "skipped" ou "failed" se a tarefa não deve ser
+    executada, ou None com o dicionário de parâmetros para run_model_task.
+    """
+    task_id = task_config.get("task_id", f"Tarefa_NaoIdentificada_{task_index+1}")
+    print(f"\n--- Avaliando Tarefa [{task_index+1}/{total_tasks}]: {task_id} ---")
+
+    if not task_config.get("enabled", True):
+        print(f"  Tarefa '{task_id}' está desabilitada. Pulando.")
+        return "skipped", None
+    
+    print(f"  Tarefa '{task_id}' está habilitada. Iniciando processamento...")
+
+    required_keys = ["model_type", "model_file", "output_directory", "visualization_pos"]
+    missing_keys = [key for key in required_keys if key not in task_config]
+
+    if missing_keys:
+        print(f"  ERRO na Tarefa '{task_id}': Chaves obrigatórias ausentes: {', '.join(missing_keys)}. Pulando tarefa.")
+        return "failed", None
+
+    task_params = {
+        "task_id": task_id,
+        "model_type": task_config["model_type"],
+        "model_file": task_config["model_file"],
+        # output_directory do JSON é para os resultados da tarefa individual
+        "output_directory": task_config["output_directory"],
+        "visualization_pos": task_config["visualization_pos"],
+        # Backend das métricas diárias e cache de arrays (None/ausente desativa o cache)
+        "metrics_backend": task_config.get("metrics_backend", batch_config_data.get("metrics_backend", "numpy")),
+        "cache_dir": task_config.get("forecast_cache_dir", batch_config_data.get("forecast_cache_dir")),
+        # Modo streaming: amostras processadas em blocos de "stream_chunk_size"
+        "streaming": task_config.get("streaming", batch_config_data.get("streaming", False)),
+        "chunk_size": int(task_config.get("stream_chunk_size", batch_config_data.get("stream_chunk_size", DEFAULT_STREAM_CHUNK_SIZE))),
+        # Processos que renderizam os GIFs, o grid e os gráficos diários da tarefa em paralelo
+        "render_workers": int(task_config.get("render_workers", batch_config_data.get("render_workers", DEFAULT_RENDER_WORKERS))),
+        # Renderizador dos GIFs e do grid: "cartopy" ou "fast_raster"
+        "renderer": task_config.get("renderer", batch_config_data.get("renderer", DEFAULT_RENDERER)),
+        # Viés, MAE e RMSE por ponto de grade sobre todas as amostras (mapas de erro espacial)
+        "spatial_metrics": bool(task_config.get("spatial_metrics", batch_config_data.get("spatial_metrics", False))),
+        # Formato das animações: "gif" (padrão), "webp", "apng" ou "mp4" (requer ffmpeg)
+        "animation_format": task_config.get("animation_format", batch_config_data.get("animation_format", DEFAULT_ANIMATION_FORMAT)),
+        # Precisão dos campos da leitura à renderização: "float64" (padrão) ou "float32" (metade da memória)
+        "precision": resolve_precision(task_config.get("precision", batch_config_data.get("precision", DEFAULT_PRECISION))),
+        # (vmin, vmax) comuns do lote com "color_scale": "batch" (definidos em main); None = escala da amostra
+        "color_limits": None,
+        # Amostras visualizadas escolhidas pelas métricas por amostra (ex: ["best", "median", "worst", 3]);
+        # ausente/vazio usa a amostra de "visualization_pos"
+        "visualization_select": task_config.get("visualization_select", batch_config_data.get("visualization_select")) or None,
+        "visualization_select_metric": task_config.get("visualization_select_metric",
+                                                       batch_config_data.get("visualization_select_metric", DEFAULT_SELECTION_METRIC)),
+        # Dia de previsão (1 a 7) do ranking; ausente/null usa a média dos dias (guardado 0-based)
+        "visualization_select_day": task_config.get("visualization_select_day", batch_config_data.get("visualization_select_day")),
+    }
+    if task_params["visualization_select_metric"] not in SELECTION_METRICS:
+        print(f"  AVISO: visualization_select_metric '{task_params['visualization_select_metric']}' desconhecida "
+              f"(opções: {', '.join(SELECTION_METRICS)}). Usando '{DEFAULT_SELECTION_METRIC}'.")
+        task_params["visualization_select_metric"] = DEFAULT_SELECTION_METRIC
+    select_day = task_params["visualization_select_day"]
+    if select_day is not None:
+        if isinstance(select_day, int) and 1 <= select_day <= NUM_DAYS_METRICS:
+            task_params["visualization_select_day"] = select_day - 1
+        else:
+            print(f"  AVISO: visualization_select_day '{select_day}' inválido (1 a {NUM_DAYS_METRICS}). Usando a média dos dias.")
+            task_params["visualization_select_day"] = None
+
+    print(f"  Tipo de Modelo: {task_params['model_type']}")
+    print(f"  Arquivo do Modelo: {task_params['model_file']}")
+    print(f"  Diretório de Saída da Tarefa: {task_params['output_directory']}")
+    print(f"  Posição para Visualização: {task_params['visualization_pos']}")
+    print(f"  Backend de Métricas: {task_params['metrics_backend']}")
+    print(f"  Cache de Previsões: {task_params['cache_dir'] if task_params['cache_dir'] else 'desativado'}")
+    if is_chunked_forecast(task_params["model_file"]):
+        print(f"  Modo Streaming: blocos de {task_params['chunk_size']} amostras (arquivo no formato em blocos)")
+    else:
+        print(f"  Modo Streaming: {'blocos de ' + str(task_params['chunk_size']) + ' amostras' if task_params['streaming'] else 'desativado'}")
+    print(f"  Processos de Renderização: {task_params['render_workers']}")
+    print(f"  Renderizador: {task_params['renderer']}")
+    print(f"  Métricas Espaciais: {'ativadas' if task_params['spatial_metrics'] else 'desativadas'}")
+    print(f"  Formato das Animações: {task_params['animation_format']}")
+    print(f"  Precisão dos Campos: {task_params['precision']}")
+    if task_params["visualization_select"]:
+        select_day_str = (f"dia {task_params['visualization_select_day'] + 1}" if task_params["visualization_select_day"] is not None
+                          else "média dos dias")
+        print(f"  Seleção de Amostras: {task_params['visualization_select']} por "
+              f"{task_params['visualization_select_metric'].upper()} ({select_day_str})")
+
+    if not os.path.exists(task_params["model_file"]):
+        print(f"  ERRO: Arquivo de modelo '{task_params['model_file']}' não encontrado. Pulando tarefa '{task_id}'.")
+        return "failed", None
+
+    return None, task_params
+
+def run_model_task(task_params):
+    """
+    Executa process_model para uma tarefa já validada. Pode rodar no processo principal
+    ou em um worker do ProcessPoolExecutor; exceções são contidas aqui para que a falha
+    de uma tarefa não afete as demais.
+    Retorna (status, result_entry) com status "success" ou "failed".
+    """
+    task_id = task_params["task_id"]
+    if task_params.get("trace_dir"):
+        configure_instrumentation(task_params["trace_dir"]) # Necessário se o worker não foi criado por fork
+    set_current_task(task_id)
+    try:
+        os.makedirs(task_params["output_directory"], exist_ok=True) # Cria o diretório de saída da tarefa
+        
+        with span("run_model_task", category="main", model_type=task_params["model_type"],
+                  model_file=task_params["model_file"]):
+            task_metrics = process_model(
+                task_params["model_type"],
+                task_params["model_file"],
+                task_params["output_directory"], # Passa o diretório da tarefa para process_model
+                task_params["visualization_pos"],
+                metrics_backend=task_params["metrics_backend"],
+                cache_dir=task_params["cache_dir"],
+                streaming=task_params["streaming"],
+                chunk_size=task_params["chunk_size"],
+                render_workers=task_params["render_workers"],
+                renderer=task_params["renderer"],
+                spatial_metrics=task_params["spatial_metrics"],
+                animation_format=task_params["animation_format"],
+                precision=task_params["precision"],
+                color_limits=task_params["color_limits"],
+                visualization_select=task_params["visualization_select"],
+                select_metric=task_params["visualization_select_metric"],
+                select_day=task_params["visualization_select_day"]
+            )
+
+        if task_metrics and isinstance(task_metrics, dict):
+            print(f"  Tarefa '{task_id}' processada com sucesso.")
+            return "success", {
+                "task_id": task_id,
+                "model_type": task_params["model_type"],
+                "metrics_data": task_metrics # Deve ser {'rmse': [d1..d7], 'r2': [d1..d7], ...}
+            }
+        print(f"  AVISO: Tarefa '{task_id}' concluída, mas não retornou métricas válidas ou no formato esperado.")
+        return "failed", None
+
+    except Exception as e:
+        print(f"  ERRO INESPERADO durante o processamento da tarefa '{task_id}': {e}")
+        import traceback
+        traceback.print_exc()
+        return "failed", None
+    finally:
+        set_current_task(None)
+
+def lookup_manifest_task(run_manifest, task_params):
+    """run_manifest.lookup com aviso: (resultado armazenado ou None, entradas do manifesto ou None)."""
+    try:
+        return run_manifest.lookup(task_params)
+    except OSError as e:
+        print(f"  AVISO: Não foi possível calcular a impressão digital da tarefa '{task_params['task_id']}': {e}")
+        return None, None
+
+def read_available_memory_bytes():
+    """Lê a memória disponível (MemAvailable) de /proc/meminfo; retorna None se indisponível."""
+    try:
+        with open("/proc/meminfo", 'r') as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+def estimate_task_memory_bytes(task_params):
+    """
+    Estima o pico de memória de uma tarefa: n_amostras x GRID_POINTS x dias x 8 bytes (4 em float32),
+    duas vezes (y_rol e y_rol_pred). n_amostras vem do cache quando disponível; senão é
+    estimado pelo tamanho do .pkl (supondo arrays float32 no arquivo, o pior caso), e o
+    próprio DataFrame decodificado é somado. Arquivos no formato em blocos são processados em
+    streaming: só um bloco de 'chunk_size' amostras fica em memória.
+    """
+    precision = task_params.get("precision", DEFAULT_PRECISION)
+    sample_bytes = GRID_POINTS * NUM_DAYS_METRICS * np.dtype(PRECISION_DTYPES[precision]).itemsize
+    if is_chunked_forecast(task_params["model_file"]):
+        try:
+            with ChunkedForecastReader(task_params["model_file"]) as reader:
+                return min(reader.n_samples, task_params["chunk_size"]) * sample_bytes * 2
+        except Exception:
+            pass
+    if task_params.get("cache_dir"):
+        try:
+            cached_metadata = ForecastCache(task_params["cache_dir"], precision=precision).lookup_metadata(task_params["model_file"])
+            if cached_metadata is not None:
+                return cached_metadata["n_samples"] * sample_bytes * 2
+        except Exception:
+            pass
+    file_size = os.path.getsize(task_params["model_file"])
+    estimated_samples = max(1, file_size // (GRID_POINTS * NUM_DAYS_METRICS * 4 * 2))
+    return estimated_samples * sample_bytes * 2 + file_size
+
+def run_tasks_in_pool(prepared_tasks, max_workers, memory_budget_bytes):
+    """
+    Executa as tarefas em um ProcessPoolExecutor, admitindo uma nova tarefa apenas se a
+    soma das estimativas de memória das tarefas em execução couber em 'memory_budget_bytes'
+    (sempre admite ao menos uma). Se um worker morrer (ex: OOM), o pool é recriado e as
+    tarefas em andamento são reexecutadas uma vez antes de serem contadas como falha.
+    Retorna {índice_da_tarefa: (status, result_entry)}.
+    """
+    pending = deque((task_index, task_params, estimate_task_memory_bytes(task_params), 0)
+                    for task_index, task_params in prepared_tasks)
+    results = {}
+    executor = ProcessPoolExecutor(max_workers=max_workers)
+    running = {}
+    memory_in_use = 0
+    try:
+        while pending or running:
+            while pending and len(running) < max_workers:
+                task_index, task_params, estimated_bytes, attempts = pending[0]
+                if running and memory_budget_bytes and memory_in_use + estimated_bytes > memory_budget_bytes:
+                    break # Aguarda liberar memória antes de admitir a próxima tarefa
+                pending.popleft()
+                print(f"  Despachando tarefa '{task_params['task_id']}' (estimativa de memória: {estimated_bytes / 1024**3:.2f} GB)")
+                future = executor.submit(run_model_task, task_params)
+                running[future] = (task_index, task_params, estimated_bytes, attempts)
+                memory_in_use += estimated_bytes
+
+            done_futures, _ = wait(running, return_when=FIRST_COMPLETED)
+            pool_broken = False
+            for future in done_futures:
+                task_index, task_params, estimated_bytes, attempts = running.pop(future)
+                memory_in_use -= estimated_bytes
+                try:
+                    results[task_index] = future.result()
+                except BrokenProcessPool:
+                    pool_broken = True
+                    if attempts == 0:
+                        print(f"  AVISO: Worker encerrado durante a tarefa '{task_params['task_id']}'. Reexecutando.")
+                        pending.appendleft((task_index, task_params, estimated_bytes, attempts + 1))
+                    else:
+                        print(f"  ERRO: Worker encerrado novamente durante a tarefa '{task_params['task_id']}'.")
+                        results[task_index] = ("failed", None)
+                except Exception as e:
+                    print(f"  ERRO INESPERADO no worker da tarefa '{task_params['task_id']}': {e}")
+                    results[task_index] = ("failed", None)
+
+            if pool_broken:
+                for future, (task_index, task_params, estimated_bytes, attempts) in running.items():
+                    pending.appendleft((task_index, task_params, estimated_bytes, attempts + 1))
+                running.clear()
+                memory_in_use = 0
+                executor.shutdown(wait=False, cancel_futures=True)
+                executor = ProcessPoolExecutor(max_workers=max_workers)
+    finally:
+        executor.shutdown(wait=True)
+    return results
+
+def record_metrics_store(metrics_store_path, script_dir, batch_config_data, executed_tasks, task_results, manifest_inputs,
+                         reused_tasks=None):
+    """
+    Registra a execução do lote no armazenamento de métricas (SQLite) com os resultados das
+    tarefas executadas com sucesso nesta rodada e das reaproveitadas do manifesto
+    ('reused_tasks', {índice: (task_params, entradas do manifesto)}, gravadas com "reused"
+    nos metadados), de modo que cada execução tenha todas as tarefas do lote.
+    Retorna o run_id ou None em caso de falha.
+    """
+    reused_tasks = reused_tasks or {}
+    run_config = {key: value for key, value in batch_config_data.items() if key != "model_tasks"}
+    try:
+        with MetricsStore(metrics_store_path) as store:
+            run_id = store.start_run(code_version=compute_code_version(script_dir), config=run_config)
+            recorded_count = 0
+            for i in sorted(set(executed_tasks) | set(reused_tasks)):
+                status, result_entry = task_results[i]
+                if status != "success":
+                    continue
+                if i in reused_tasks:
+                    task_params, inputs = reused_tasks[i]
+                else:
+                    task_params, inputs = executed_tasks[i], manifest_inputs.get(i, (None, None))[1]
+                source_hash = inputs["source_hash"] if inputs else None
+                store.record_task(run_id, task_params, result_entry, source_hash=source_hash, reused=i in reused_tasks)
+                recorded_count += 1
+    except (sqlite3.Error, OSError) as e:
+        print(f"\nAVISO: Não foi possível gravar as métricas em {metrics_store_path}: {e}")
+        return None
+    reused_str = f" ({len(reused_tasks)} reaproveitada(s) do manifesto)" if reused_tasks else ""
+    print(f"\nMétricas de {recorded_count} tarefa(s){reused_str} gravadas em {metrics_store_path} (execução {run_id}).")
+    return run_id
+
+def run_model_comparison(comparison_tasks, batch_config_data, reports_output_dir):
+    """
+    Compara os modelos das tarefas válidas em uma única passada sobre a verdade de campo
+    compartilhada (ver comparison.py), restritos a "comparison_task_ids" se configurado.
+    Grava o resumo em JSON e a figura da comparação pareada em reports_output_dir.
+    """
+    task_ids = batch_config_data.get("comparison_task_ids")
+    if task_ids:
+        comparison_tasks = [task_params for task_params in comparison_tasks if task_params["task_id"] in task_ids]
+    if len(comparison_tasks) < 2:
+        print("  São necessárias ao menos duas tarefas válidas para a comparação entre modelos. Pulando.")
+        return None
+
+    chunk_size = int(batch_config_data.get("comparison_chunk_size", DEFAULT_COMPARISON_CHUNK_SIZE))
+    set_current_task("comparacao_modelos")
+    try:
+        comparison = compare_models(comparison_tasks, chunk_size=chunk_size,
+                                    cache_dir=batch_config_data.get("forecast_cache_dir"))
+        if comparison is None:
+            return None
+        write_comparison_report(comparison, reports_output_dir)
+        plot_pairwise_comparison(comparison, os.path.join(reports_output_dir, COMPARISON_REPORT_FILENAME.replace(".json", ".png")))
+        return comparison
+    except Exception as e:
+        print(f"  ERRO durante a comparação entre modelos: {e}")
+        import traceback
+        traceback.print_exc()
+        return None
+    finally:
+        set_current_task(None)
+
+def write_animation_montages(successful_tasks, batch_config_data, reports_output_dir):
+    """
+    Monta, para cada tipo de animação (previsão e diferença), uma animação com os GIFs de
+    todas as tarefas lado a lado (visualizer.combine_gifs, modo montagem), em reports_output_dir.
+    """
+    montage_format = batch_config_data.get("animation_format", DEFAULT_ANIMATION_FORMAT)
+    columns = batch_config_data.get("animation_montage_columns")
+    for prefix_gif, montage_name in [('_pred', "montagem_previsoes"), ('_diff', "montagem_diferencas")]:
+        paths, labels = [], []
+        for task_params in successful_tasks:
+            # Com seleção de amostras, a montagem usa a primeira amostra escolhida
+            label = primary_label(task_params["visualization_select"]) if task_params["visualization_select"] else None
+            artifact_prefix = task_params["model_type"] if label is None else f"{task_params['model_type']}_{label}"
+            gif_base_name = f"{artifact_prefix}_dia{task_params['visualization_pos'] + 1}{prefix_gif}"
+            gif_path = animation_path(os.path.join(task_params["output_directory"], gif_base_name), 24,
+                                      task_params["animation_format"])
+            if os.path.exists(gif_path):
+                paths.append(gif_path)
+                labels.append(task_params["task_id"])
+        if len(paths) < 2:
+            print(f"  Menos de duas animações '{prefix_gif}' disponíveis; montagem não gerada.")
+            continue
+        combine_gifs(paths, animation_path(os.path.join(reports_output_dir, montage_name), 24, montage_format),
+                     duration_ms=DEFAULT_FRAME_DURATION_MS, mode="montage",
+                     columns=int(columns) if columns else None, labels=labels)
+
 def main():
     """
     Script principal para processamento em lote de modelos de previsão,
@@ -44,6 +485,17 @@ def main():
         return
 
     model_tasks_list = batch_config_data["model_tasks"]
+    # Número de tarefas executadas em paralelo (1 = sequencial, no próprio processo)
+    max_workers = max(1, int(batch_config_data.get("max_workers", 1)))
+    execution_mode = batch_config_data.get("execution_mode", "sequential")
+    if execution_mode not in EXECUTION_MODES:
+        print(f"AVISO: execution_mode '{execution_mode}' desconhecido (opções: {', '.join(EXECUTION_MODES)}). Usando 'sequential'.")
+        execution_mode = "sequential"
+    # "sample": escala de cores de cada tarefa pela sua amostra; "batch": escala comum a todo o lote
+    color_scale = batch_config_data.get("color_scale", DEFAULT_COLOR_SCALE)
+    if color_scale not in COLOR_SCALES:
+        print(f"AVISO: color_scale '{color_scale}' desconhecido (opções: {', '.join(COLOR_SCALES)}). Usando '{DEFAULT_COLOR_SCALE}'.")
+        color_scale = DEFAULT_COLOR_SCALE
 
     print(f"\n--- Iniciando Processamento em Lote ---")
     print(f"Total de tarefas definidas no JSON: {len(model_tasks_list)}")
@@ -57,81 +509,175 @@ def main():
     reports_output_dir = os.path.join(script_dir, "relatorios_finais_batch") # Nome do diretório de relatórios
     os.makedirs(reports_output_dir, exist_ok=True) 
 
-    for i, task_config in enumerate(model_tasks_list):
-        task_id = task_config.get("task_id", f"Tarefa_NaoIdentificada_{i+1}")
-        print(f"\n--- Avaliando Tarefa [{i+1}/{len(model_tasks_list)}]: {task_id} ---")
+    if batch_config_data.get("record_import_times", False):
+        record_startup_profile(script_dir, reports_output_dir)
 
-        if not task_config.get("enabled", True):
-            print(f"  Tarefa '{task_id}' está desabilitada. Pulando.")
-            skipped_tasks_count += 1
-            continue
-        
-        print(f"  Tarefa '{task_id}' está habilitada. Iniciando processamento...")
+    # Spans por tarefa/estágio (tempo, CPU, pico de RSS); cada processo grava seus eventos em trace_dir
+    trace_dir = None
+    if batch_config_data.get("instrumentation", False):
+        trace_dir = os.path.join(reports_output_dir, TRACE_PARTS_DIRNAME)
+        configure_instrumentation(trace_dir)
+        reset_trace_dir(trace_dir)
 
-        required_keys = ["model_type", "model_file", "output_directory", "visualization_pos"]
-        missing_keys = [key for key in required_keys if key not in task_config]
+    # Execução incremental: tarefas inalteradas desde a última execução reaproveitam métricas e artefatos
+    run_manifest = None
+    if batch_config_data.get("incremental", False):
+        run_manifest = RunManifest(os.path.join(reports_output_dir, MANIFEST_FILENAME), compute_code_version(script_dir))
+    manifest_inputs = {} # {índice_da_tarefa: (task_params, entradas do manifesto)} das tarefas a processar
+    reused_tasks_count = 0
 
-        if missing_keys:
-            print(f"  ERRO na Tarefa '{task_id}': Chaves obrigatórias ausentes: {', '.join(missing_keys)}. Pulando tarefa.")
-            failed_tasks_count += 1
-            continue
+    task_results = {} # {índice_da_tarefa: (status, result_entry)}
+    executed_tasks = {} # {índice_da_tarefa: task_params} das tarefas executadas nesta rodada
+    reused_tasks = {} # {índice_da_tarefa: (task_params, entradas do manifesto)} das tarefas reaproveitadas
+    prepared_tasks = []
+    valid_tasks = {} # {índice_da_tarefa: task_params} das tarefas válidas (inclusive as reaproveitadas)
+    task_preparations = [] # (índice_da_tarefa, status, task_params)
+    for i, task_config in enumerate(model_tasks_list):
+        status, task_params = prepare_model_task(i, len(model_tasks_list), task_config, batch_config_data)
+        if task_params is not None:
+            task_params["trace_dir"] = trace_dir
+            valid_tasks[i] = task_params
+        task_preparations.append((i, status, task_params))
 
-        current_model_type = task_config["model_type"]
-        current_model_file = task_config["model_file"]
-        # output_directory do JSON é para os resultados da tarefa individual
-        task_specific_output_dir = task_config["output_directory"] 
-        current_viz_pos = task_config["visualization_pos"]
+    # A escala comum precisa ser conhecida antes da primeira renderização (e entra na impressão digital do manifesto).
+    # Em execução incremental, a escala gravada é reaproveitada sem ler nenhum arquivo se todas as tarefas
+    # estiverem inalteradas com ela; basta uma tarefa a executar para que seja recalculada.
+    manifest_lookups = {} # {índice_da_tarefa: (resultado armazenado, entradas do manifesto)} já consultados
+    if color_scale == "batch" and valid_tasks:
+        batch_color_scale = None
+        if run_manifest is not None:
+            batch_color_scale = read_color_scale(reports_output_dir, list(valid_tasks.values()))
+        if batch_color_scale is not None:
+            for i, task_params in valid_tasks.items():
+                task_params["color_limits"] = [batch_color_scale["vmin"], batch_color_scale["vmax"]]
+                manifest_lookups[i] = lookup_manifest_task(run_manifest, task_params)
+                if manifest_lookups[i][0] is None:
+                    batch_color_scale, manifest_lookups = None, {}
+                    break
+        if batch_color_scale is not None:
+            print(f"\n--- Escala de Cores Comum do Lote: {len(valid_tasks)} tarefas inalteradas; "
+                  f"escala de {COLOR_SCALE_FILENAME} reaproveitada (vmin={batch_color_scale['vmin']:.4g}, "
+                  f"vmax={batch_color_scale['vmax']:.4g}) ---")
+        else:
+            print(f"\n--- Escala de Cores Comum do Lote ({len(valid_tasks)} tarefas) ---")
+            set_current_task("escala_cores")
+            try:
+                with span("compute_batch_color_scale", category="main"):
+                    batch_color_scale = compute_batch_color_scale(list(valid_tasks.values()))
+            finally:
+                set_current_task(None)
+            if batch_color_scale is not None:
+                write_color_scale(batch_color_scale, reports_output_dir)
+            for task_params in valid_tasks.values():
+                task_params["color_limits"] = [batch_color_scale["vmin"], batch_color_scale["vmax"]] \
+                    if batch_color_scale is not None else None
 
-        print(f"  Tipo de Modelo: {current_model_type}")
-        print(f"  Arquivo do Modelo: {current_model_file}")
-        print(f"  Diretório de Saída da Tarefa: {task_specific_output_dir}")
-        print(f"  Posição para Visualização: {current_viz_pos}")
+    for i, status, task_params in task_preparations:
+        if status is None and run_manifest is not None:
+            stored_result, inputs = manifest_lookups.get(i) or lookup_manifest_task(run_manifest, task_params)
+            if stored_result is not None:
+                print(f"  Tarefa '{task_params['task_id']}' inalterada desde a última execução. Reaproveitando métricas e artefatos.")
+                task_results[i] = ("success", stored_result)
+                reused_tasks[i] = (task_params, inputs)
+                reused_tasks_count += 1
+                continue
+            if inputs is not None:
+                manifest_inputs[i] = (task_params, inputs)
 
-        if not os.path.exists(current_model_file):
-            print(f"  ERRO: Arquivo de modelo '{current_model_file}' não encontrado. Pulando tarefa '{task_id}'.")
-            failed_tasks_count += 1
+        if status is not None:
+            task_results[i] = (status, None)
             continue
+        executed_tasks[i] = task_params
+        if max_workers == 1 and execution_mode == "sequential":
+            task_results[i] = run_model_task(task_params)
+        else:
+            prepared_tasks.append((i, task_params))
 
-        try:
-            os.makedirs(task_specific_output_dir, exist_ok=True) # Cria o diretório de saída da tarefa
-            
-            task_metrics = process_model(
-                current_model_type,
-                current_model_file,
-                task_specific_output_dir, # Passa o diretório da tarefa para process_model
-                current_viz_pos
-            )
+    if prepared_tasks and execution_mode == "pipeline":
+        pipeline_options = {
+            "load_workers": batch_config_data.get("pipeline_load_workers", DEFAULT_PIPELINE_LOAD_WORKERS),
+            "compute_workers": batch_config_data.get("pipeline_compute_workers", DEFAULT_PIPELINE_COMPUTE_WORKERS),
+            "render_workers": batch_config_data.get("pipeline_render_workers", DEFAULT_PIPELINE_RENDER_WORKERS),
+            "queue_size": batch_config_data.get("pipeline_queue_size", DEFAULT_PIPELINE_QUEUE_SIZE),
+        }
+        print(f"\n--- Executando {len(prepared_tasks)} tarefas em pipeline (leitura: {pipeline_options['load_workers']}, "
+              f"cálculo: {pipeline_options['compute_workers']}, renderização: {pipeline_options['render_workers']} workers; "
+              f"filas de {pipeline_options['queue_size']}) ---")
+        with span("run_tasks_pipeline", category="main"):
+            pipeline_results, pipeline_stats = run_tasks_pipeline(prepared_tasks, **pipeline_options)
+        task_results.update(pipeline_results)
+        write_pipeline_stats(pipeline_stats, reports_output_dir)
+    elif prepared_tasks:
+        if "max_memory_gb" in batch_config_data:
+            memory_budget_bytes = float(batch_config_data["max_memory_gb"]) * 1024**3
+        else:
+            available_bytes = read_available_memory_bytes()
+            memory_budget_bytes = available_bytes * 0.8 if available_bytes else None
+        budget_str = f"{memory_budget_bytes / 1024**3:.1f} GB" if memory_budget_bytes else "sem limite"
+        print(f"\n--- Executando {len(prepared_tasks)} tarefas com {max_workers} workers (orçamento de memória: {budget_str}) ---")
+        task_results.update(run_tasks_in_pool(prepared_tasks, max_workers, memory_budget_bytes))
 
-            if task_metrics and isinstance(task_metrics, dict):
-                all_task_metrics_results.append({
-                    "task_id": task_id,
-                    "model_type": current_model_type,
-                    "metrics_data": task_metrics # Deve ser {'rmse': [d1..d7], 'r2': [d1..d7], ...}
-                })
-                print(f"  Tarefa '{task_id}' processada com sucesso.")
-                successful_tasks_count += 1
-            else:
-                print(f"  AVISO: Tarefa '{task_id}' concluída, mas não retornou métricas válidas ou no formato esperado.")
-                failed_tasks_count +=1 
-
-        except Exception as e:
-            print(f"  ERRO INESPERADO durante o processamento da tarefa '{task_id}': {e}")
-            import traceback
-            traceback.print_exc()
+    # Coleta em ordem do JSON, para que os relatórios não dependam da ordem de conclusão
+    for i in range(len(model_tasks_list)):
+        status, result_entry = task_results[i]
+        if status == "success":
+            all_task_metrics_results.append(result_entry)
+            successful_tasks_count += 1
+        elif status == "skipped":
+            skipped_tasks_count += 1
+        else:
             failed_tasks_count += 1
     # --- FIM DO LOOP DE PROCESSAMENTO DAS TAREFAS ---
 
+    if run_manifest is not None:
+        for i, (task_params, inputs) in manifest_inputs.items():
+            status, result_entry = task_results[i]
+            if status == "success":
+                run_manifest.record(task_params, inputs, result_entry)
+        try:
+            run_manifest.save()
+            print(f"\nManifesto de execução atualizado: {run_manifest.manifest_path}")
+        except OSError as e:
+            print(f"\nAVISO: Não foi possível gravar o manifesto de execução: {e}")
+
+    # Armazenamento persistente das métricas por tarefa, amostra e dia (ausente/null desativa)
+    metrics_store_path = batch_config_data.get("metrics_store_path")
+    if metrics_store_path:
+        record_metrics_store(metrics_store_path, script_dir, batch_config_data, executed_tasks, task_results, manifest_inputs,
+                             reused_tasks=reused_tasks)
+
+    # Comparação entre modelos: verdade de campo lida uma vez, previsões alinhadas por data
+    if batch_config_data.get("comparison", False):
+        print(f"\n--- Comparação entre Modelos (verdade de campo compartilhada) ---")
+        run_model_comparison(list(valid_tasks.values()), batch_config_data, reports_output_dir)
+
     print(f"\n--- Resumo do Processamento em Lote ---")
     print(f"Total de tarefas configuradas: {len(model_tasks_list)}")
     print(f"Tarefas processadas com sucesso (com métricas): {successful_tasks_count}")
     print(f"Tarefas com falha ou sem métricas: {failed_tasks_count}")
     print(f"Tarefas puladas (desabilitadas): {skipped_tasks_count}")
+    if run_manifest is not None:
+        print(f"Tarefas reaproveitadas do manifesto (inalteradas): {reused_tasks_count}")
 
     # --- GERAÇÃO DOS GRÁFICOS E DA TABELA ---
     if all_task_metrics_results: # Só tenta gerar se houver resultados de métricas
         days_for_plotting = np.arange(1, NUM_DAYS_METRICS + 1) # Eixo X para os gráficos (Dia 1, Dia 2, ...)
         
         print(f"\n--- Gerando Relatórios Finais em: {reports_output_dir} ---")
+
+        # ICs bootstrap e testes pareados a partir das métricas por amostra (0/ausente desativa)
+        bootstrap_summary = None
+        bootstrap_resamples = int(batch_config_data.get("bootstrap_resamples", 0))
+        if bootstrap_resamples > 0:
+            print(f"  Calculando ICs bootstrap e testes pareados ({bootstrap_resamples} reamostragens)...")
+            with span("bootstrap", category="main"):
+                bootstrap_summary = compute_bootstrap_summary(
+                    all_task_metrics_results,
+                    n_resamples=bootstrap_resamples,
+                    confidence=float(batch_config_data.get("bootstrap_confidence", DEFAULT_BOOTSTRAP_CONFIDENCE)),
+                    seed=int(batch_config_data.get("bootstrap_seed", DEFAULT_BOOTSTRAP_SEED)),
+                    workers=max(1, int(batch_config_data.get("bootstrap_workers", 1))))
+            write_bootstrap_report(bootstrap_summary, reports_output_dir)
         
         # 1. Gerar os gráficos de métricas acumuladas
         # Define quais métricas plotar e seus rótulos para os gráficos
@@ -149,7 +695,8 @@ def main():
                 metric_label=display_metric_label,
                 all_tasks_metrics_data=all_task_metrics_results,
                 days_array=days_for_plotting,
-                output_directory=reports_output_dir # Salva gráficos neste diretório
+                output_directory=reports_output_dir, # Salva gráficos neste diretório
+                bootstrap_summary=bootstrap_summary
             )
             if graph_path:
                  generated_graph_paths.append(graph_path)
@@ -164,10 +711,21 @@ def main():
         summary_table_path = os.path.join(reports_output_dir, summary_table_filename)
         
         print(f"\nGerando tabela de resumo das métricas em: {summary_table_path}...")
-        create_metrics_summary_table(all_task_metrics_results, summary_table_path) # Função do reporting.py
+        create_metrics_summary_table(all_task_metrics_results, summary_table_path, # Função do reporting.py
+                                     bootstrap_summary=bootstrap_summary)
     else:
         print("\nNenhuma métrica foi coletada das tarefas processadas para gerar os relatórios.")
 
+    # Animações de todas as tarefas lado a lado, para comparação direta
+    if batch_config_data.get("animation_montage", False):
+        print(f"\n--- Montagem das Animações das Tarefas ---")
+        successful_tasks = [task_params for i, task_params in valid_tasks.items() if task_results[i][0] == "success"]
+        write_animation_montages(successful_tasks, batch_config_data, reports_output_dir)
+
+    if trace_dir:
+        print(f"\n--- Instrumentação por Estágio ---")
+        write_trace_reports(trace_dir, reports_output_dir)
+
     print(f"\n--- Processamento em Lote e Geração de Relatórios Concluídos ---")
 
 if __name__ == "__main__":
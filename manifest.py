@@ -0,0 +1,149 @@
+# manifest.py
+import os
+import json
+import hashlib
+from datetime import datetime
+import numpy as np
+from forecast_cache import file_content_hash
+
+# Manifesto de execução do lote: para cada tarefa guarda a impressão digital das entradas
+# (conteúdo do .pkl, parâmetros que alteram as saídas e versão do código) junto com as
+# métricas calculadas e a lista de artefatos gerados. Em execuções incrementais, tarefas com a
+# mesma impressão digital e artefatos ainda presentes não são reprocessadas.
+MANIFEST_FORMAT_VERSION = 1
+MANIFEST_FILENAME = "run_manifest.json"
+# Módulos cujo código determina métricas e artefatos de uma tarefa (os relatórios finais
+# são sempre refeitos, então reporting.py não entra na versão do código)
+CODE_VERSION_MODULES = ["processor", "metrics", "visualizer", "fast_raster", "forecast_cache", "grid_registry", "chunked_forecast",
+                        "animation_writers", "sample_index", "sample_fields", "colorscale"]
+# Parâmetros da tarefa que alteram as métricas ou os artefatos; os demais (cache_dir,
+# streaming, chunk_size, render_workers) mudam apenas a forma de execução
+FINGERPRINT_PARAMS = ["model_type", "visualization_pos", "output_directory", "metrics_backend", "renderer", "spatial_metrics",
+                     "animation_format", "precision", "color_limits", "visualization_select", "visualization_select_metric",
+                     "visualization_select_day"]
+
+def compute_code_version(script_dir, module_names=CODE_VERSION_MODULES):
+    """Hash do código-fonte dos módulos do pipeline (módulos ausentes são ignorados)."""
+    digest = hashlib.blake2b(digest_size=16)
+    for module_name in module_names:
+        module_path = os.path.join(script_dir, f"{module_name}.py")
+        if not os.path.exists(module_path):
+            continue
+        digest.update(module_name.encode('utf-8'))
+        with open(module_path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+def to_jsonable(value):
+    """Converte arrays/escalares NumPy (inclusive aninhados em dicts/listas) para tipos JSON."""
+    if isinstance(value, dict):
+        return {key: to_jsonable(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_jsonable(item) for item in value]
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+def _from_jsonable_metrics(metrics_data):
+    """Reconstrói o dict de métricas de process_model: listas de números viram arrays NumPy."""
+    if isinstance(metrics_data, dict):
+        return {key: _from_jsonable_metrics(item) for key, item in metrics_data.items()}
+    if isinstance(metrics_data, list) and all(isinstance(item, (int, float)) or item is None for item in metrics_data):
+        return np.array([np.nan if item is None else item for item in metrics_data], dtype=float)
+    return metrics_data
+
+class RunManifest:
+    """
+    Manifesto persistente (JSON) das tarefas concluídas com sucesso, indexado por task_id.
+    lookup() devolve o resultado armazenado se a tarefa não mudou; record() registra o
+    resultado de uma tarefa recém-processada; save() grava o arquivo atomicamente.
+    """
+
+    def __init__(self, manifest_path, code_version):
+        self.manifest_path = manifest_path
+        self.code_version = code_version
+        self.tasks = {}
+        try:
+            with open(manifest_path, 'r') as f:
+                stored = json.load(f)
+            if stored.get("format_version") == MANIFEST_FORMAT_VERSION:
+                self.tasks = stored.get("tasks", {})
+        except FileNotFoundError:
+            pass
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"  AVISO: Manifesto {manifest_path} ilegível ({e}). Todas as tarefas serão processadas.")
+
+    def _source_hash(self, task_id, model_file):
+        """Hash do conteúdo do .pkl, reaproveitando o hash anterior se tamanho e mtime não mudaram."""
+        stat = os.stat(model_file)
+        previous_inputs = self.tasks.get(task_id, {}).get("inputs", {})
+        if previous_inputs.get("model_file") == os.path.abspath(model_file) and \
+           previous_inputs.get("source_size") == stat.st_size and \
+           previous_inputs.get("source_mtime_ns") == stat.st_mtime_ns:
+            return previous_inputs["source_hash"], stat
+        return file_content_hash(model_file), stat
+
+    def task_inputs(self, task_params):
+        """Entradas que identificam a tarefa: arquivo (hash, tamanho, mtime), parâmetros e código."""
+        source_hash, stat = self._source_hash(task_params["task_id"], task_params["model_file"])
+        inputs = {param_name: task_params.get(param_name) for param_name in FINGERPRINT_PARAMS}
+        inputs.update({
+            "model_file": os.path.abspath(task_params["model_file"]),
+            "source_size": stat.st_size,
+            "source_mtime_ns": stat.st_mtime_ns,
+            "source_hash": source_hash,
+            "code_version": self.code_version
+        })
+        return inputs
+
+    @staticmethod
+    def fingerprint(inputs):
+        """Impressão digital das entradas (tamanho/mtime ficam de fora: só o conteúdo importa)."""
+        fingerprint_inputs = {key: value for key, value in inputs.items() if key not in ("source_size", "source_mtime_ns")}
+        return hashlib.blake2b(json.dumps(fingerprint_inputs, sort_keys=True).encode('utf-8'), digest_size=16).hexdigest()
+
+    def lookup(self, task_params):
+        """
+        Retorna (result_entry, inputs): result_entry é o resultado armazenado se a impressão
+        digital não mudou e todos os artefatos registrados ainda existem; senão None.
+        """
+        inputs = self.task_inputs(task_params)
+        stored_entry = self.tasks.get(task_params["task_id"])
+        if stored_entry is None or stored_entry.get("fingerprint") != self.fingerprint(inputs):
+            return None, inputs
+
+        output_dir = task_params["output_directory"]
+        missing_artifacts = [name for name in stored_entry.get("artifacts", [])
+                             if not os.path.exists(os.path.join(output_dir, name))]
+        if missing_artifacts:
+            print(f"  Manifesto: {len(missing_artifacts)} artefato(s) ausente(s) em {output_dir}; tarefa será reprocessada.")
+            return None, inputs
+
+        return {
+            "task_id": task_params["task_id"],
+            "model_type": task_params["model_type"],
+            "metrics_data": _from_jsonable_metrics(stored_entry["metrics_data"])
+        }, inputs
+
+    def record(self, task_params, inputs, result_entry):
+        """Registra o resultado de uma tarefa processada com sucesso e os artefatos do seu diretório."""
+        output_dir = task_params["output_directory"]
+        artifacts = sorted(name for name in os.listdir(output_dir)
+                           if os.path.isfile(os.path.join(output_dir, name))) if os.path.isdir(output_dir) else []
+        self.tasks[task_params["task_id"]] = {
+            "fingerprint": self.fingerprint(inputs),
+            "inputs": inputs,
+            "metrics_data": to_jsonable(result_entry["metrics_data"]),
+            "artifacts": artifacts,
+            "completed": datetime.now().isoformat(timespec="seconds")
+        }
+
+    def save(self):
+        """Grava o manifesto (arquivo temporário + os.replace, para não deixar JSON truncado)."""
+        tmp_path = f"{self.manifest_path}.tmp-{os.getpid()}"
+        with open(tmp_path, 'w') as f:
+            json.dump({"format_version": MANIFEST_FORMAT_VERSION, "code_version": self.code_version,
+                       "tasks": self.tasks}, f, indent=1)
+        os.replace(tmp_path, self.manifest_path)
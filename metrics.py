@@ -1,26 +1,221 @@
 # metrics.py
 import numpy as np
-import torch # Usado em posprocessDataframe
-from sklearn.metrics import r2_score # Usado em posprocessDataframe
+from instrumentation import instrumented
+# torch e sklearn são importados apenas dentro dos backends que os utilizam
+# (ver get_metrics_backend), evitando o custo de import no caminho principal.
 
-def posprocessDataframe(df):
+# Backends disponíveis para o cálculo das métricas diárias por amostra.
+METRICS_BACKENDS = ("numpy", "torch", "sklearn")
+DEFAULT_METRICS_BACKEND = "numpy"
+
+# Número de amostras empilhadas por vez no motor vetorizado. Cada bloco ocupa
+# chunk_size * 127440 * 7 * 8 bytes por buffer (~57 MB por amostra em float64 x3 buffers).
+DEFAULT_METRICS_CHUNK_SIZE = 8
+
+# Quantis reportados pelo OnlineMetricsAggregator e tamanho do seu reservatório de amostras
+DEFAULT_SUMMARY_QUANTILES = (0.05, 0.5, 0.95)
+DEFAULT_RESERVOIR_SIZE = 10000
+
+def _r2_from_sums(ss_res, ss_tot):
+    """
+    Calcula o R² a partir das somas de quadrados, replicando o comportamento
+    de sklearn.metrics.r2_score (force_finite=True) quando ss_tot == 0.
+    """
+    r2 = np.ones_like(ss_tot, dtype=np.float64)
+    valid = ss_tot != 0
+    r2[valid] = 1.0 - ss_res[valid] / ss_tot[valid]
+    r2[~valid & (ss_res != 0)] = 0.0
+    return r2
+
+def _daily_metrics_block(y_true, y_pred, residual_buffer):
+    """
+    Calcula MSE e R² por amostra e por dia para um bloco (c, N, dias),
+    reutilizando 'residual_buffer' (float64) para os resíduos e para os desvios da média.
+    Blocos float32 são convertidos elemento a elemento dentro das operações, então as
+    diferenças e as somas ficam em float64 sem cópia do bloco em float64.
+    """
+    n_points = y_true.shape[1]
+    resid = residual_buffer[:y_true.shape[0]]
+
+    np.subtract(y_true, y_pred, out=resid, dtype=np.float64)
+    np.square(resid, out=resid)
+    ss_res = resid.sum(axis=1)
+
+    np.subtract(y_true, y_true.mean(axis=1, keepdims=True, dtype=np.float64), out=resid, dtype=np.float64)
+    np.square(resid, out=resid)
+    ss_tot = resid.sum(axis=1)
+
+    return ss_res / n_points, _r2_from_sums(ss_res, ss_tot)
+
+def _iter_sample_blocks(y_true, y_pred, chunk_size):
+    """
+    Gera blocos (start, stop, true_block, pred_block) de até 'chunk_size' amostras.
+    Arrays 3D já empilhados (ex: memmaps) são fatiados sem cópia; sequências de
+    arrays (N, dias) são empilhadas em buffers reutilizados entre os blocos, no tipo
+    das amostras (float32 continua float32).
+    """
+    n_samples = len(y_true)
+    if n_samples != len(y_pred):
+        raise ValueError(f"y_true e y_pred com número de amostras diferente ({n_samples} != {len(y_pred)}).")
+
+    if isinstance(y_true, np.ndarray) and isinstance(y_pred, np.ndarray):
+        for start in range(0, n_samples, chunk_size):
+            stop = min(start + chunk_size, n_samples)
+            yield start, stop, y_true[start:stop], y_pred[start:stop]
+        return
+
+    sample_shape = np.shape(y_true[0])
+    true_buffer = np.empty((chunk_size,) + sample_shape, dtype=np.result_type(np.asarray(y_true[0]).dtype, np.asarray(y_pred[0]).dtype, np.float32))
+    pred_buffer = np.empty_like(true_buffer)
+    for start in range(0, n_samples, chunk_size):
+        stop = min(start + chunk_size, n_samples)
+        true_block = np.stack(y_true[start:stop], out=true_buffer[:stop - start])
+        pred_block = np.stack(y_pred[start:stop], out=pred_buffer[:stop - start])
+        yield start, stop, true_block, pred_block
+
+def _empty_daily_metrics():
+    return {'mse': np.empty((0, 0), dtype=np.float32),
+            'rmse': np.empty((0, 0), dtype=np.float32),
+            'r2_score': np.empty((0, 0))}
+
+def _finalize_daily_metrics(mse, r2):
+    mse = mse.astype(np.float32)
+    return {'mse': mse, 'rmse': np.sqrt(mse), 'r2_score': r2}
+
+def compute_daily_metrics_batch(y_true, y_pred, chunk_size=DEFAULT_METRICS_CHUNK_SIZE):
+    """
+    Calcula MSE, RMSE e R² por amostra e por dia com reduções NumPy vetorizadas.
+    Backend padrão ("numpy") de get_metrics_backend.
+
+    Parameters:
+    -----------
+    y_true, y_pred : np.ndarray (n_amostras, N, dias) ou sequência de arrays (N, dias)
+        Valores reais e previstos. Sequências (ex: uma coluna do DataFrame) são
+        empilhadas em blocos de 'chunk_size' amostras, sem criar uma cópia completa.
+    chunk_size : int
+        Número de amostras processadas por bloco.
+
+    Returns:
+    --------
+    dict
+        {'mse': (n_amostras, dias), 'rmse': (n_amostras, dias), 'r2_score': (n_amostras, dias)}
+        MSE/RMSE em float32 (como no cálculo original via torch) e R² em float64.
+    """
+    n_samples = len(y_true)
+    if n_samples == 0:
+        return _empty_daily_metrics()
+
+    sample_shape = np.shape(y_true[0])
+    chunk_size = max(1, min(int(chunk_size), n_samples))
+    residual_buffer = np.empty((chunk_size,) + sample_shape, dtype=np.float64)
+
+    mse = np.empty((n_samples, sample_shape[1]), dtype=np.float64)
+    r2 = np.empty_like(mse)
+    for start, stop, true_block, pred_block in _iter_sample_blocks(y_true, y_pred, chunk_size):
+        mse[start:stop], r2[start:stop] = _daily_metrics_block(true_block, pred_block, residual_buffer)
+
+    return _finalize_daily_metrics(mse, r2)
+
+def _compute_daily_metrics_torch(y_true, y_pred, chunk_size=DEFAULT_METRICS_CHUNK_SIZE):
+    """
+    Backend "torch": mesmas reduções de compute_daily_metrics_batch executadas com torch
+    (útil quando o torch já está carregado ou para aproveitar suas threads).
+    """
+    import torch
+
+    n_samples = len(y_true)
+    if n_samples == 0:
+        return _empty_daily_metrics()
+
+    chunk_size = max(1, min(int(chunk_size), n_samples))
+    n_days = np.shape(y_true[0])[1]
+    mse = np.empty((n_samples, n_days), dtype=np.float64)
+    r2 = np.empty_like(mse)
+    for start, stop, true_block, pred_block in _iter_sample_blocks(y_true, y_pred, chunk_size):
+        true_t = torch.from_numpy(np.ascontiguousarray(true_block, dtype=np.float64))
+        pred_t = torch.from_numpy(np.ascontiguousarray(pred_block, dtype=np.float64))
+        ss_res = ((true_t - pred_t) ** 2).sum(dim=1)
+        ss_tot = ((true_t - true_t.mean(dim=1, keepdim=True)) ** 2).sum(dim=1)
+        mse[start:stop] = (ss_res / true_t.shape[1]).numpy()
+        r2[start:stop] = _r2_from_sums(ss_res.numpy(), ss_tot.numpy())
+
+    return _finalize_daily_metrics(mse, r2)
+
+def _compute_daily_metrics_sklearn(y_true, y_pred, chunk_size=DEFAULT_METRICS_CHUNK_SIZE):
+    """
+    Backend "sklearn": chama mean_squared_error/r2_score de sklearn por amostra e por dia.
+    Lento; útil apenas como referência.
+    """
+    from sklearn.metrics import mean_squared_error, r2_score
+
+    n_samples = len(y_true)
+    if n_samples == 0:
+        return _empty_daily_metrics()
+
+    n_days = np.shape(y_true[0])[1]
+    mse = np.empty((n_samples, n_days), dtype=np.float64)
+    r2 = np.empty_like(mse)
+    for i_sample in range(n_samples):
+        for i_day in range(n_days):
+            mse[i_sample, i_day] = mean_squared_error(y_true[i_sample][:, i_day], y_pred[i_sample][:, i_day])
+            r2[i_sample, i_day] = r2_score(y_true[i_sample][:, i_day], y_pred[i_sample][:, i_day])
+
+    return _finalize_daily_metrics(mse, r2)
+
+def get_metrics_backend(name=None):
+    """
+    Retorna a função de cálculo das métricas diárias do backend 'name'
+    ("numpy", "torch" ou "sklearn"; None usa DEFAULT_METRICS_BACKEND).
+    torch/sklearn só são importados na primeira chamada da função retornada.
+    """
+    backend_name = (name or DEFAULT_METRICS_BACKEND).strip().lower()
+    backend_functions = {
+        "numpy": compute_daily_metrics_batch,
+        "torch": _compute_daily_metrics_torch,
+        "sklearn": _compute_daily_metrics_sklearn,
+    }
+    if backend_name not in backend_functions:
+        raise ValueError(f"Backend de métricas desconhecido: '{name}'. Opções: {', '.join(METRICS_BACKENDS)}.")
+    return backend_functions[backend_name]
+
+@instrumented()
+def posprocessDataframe(df, chunk_size=DEFAULT_METRICS_CHUNK_SIZE, backend=None):
     """
     Calcula métricas para o DataFrame (MSE, RMSE, R²) por amostra, para cada dia.
     Adiciona colunas 'mse', 'rmse', 'r2_score' ao DataFrame, onde cada célula
     dessas colunas conterá um array de 7 valores (um para cada dia).
+    Usa o backend de métricas selecionado (padrão: motor vetorizado NumPy);
+    a implementação linha a linha original continua disponível em
+    posprocessDataframe_reference.
     
     Parameters:
     -----------
     df : pandas.DataFrame
         DataFrame com colunas 'y_rol' e 'y_rol_pred' (arrays (N,7))
+    chunk_size : int
+        Número de amostras empilhadas por bloco no cálculo vetorizado.
+    backend : str, optional
+        Nome do backend de métricas ("numpy", "torch" ou "sklearn").
     
     Returns:
     --------
     pandas.DataFrame
         DataFrame com métricas adicionadas.
     """
-    # Garantir que y_rol e y_rol_pred tenham o mesmo número de "dias" (segunda dimensão)
-    # para evitar erros no cálculo das métricas.
+    df, _ = _truncate_to_common_days(df)
+
+    compute_daily_metrics = get_metrics_backend(backend)
+    daily_metrics = compute_daily_metrics(df['y_rol'].to_list(), df['y_rol_pred'].to_list(), chunk_size=chunk_size)
+    for metric_col_name in ['mse', 'rmse', 'r2_score']:
+        df[metric_col_name] = list(daily_metrics[metric_col_name])
+    
+    return df
+
+def _truncate_to_common_days(df):
+    """
+    Garante que y_rol e y_rol_pred tenham o mesmo número de "dias" (segunda dimensão)
+    para evitar erros no cálculo das métricas. Retorna (df, min_shape_days).
+    """
     # Assume que a primeira linha é representativa da estrutura.
     if not df.empty and 'y_rol' in df.columns and 'y_rol_pred' in df.columns and \
        isinstance(df['y_rol'].iloc[0], np.ndarray) and \
@@ -36,6 +231,18 @@ def posprocessDataframe(df):
         # Você pode querer retornar o df original ou None se isso for um erro crítico.
         # Por ora, prosseguirá, mas os cálculos abaixo podem falhar.
         min_shape_days = 7 # Um fallback, mas pode não ser ideal.
+    return df, min_shape_days
+
+@instrumented()
+def posprocessDataframe_reference(df):
+    """
+    Implementação original (linha a linha, via torch/sklearn) de posprocessDataframe.
+    Mantida como referência para testes de paridade com o motor vetorizado.
+    """
+    import torch
+    from sklearn.metrics import r2_score
+
+    df, min_shape_days = _truncate_to_common_days(df)
 
     # Calcular MSE por dia, para cada amostra
     # torch.mean(..., dim=0) calcula a média ao longo dos pontos da grade (N), resultando em 7 valores de MSE.
@@ -59,10 +266,12 @@ def posprocessDataframe(df):
     
     return df
 
+@instrumented()
 def calculate_model_metrics(df):
     """
     Extrai e resume métricas do DataFrame (que já foi processado por posprocessDataframe).
-    Calcula a média das métricas diárias sobre todas as amostras do DataFrame.
+    Calcula a média das métricas diárias sobre todas as amostras do DataFrame,
+    alimentando um OnlineMetricsAggregator amostra a amostra (sem empilhar as colunas).
     
     Parameters:
     -----------
@@ -75,40 +284,309 @@ def calculate_model_metrics(df):
     dict
         Dicionário com métricas resumidas (média dos 7 dias sobre todas as amostras).
         Ex: {'rmse': [rmse_d1, rmse_d2, ..., rmse_d7], 'r2': [...], ...}
+        A chave 'stats' traz a dispersão por dia (ver OnlineMetricsAggregator.statistics)
+        e 'per_sample' as métricas de cada amostra (ver stack_sample_metrics).
     """
     metrics_summary = {}
     
     # Métricas a serem agregadas
     metrics_to_aggregate = ['mse', 'rmse', 'r2_score']
+    available_metrics = []
     
     for metric_col_name in metrics_to_aggregate:
         if metric_col_name in df.columns and not df[metric_col_name].empty:
-            try:
-                # df[metric_col_name].to_numpy() retorna um array de objetos (cada objeto é um array de 7 métricas)
-                # np.stack(...) converte isso em um array 2D (n_amostras, 7_dias)
-                stacked_metric_arrays = np.stack(df[metric_col_name].to_numpy())
-                
-                # np.mean(..., axis=0) calcula a média ao longo das amostras, resultando em 7 valores (um por dia)
-                mean_daily_metrics = np.mean(stacked_metric_arrays, axis=0)
-                
-                # Armazena no dicionário de resumo, removendo '_score' de 'r2_score' para a chave
-                summary_key = metric_col_name.replace('_score', '')
-                metrics_summary[summary_key] = mean_daily_metrics
-            except Exception as e:
-                print(f"AVISO em calculate_model_metrics: Erro ao processar a coluna de métrica '{metric_col_name}': {e}")
-                # Preenche com NaNs ou array de zeros se falhar, para manter a estrutura do dict
-                summary_key = metric_col_name.replace('_score', '')
-                # Tenta obter o número de dias de uma métrica bem-sucedida, ou usa 7 como padrão
-                num_days_fallback = len(next(iter(metrics_summary.values()))) if metrics_summary else 7
-                metrics_summary[summary_key] = np.full(num_days_fallback, np.nan)
+            available_metrics.append(metric_col_name)
         else:
             print(f"AVISO em calculate_model_metrics: Coluna de métrica '{metric_col_name}' não encontrada ou vazia no DataFrame.")
-            summary_key = metric_col_name.replace('_score', '')
-            num_days_fallback = len(next(iter(metrics_summary.values()))) if metrics_summary else 7
+
+    aggregator = OnlineMetricsAggregator(metric_names=available_metrics)
+    try:
+        for metric_values in zip(*(df[metric_col_name] for metric_col_name in available_metrics)):
+            aggregator.update(dict(zip(available_metrics, metric_values)))
+    except Exception as e:
+        print(f"AVISO em calculate_model_metrics: Erro ao processar as colunas de métricas {available_metrics}: {e}")
+        aggregator = OnlineMetricsAggregator(metric_names=[])
+
+    aggregated_means = aggregator.summary()
+    for metric_col_name in metrics_to_aggregate:
+        # Armazena no dicionário de resumo, removendo '_score' de 'r2_score' para a chave
+        summary_key = metric_col_name.replace('_score', '')
+        if summary_key in aggregated_means:
+            metrics_summary[summary_key] = aggregated_means[summary_key]
+        else:
+            # Preenche com NaNs para manter a estrutura do dict
+            # Tenta obter o número de dias de uma métrica bem-sucedida, ou usa 7 como padrão
+            num_days_fallback = len(next(iter(aggregated_means.values()))) if aggregated_means else 7
             metrics_summary[summary_key] = np.full(num_days_fallback, np.nan)
+    metrics_summary['stats'] = aggregator.statistics()
+    if aggregator.count > 0:
+        try:
+            metrics_summary['per_sample'] = stack_sample_metrics(
+                [{metric_col_name: np.vstack(df[metric_col_name].to_numpy()) for metric_col_name in available_metrics}],
+                df['data'] if 'data' in df.columns else None)
+        except Exception as e:
+            print(f"AVISO em calculate_model_metrics: Métricas por amostra não puderam ser empilhadas: {e}")
             
     return metrics_summary
 
+def _iso_date(value):
+    """Data de uma amostra em ISO 8601 (None se ausente ou NaT)."""
+    return value.isoformat() if hasattr(value, 'isoformat') and value == value else None
+
+def stack_sample_metrics(metric_blocks, sample_dates=None):
+    """
+    Junta blocos de métricas por amostra [{'mse': (c, dias), ...}, ...] no dict guardado na
+    chave 'per_sample' do resumo: {'mse': (n, dias), 'rmse': ..., 'r2': ..., 'dates': [...]},
+    com as datas das amostras em ISO 8601. Usado pelo armazenamento de métricas (metrics_store.py).
+    """
+    per_sample = {}
+    for metric_col_name in ('mse', 'rmse', 'r2_score'):
+        blocks = [np.atleast_2d(np.asarray(block[metric_col_name], dtype=np.float64))
+                  for block in metric_blocks if metric_col_name in block]
+        if blocks:
+            per_sample[metric_col_name.replace('_score', '')] = np.vstack(blocks)
+    if sample_dates is not None:
+        per_sample['dates'] = [_iso_date(value) for value in sample_dates]
+    return per_sample
+
+class OnlineMetricsAggregator:
+    """
+    Agregador online das métricas diárias por amostra (MSE, RMSE, R²).
+
+    Para cada métrica e dia mantém contagem, média e M2 (Welford/Chan), mínimo e máximo,
+    além de uma amostra aleatória uniforme (reservatório de até 'reservoir_size' amostras)
+    para os quantis, que são exatos enquanto count <= reservoir_size.
+    Aceita uma amostra (dias,) ou um bloco (c, dias) por vez, e agregados parciais de
+    outros workers/blocos podem ser combinados com merge().
+    """
+
+    def __init__(self, metric_names=('mse', 'rmse', 'r2_score'), quantiles=DEFAULT_SUMMARY_QUANTILES,
+                 reservoir_size=DEFAULT_RESERVOIR_SIZE, seed=0):
+        self.metric_names = tuple(metric_names)
+        self.quantiles = tuple(quantiles)
+        self.reservoir_size = int(reservoir_size)
+        self.count = 0
+        self.mean = {}
+        self.m2 = {}
+        self.min = {}
+        self.max = {}
+        self.reservoir = {}
+        self._rng = np.random.default_rng(seed)
+
+    def update(self, daily_metrics):
+        """Adiciona uma amostra {'mse': (dias,), ...} ou um bloco {'mse': (c, dias), ...}."""
+        blocks = {}
+        for metric_col_name in self.metric_names:
+            block = np.asarray(daily_metrics[metric_col_name], dtype=np.float64)
+            blocks[metric_col_name] = block[np.newaxis, :] if block.ndim == 1 else block
+        block_count = next(iter(blocks.values())).shape[0] if blocks else 0
+        if block_count == 0:
+            return self
+
+        reservoir_slots = self._reservoir_slots(block_count)
+        for metric_col_name, block in blocks.items():
+            block_mean = block.mean(axis=0)
+            block_m2 = ((block - block_mean) ** 2).sum(axis=0)
+            self._combine_moments(metric_col_name, block_count, block_mean, block_m2,
+                                  block.min(axis=0), block.max(axis=0))
+            self._update_reservoir(metric_col_name, block, reservoir_slots)
+        self.count += block_count
+        return self
+
+    def _combine_moments(self, metric_col_name, other_count, other_mean, other_m2, other_min, other_max):
+        if self.count == 0 or metric_col_name not in self.mean:
+            self.mean[metric_col_name] = np.array(other_mean, dtype=np.float64)
+            self.m2[metric_col_name] = np.array(other_m2, dtype=np.float64)
+            self.min[metric_col_name] = np.array(other_min, dtype=np.float64)
+            self.max[metric_col_name] = np.array(other_max, dtype=np.float64)
+            return
+        total_count = self.count + other_count
+        delta = other_mean - self.mean[metric_col_name]
+        self.mean[metric_col_name] = self.mean[metric_col_name] + delta * (other_count / total_count)
+        self.m2[metric_col_name] = self.m2[metric_col_name] + other_m2 + delta ** 2 * (self.count * other_count / total_count)
+        self.min[metric_col_name] = np.minimum(self.min[metric_col_name], other_min)
+        self.max[metric_col_name] = np.maximum(self.max[metric_col_name], other_max)
+
+    def _reservoir_slots(self, block_count):
+        """
+        Algoritmo R vetorizado: para as próximas 'block_count' amostras retorna o slot do
+        reservatório que cada uma ocupa (-1 = descartada). Compartilhado entre métricas,
+        para que os quantis de todas as métricas venham das mesmas amostras.
+        """
+        seen = self.count + np.arange(block_count)
+        slots = np.where(seen < self.reservoir_size, seen, -1)
+        overflow = seen >= self.reservoir_size
+        if np.any(overflow):
+            candidates = self._rng.integers(0, seen[overflow] + 1)
+            slots[overflow] = np.where(candidates < self.reservoir_size, candidates, -1)
+        return slots
+
+    def _update_reservoir(self, metric_col_name, block, slots):
+        if metric_col_name not in self.reservoir:
+            self.reservoir[metric_col_name] = np.empty((self.reservoir_size, block.shape[1]), dtype=np.float64)
+        kept = slots >= 0
+        # Em colisões dentro do bloco prevalece a amostra mais recente, como no algoritmo sequencial
+        self.reservoir[metric_col_name][slots[kept]] = block[kept]
+
+    def _reservoir_samples(self, metric_col_name):
+        """Amostras válidas do reservatório (as primeiras min(count, reservoir_size) linhas)."""
+        return self.reservoir[metric_col_name][:min(self.count, self.reservoir_size)]
+
+    def merge(self, other):
+        """Combina (in-place) o agregado parcial 'other' (ex: de outro worker ou bloco)."""
+        if other.count == 0:
+            return self
+        merged_reservoirs = {}
+        for metric_col_name in other.metric_names:
+            other_samples = other._reservoir_samples(metric_col_name)
+            if self.count == 0 or metric_col_name not in self.reservoir:
+                combined = other_samples
+            elif self.count + other.count <= self.reservoir_size:
+                combined = np.vstack([self._reservoir_samples(metric_col_name), other_samples])
+            else:
+                # Mantém no reservatório combinado a proporção das contagens de cada lado
+                own_samples = self._reservoir_samples(metric_col_name)
+                rng = np.random.default_rng(self.count + other.count)
+                own_share = min(int(round(self.reservoir_size * self.count / (self.count + other.count))), len(own_samples))
+                other_share = min(self.reservoir_size - own_share, len(other_samples))
+                combined = np.vstack([own_samples[rng.choice(len(own_samples), own_share, replace=False)],
+                                      other_samples[rng.choice(len(other_samples), other_share, replace=False)]])
+            merged_reservoirs[metric_col_name] = combined
+
+            self._combine_moments(metric_col_name, other.count, other.mean[metric_col_name], other.m2[metric_col_name],
+                                  other.min[metric_col_name], other.max[metric_col_name])
+
+        self.metric_names = tuple(dict.fromkeys(self.metric_names + other.metric_names))
+        self.count += other.count
+        for metric_col_name, combined in merged_reservoirs.items():
+            reservoir = np.empty((self.reservoir_size, combined.shape[1]), dtype=np.float64)
+            reservoir[:len(combined)] = combined
+            self.reservoir[metric_col_name] = reservoir
+        return self
+
+    def summary(self):
+        """Retorna {'mse': [...], 'rmse': [...], 'r2': [...]} com as médias por dia."""
+        return {metric_col_name.replace('_score', ''): self.mean[metric_col_name].copy()
+                for metric_col_name in self.metric_names if metric_col_name in self.mean}
+
+    def statistics(self):
+        """
+        Retorna, por métrica (chaves 'mse', 'rmse', 'r2'), um dict de arrays por dia:
+        count, mean, std (amostral), min, max, q<nn> para cada quantil e ci95_low/ci95_high
+        (intervalo de confiança normal de 95% da média).
+        """
+        stats = {}
+        for metric_col_name in self.metric_names:
+            if metric_col_name not in self.mean:
+                continue
+            mean = self.mean[metric_col_name]
+            std = np.sqrt(self.m2[metric_col_name] / (self.count - 1)) if self.count > 1 else np.full_like(mean, np.nan)
+            half_width = 1.96 * std / np.sqrt(self.count)
+            metric_stats = {
+                'count': self.count,
+                'mean': mean.copy(),
+                'std': std,
+                'min': self.min[metric_col_name].copy(),
+                'max': self.max[metric_col_name].copy(),
+                'ci95_low': mean - half_width,
+                'ci95_high': mean + half_width
+            }
+            for q in self.quantiles:
+                metric_stats[f'q{int(round(q * 100)):02d}'] = np.quantile(self._reservoir_samples(metric_col_name), q, axis=0)
+            stats[metric_col_name.replace('_score', '')] = metric_stats
+        return stats
+
+class SpatialErrorAccumulator:
+    """
+    Acumulador, por ponto de grade e por dia, do erro (previsão - real) sobre todas as amostras:
+    somas do erro, do erro absoluto e do erro quadrático em float64 (N, dias), ou seja,
+    3 x 127440 x 7 x 8 bytes (~21 MB) independentemente do número de amostras.
+    Recebe blocos (c, N, dias) um por vez (ver accumulate_spatial_errors e o modo streaming)
+    e agregados parciais podem ser combinados com merge(). maps() devolve os mapas de viés,
+    MAE e RMSE.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.sum_error = None
+        self.sum_abs_error = None
+        self.sum_squared_error = None
+        self._error_buffer = None # Reutilizado entre blocos do mesmo tamanho
+
+    def update(self, y_true_block, y_pred_block):
+        """Adiciona um bloco (c, N, dias) (ou uma amostra (N, dias)) de valores reais e previstos."""
+        y_true_block = np.asarray(y_true_block)
+        y_pred_block = np.asarray(y_pred_block)
+        if y_true_block.ndim == 2:
+            y_true_block, y_pred_block = y_true_block[np.newaxis], y_pred_block[np.newaxis]
+        if y_true_block.shape[0] == 0:
+            return self
+        if self.sum_error is None:
+            point_shape = y_true_block.shape[1:]
+            self.sum_error = np.zeros(point_shape, dtype=np.float64)
+            self.sum_abs_error = np.zeros(point_shape, dtype=np.float64)
+            self.sum_squared_error = np.zeros(point_shape, dtype=np.float64)
+        if self._error_buffer is None or self._error_buffer.shape[0] < y_true_block.shape[0]:
+            self._error_buffer = np.empty(y_true_block.shape, dtype=np.float64)
+        error = self._error_buffer[:y_true_block.shape[0]]
+
+        np.subtract(y_pred_block, y_true_block, out=error, dtype=np.float64)
+        self.sum_error += error.sum(axis=0)
+        np.abs(error, out=error)
+        self.sum_abs_error += error.sum(axis=0)
+        np.square(error, out=error)
+        self.sum_squared_error += error.sum(axis=0)
+        self.count += y_true_block.shape[0]
+        return self
+
+    def merge(self, other):
+        """Combina (in-place) o acumulador parcial 'other' (ex: de outro worker ou bloco)."""
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            self.sum_error = other.sum_error.copy()
+            self.sum_abs_error = other.sum_abs_error.copy()
+            self.sum_squared_error = other.sum_squared_error.copy()
+        else:
+            self.sum_error += other.sum_error
+            self.sum_abs_error += other.sum_abs_error
+            self.sum_squared_error += other.sum_squared_error
+        self.count += other.count
+        return self
+
+    def maps(self, grid_shape):
+        """
+        Retorna {'bias', 'mae', 'rmse': (dias, ny, nx), 'count': n_amostras} com os pontos
+        reorganizados na forma da grade 'grid_shape' (lat/lon), ou None sem amostras.
+        """
+        if self.count == 0:
+            return None
+        num_days = self.sum_error.shape[1]
+
+        def to_day_major(point_values):
+            return np.ascontiguousarray(point_values.T).reshape((num_days,) + tuple(grid_shape))
+
+        return {
+            'bias': to_day_major(self.sum_error / self.count),
+            'mae': to_day_major(self.sum_abs_error / self.count),
+            'rmse': to_day_major(np.sqrt(self.sum_squared_error / self.count)),
+            'count': self.count
+        }
+
+@instrumented()
+def accumulate_spatial_errors(df, chunk_size=DEFAULT_METRICS_CHUNK_SIZE, accumulator=None):
+    """
+    Alimenta um SpatialErrorAccumulator com todas as amostras do DataFrame (colunas
+    'y_rol' e 'y_rol_pred', arrays (N, dias)), empilhando 'chunk_size' amostras por vez.
+    """
+    accumulator = accumulator if accumulator is not None else SpatialErrorAccumulator()
+    if df.empty:
+        return accumulator
+    y_true, y_pred = df['y_rol'].to_list(), df['y_rol_pred'].to_list()
+    for _, _, true_block, pred_block in _iter_sample_blocks(y_true, y_pred, max(1, min(int(chunk_size), len(df)))):
+        accumulator.update(true_block, pred_block)
+    return accumulator
+
 # --- Funções Utilitárias (não diretamente no fluxo principal, mas podem ser úteis) ---
 def calculate_mape(y_true, y_pred):
     """
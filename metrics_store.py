@@ -0,0 +1,294 @@
+# metrics_store.py
+import os
+import json
+import sqlite3
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+# Armazenamento persistente (SQLite) das métricas de cada execução do lote: uma linha por
+# execução (runs), por tarefa executada (tasks), por tarefa/métrica/dia com o resumo e a
+# dispersão (daily_metrics) e por tarefa/amostra/dia (sample_metrics). Permite comparar
+# modelos entre centenas de execuções sem reabrir nenhum pickle.
+METRICS_STORE_SCHEMA_VERSION = 1
+STORE_METRICS = ("mse", "rmse", "r2")
+# Campos de 'stats' (ver OnlineMetricsAggregator.statistics) gravados em colunas próprias;
+# os quantis (q05, q50, ...) vão em JSON na coluna 'quantiles'
+STATS_COLUMNS = ("std", "min", "max", "ci95_low", "ci95_high")
+# Parâmetros da tarefa gravados como metadados (JSON) junto com cada resultado
+TASK_METADATA_PARAMS = ["visualization_pos", "output_directory", "metrics_backend", "streaming", "renderer", "spatial_metrics"]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started TEXT NOT NULL,
+    code_version TEXT,
+    config TEXT
+);
+CREATE TABLE IF NOT EXISTS tasks (
+    task_row_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id INTEGER NOT NULL REFERENCES runs(run_id) ON DELETE CASCADE,
+    task_id TEXT NOT NULL,
+    model_type TEXT,
+    model_file TEXT,
+    source_hash TEXT,
+    n_samples INTEGER,
+    params TEXT,
+    recorded TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_tasks_task_id ON tasks(task_id, task_row_id);
+CREATE INDEX IF NOT EXISTS idx_tasks_model_type ON tasks(model_type, task_row_id);
+CREATE INDEX IF NOT EXISTS idx_tasks_run_id ON tasks(run_id);
+CREATE TABLE IF NOT EXISTS daily_metrics (
+    task_row_id INTEGER NOT NULL REFERENCES tasks(task_row_id) ON DELETE CASCADE,
+    metric TEXT NOT NULL,
+    day INTEGER NOT NULL,
+    mean REAL,
+    count INTEGER,
+    std REAL,
+    min REAL,
+    max REAL,
+    ci95_low REAL,
+    ci95_high REAL,
+    quantiles TEXT,
+    PRIMARY KEY (task_row_id, metric, day)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS sample_metrics (
+    task_row_id INTEGER NOT NULL REFERENCES tasks(task_row_id) ON DELETE CASCADE,
+    sample_idx INTEGER NOT NULL,
+    day INTEGER NOT NULL,
+    sample_date TEXT,
+    mse REAL,
+    rmse REAL,
+    r2 REAL,
+    PRIMARY KEY (task_row_id, sample_idx, day)
+) WITHOUT ROWID;
+"""
+
+def _as_float(value):
+    """Float para o SQLite (NaN vira NULL)."""
+    value = float(value)
+    return None if np.isnan(value) else value
+
+def _as_array(values):
+    """Array float com NULL -> NaN (inverso de _as_float)."""
+    return np.array([np.nan if value is None else value for value in values], dtype=float)
+
+class MetricsStore:
+    """
+    Armazenamento de métricas em um arquivo SQLite. Gravação: start_run() e, para cada
+    tarefa processada, record_task(). Consulta: latest_task_results() devolve os resultados
+    no formato de main.py/reporting.py; list_runs(), daily_history(), compare_tasks() e
+    sample_metrics() devolvem DataFrames. Uso: with MetricsStore(caminho) as store: ...
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(db_dir, exist_ok=True)
+        self.connection = sqlite3.connect(db_path)
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.execute("PRAGMA journal_mode = WAL") # Leituras não bloqueiam a gravação de outro lote
+        with self.connection:
+            self.connection.executescript(_SCHEMA)
+            self.connection.execute(f"PRAGMA user_version = {METRICS_STORE_SCHEMA_VERSION}")
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    # --- Gravação ---
+
+    def start_run(self, code_version=None, config=None):
+        """Registra uma execução do lote e retorna seu run_id."""
+        with self.connection:
+            cursor = self.connection.execute(
+                "INSERT INTO runs (started, code_version, config) VALUES (?, ?, ?)",
+                (datetime.now().isoformat(timespec="seconds"), code_version,
+                 json.dumps(config, default=str) if config is not None else None))
+        return cursor.lastrowid
+
+    def record_task(self, run_id, task_params, result_entry, source_hash=None, reused=False):
+        """
+        Grava o resultado de uma tarefa (result_entry de run_model_task) na execução run_id:
+        médias e estatísticas por métrica/dia e, se presentes em 'per_sample', as métricas
+        de cada amostra. Tudo em uma única transação. Retorna o task_row_id.
+        'reused' marca (em "params") resultados reaproveitados do manifesto, não recalculados.
+        """
+        metrics_data = result_entry["metrics_data"]
+        per_sample = metrics_data.get("per_sample") or {}
+        sample_arrays = {metric_key: np.asarray(per_sample[metric_key], dtype=float)
+                         for metric_key in STORE_METRICS if metric_key in per_sample}
+        n_samples = next(iter(sample_arrays.values())).shape[0] if sample_arrays else None
+        metadata = {param_name: task_params.get(param_name) for param_name in TASK_METADATA_PARAMS}
+        metadata["reused"] = bool(reused)
+
+        with self.connection:
+            cursor = self.connection.execute(
+                "INSERT INTO tasks (run_id, task_id, model_type, model_file, source_hash, n_samples, params, recorded) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (run_id, result_entry["task_id"], result_entry.get("model_type"),
+                 os.path.abspath(task_params["model_file"]) if task_params.get("model_file") else None,
+                 source_hash, n_samples, json.dumps(metadata, default=str),
+                 datetime.now().isoformat(timespec="seconds")))
+            task_row_id = cursor.lastrowid
+
+            daily_rows = []
+            for metric_key in STORE_METRICS:
+                if metric_key not in metrics_data:
+                    continue
+                means = np.asarray(metrics_data[metric_key], dtype=float)
+                metric_stats = metrics_data.get("stats", {}).get(metric_key, {})
+                quantile_keys = sorted(key for key in metric_stats if key.startswith("q"))
+                for day_idx in range(len(means)):
+                    stats_values = [_as_float(metric_stats[column][day_idx]) if column in metric_stats else None
+                                    for column in STATS_COLUMNS]
+                    quantiles = {key: _as_float(metric_stats[key][day_idx]) for key in quantile_keys}
+                    daily_rows.append((task_row_id, metric_key, day_idx + 1, _as_float(means[day_idx]),
+                                       int(metric_stats["count"]) if "count" in metric_stats else None, *stats_values,
+                                       json.dumps(quantiles) if quantiles else None))
+            self.connection.executemany(
+                "INSERT INTO daily_metrics (task_row_id, metric, day, mean, count, std, min, max, ci95_low, ci95_high, quantiles) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", daily_rows)
+
+            if sample_arrays:
+                sample_dates = per_sample.get("dates") or [None] * n_samples
+                num_days = next(iter(sample_arrays.values())).shape[1]
+                columns = [sample_arrays.get(metric_key) for metric_key in STORE_METRICS]
+                self.connection.executemany(
+                    "INSERT INTO sample_metrics (task_row_id, sample_idx, day, sample_date, mse, rmse, r2) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    ((task_row_id, sample_idx, day_idx + 1, sample_dates[sample_idx],
+                      *(None if column is None else _as_float(column[sample_idx, day_idx]) for column in columns))
+                     for sample_idx in range(n_samples) for day_idx in range(num_days)))
+        return task_row_id
+
+    # --- Consulta ---
+
+    def _select_task_rows(self, task_ids=None, model_types=None, run_id=None):
+        """
+        Linhas de 'tasks' selecionadas: as da execução run_id ou, sem run_id, o registro mais
+        recente de cada task_id. Filtra por task_ids/model_types se informados.
+        """
+        if (task_ids is not None and not task_ids) or (model_types is not None and not model_types):
+            return []
+        conditions, parameters = [], []
+        if run_id is not None:
+            conditions.append("run_id = ?")
+            parameters.append(run_id)
+        else:
+            conditions.append("task_row_id IN (SELECT MAX(task_row_id) FROM tasks GROUP BY task_id)")
+        if task_ids is not None:
+            conditions.append(f"task_id IN ({', '.join('?' * len(task_ids))})")
+            parameters.extend(task_ids)
+        if model_types is not None:
+            conditions.append(f"model_type IN ({', '.join('?' * len(model_types))})")
+            parameters.extend(model_types)
+        rows = self.connection.execute(
+            "SELECT task_row_id, task_id, model_type, run_id FROM tasks WHERE " + " AND ".join(conditions) +
+            " ORDER BY task_id", parameters).fetchall()
+        if task_ids is not None:
+            order = {task_id: position for position, task_id in enumerate(task_ids)}
+            rows.sort(key=lambda row: order[row[1]])
+        return rows
+
+    def _load_metrics_data(self, task_row_id):
+        """Reconstrói o dict de métricas de process_model (médias por dia, 'stats' e 'per_sample') de uma tarefa."""
+        metrics_data = {}
+        stats = {}
+        rows = self.connection.execute(
+            "SELECT metric, mean, count, std, min, max, ci95_low, ci95_high, quantiles FROM daily_metrics "
+            "WHERE task_row_id = ? ORDER BY metric, day", (task_row_id,)).fetchall()
+        for metric_key in STORE_METRICS:
+            metric_rows = [row for row in rows if row[0] == metric_key]
+            if not metric_rows:
+                continue
+            metrics_data[metric_key] = _as_array([row[1] for row in metric_rows])
+            if metric_rows[0][2] is None:
+                continue # Resultado sem 'stats'
+            metric_stats = {"count": metric_rows[0][2], "mean": metrics_data[metric_key].copy()}
+            for column_offset, column in enumerate(STATS_COLUMNS):
+                metric_stats[column] = _as_array([row[3 + column_offset] for row in metric_rows])
+            quantiles_by_day = [json.loads(row[8]) if row[8] else {} for row in metric_rows]
+            for key in quantiles_by_day[0]:
+                metric_stats[key] = _as_array([day_quantiles.get(key) for day_quantiles in quantiles_by_day])
+            stats[metric_key] = metric_stats
+        if stats:
+            metrics_data["stats"] = stats
+
+        sample_rows = self.connection.execute(
+            "SELECT sample_idx, day, sample_date, mse, rmse, r2 FROM sample_metrics "
+            "WHERE task_row_id = ? ORDER BY sample_idx, day", (task_row_id,)).fetchall()
+        if sample_rows:
+            n_samples, num_days = sample_rows[-1][0] + 1, max(row[1] for row in sample_rows)
+            if len(sample_rows) == n_samples * num_days:
+                per_sample = {metric_key: _as_array([row[3 + metric_offset] for row in sample_rows]).reshape(n_samples, num_days)
+                              for metric_offset, metric_key in enumerate(STORE_METRICS)}
+                per_sample["dates"] = [row[2] for row in sample_rows if row[1] == 1]
+                metrics_data["per_sample"] = per_sample
+        return metrics_data
+
+    def latest_task_results(self, task_ids=None, model_types=None, run_id=None):
+        """
+        Resultados no formato de all_task_metrics_results ({'task_id', 'model_type',
+        'metrics_data'}), prontos para reporting.py: o mais recente de cada tarefa ou os da
+        execução run_id. Com task_ids, segue a ordem informada.
+        """
+        return [{"task_id": task_id, "model_type": model_type, "run_id": task_run_id,
+                 "metrics_data": self._load_metrics_data(task_row_id)}
+                for task_row_id, task_id, model_type, task_run_id in self._select_task_rows(task_ids, model_types, run_id)]
+
+    def list_runs(self):
+        """DataFrame com as execuções registradas e o número de tarefas gravadas em cada uma."""
+        return pd.read_sql_query(
+            "SELECT runs.run_id, runs.started, runs.code_version, COUNT(tasks.task_row_id) AS n_tasks "
+            "FROM runs LEFT JOIN tasks ON tasks.run_id = runs.run_id GROUP BY runs.run_id ORDER BY runs.run_id",
+            self.connection)
+
+    def daily_history(self, metric="rmse", task_ids=None, model_types=None):
+        """
+        Histórico de uma métrica entre execuções: DataFrame longo com run_id, started,
+        task_id, model_type, day, mean, ci95_low e ci95_high de cada registro de tarefa.
+        """
+        conditions, parameters = ["daily_metrics.metric = ?"], [metric]
+        if task_ids is not None:
+            conditions.append(f"tasks.task_id IN ({', '.join('?' * len(task_ids))})")
+            parameters.extend(task_ids)
+        if model_types is not None:
+            conditions.append(f"tasks.model_type IN ({', '.join('?' * len(model_types))})")
+            parameters.extend(model_types)
+        return pd.read_sql_query(
+            "SELECT tasks.run_id, runs.started, tasks.task_id, tasks.model_type, daily_metrics.day, "
+            "daily_metrics.mean, daily_metrics.ci95_low, daily_metrics.ci95_high "
+            "FROM daily_metrics JOIN tasks ON tasks.task_row_id = daily_metrics.task_row_id "
+            "JOIN runs ON runs.run_id = tasks.run_id WHERE " + " AND ".join(conditions) +
+            " ORDER BY tasks.run_id, tasks.task_id, daily_metrics.day", self.connection, params=parameters)
+
+    def compare_tasks(self, metric="rmse", task_ids=None, model_types=None, run_id=None):
+        """Tabela tarefa x dia com a média de 'metric' (registro mais recente de cada tarefa ou da execução run_id)."""
+        rows = self._select_task_rows(task_ids, model_types, run_id)
+        table = {}
+        for task_row_id, task_id, _, _ in rows:
+            day_means = self.connection.execute(
+                "SELECT day, mean FROM daily_metrics WHERE task_row_id = ? AND metric = ? ORDER BY day",
+                (task_row_id, metric)).fetchall()
+            table[task_id] = {day: (np.nan if mean is None else mean) for day, mean in day_means}
+        comparison = pd.DataFrame.from_dict(table, orient="index")
+        comparison.index.name = "task_id"
+        comparison.columns.name = "day"
+        return comparison
+
+    def sample_metrics(self, task_id, run_id=None):
+        """DataFrame (sample_idx, sample_date, day, mse, rmse, r2) do registro mais recente da tarefa (ou da execução run_id)."""
+        rows = self._select_task_rows([task_id], None, run_id)
+        if not rows:
+            return pd.DataFrame(columns=["sample_idx", "sample_date", "day", *STORE_METRICS])
+        return pd.read_sql_query(
+            "SELECT sample_idx, sample_date, day, mse, rmse, r2 FROM sample_metrics "
+            "WHERE task_row_id = ? ORDER BY sample_idx, day", self.connection, params=(rows[0][0],))
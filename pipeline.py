@@ -0,0 +1,323 @@
+# pipeline.py
+import os
+import json
+import time
+import queue
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from processor import load_model_stage, compute_model_stage, render_model_stage
+from instrumentation import configure_instrumentation, set_current_task, span
+
+# Executor em pipeline do lote: os três estágios de process_model rodam em paralelo para
+# tarefas diferentes, ligados por filas limitadas. A leitura (E/S: pickle/cache) roda em um
+# pool de threads, o cálculo das métricas em threads (NumPy libera o GIL nas reduções) e a
+# renderização/gravação em um pool de processos, então a tarefa N+1 é lida enquanto a tarefa
+# N é renderizada. As filas limitam quantas tarefas carregadas ficam em memória ao mesmo tempo.
+DEFAULT_PIPELINE_LOAD_WORKERS = 2
+DEFAULT_PIPELINE_COMPUTE_WORKERS = 1
+DEFAULT_PIPELINE_RENDER_WORKERS = 2
+DEFAULT_PIPELINE_QUEUE_SIZE = 2
+PIPELINE_STAGES = ("load", "compute", "render")
+PIPELINE_STATS_FILENAME = "pipeline_estatisticas.json"
+_STAGE_DONE = object() # Marca de fim do estágio anterior nas filas
+
+class StageStats:
+    """
+    Contadores de um estágio: tarefas concluídas e com falha, tempo ocupado, tempo ocioso
+    esperando entrada ('wait_s') e tempo bloqueado com a fila de saída cheia ('blocked_s').
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.items = 0
+        self.failed = 0
+        self.busy_s = 0.0
+        self.wait_s = 0.0
+        self.blocked_s = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, **deltas):
+        with self._lock:
+            for counter_name, delta in deltas.items():
+                setattr(self, counter_name, getattr(self, counter_name) + delta)
+
+    def summary(self, wall_s):
+        """Contadores e utilização (tempo ocupado / (parede x workers))."""
+        return {"workers": self.workers, "items": self.items, "failed": self.failed,
+                "busy_s": self.busy_s, "wait_s": self.wait_s, "blocked_s": self.blocked_s,
+                "utilization": self.busy_s / (wall_s * self.workers) if wall_s > 0 else 0.0}
+
+class MonitoredQueue:
+    """
+    Fila limitada entre dois estágios. Registra a profundidade a cada put/get (máxima e média
+    ponderada pelo tempo) e soma nos StageStats o tempo bloqueado do produtor e o tempo de
+    espera do consumidor.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._start_time = time.perf_counter()
+        self._last_time = self._start_time
+        self._last_depth = 0
+        self._depth_time_integral = 0.0
+        self.max_depth = 0
+
+    def _record_depth(self):
+        with self._lock:
+            now = time.perf_counter()
+            self._depth_time_integral += self._last_depth * (now - self._last_time)
+            self._last_time = now
+            self._last_depth = self._queue.qsize()
+            self.max_depth = max(self.max_depth, self._last_depth)
+
+    def put(self, item, producer_stats=None):
+        t_start = time.perf_counter()
+        self._queue.put(item)
+        if producer_stats is not None:
+            producer_stats.add(blocked_s=time.perf_counter() - t_start)
+        self._record_depth()
+
+    def get(self, consumer_stats=None):
+        t_start = time.perf_counter()
+        item = self._queue.get()
+        if consumer_stats is not None:
+            consumer_stats.add(wait_s=time.perf_counter() - t_start)
+        self._record_depth()
+        return item
+
+    def summary(self):
+        self._record_depth()
+        elapsed = self._last_time - self._start_time
+        return {"maxsize": self.maxsize, "max_depth": self.max_depth,
+                "mean_depth": self._depth_time_integral / elapsed if elapsed > 0 else 0.0}
+
+def _run_render_stage(task_params, visualization_samples, spatial_accumulator):
+    """
+    Estágio de renderização de uma tarefa, em um processo do pool.
+    Retorna (segundos, mensagem de erro ou None).
+    """
+    if task_params.get("trace_dir"):
+        configure_instrumentation(task_params["trace_dir"]) # Workers do pool não são criados por fork
+    set_current_task(task_params["task_id"])
+    t_start = time.perf_counter()
+    try:
+        with span("pipeline_render", category="pipeline"):
+            render_model_stage(task_params["model_type"], task_params["output_directory"],
+                               task_params["visualization_pos"], visualization_samples,
+                               spatial_accumulator=spatial_accumulator, render_workers=task_params["render_workers"],
+                               renderer=task_params["renderer"], animation_format=task_params["animation_format"],
+                               color_limits=task_params.get("color_limits"))
+        return time.perf_counter() - t_start, None
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return time.perf_counter() - t_start, str(e)
+    finally:
+        set_current_task(None)
+
+def _render_pool_context():
+    """
+    Contexto dos processos de renderização: forkserver (ou spawn), porque o processo principal
+    já tem as threads de leitura e cálculo rodando e um fork copiaria travas em uso.
+    """
+    start_methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in start_methods else "spawn")
+
+def run_tasks_pipeline(prepared_tasks, load_workers=DEFAULT_PIPELINE_LOAD_WORKERS,
+                       compute_workers=DEFAULT_PIPELINE_COMPUTE_WORKERS, render_workers=DEFAULT_PIPELINE_RENDER_WORKERS,
+                       queue_size=DEFAULT_PIPELINE_QUEUE_SIZE):
+    """
+    Executa as tarefas (lista de (índice, task_params) de main.prepare_model_task) no pipeline
+    leitura -> cálculo -> renderização.
+
+    Parameters:
+    -----------
+    load_workers, compute_workers : int
+        Threads dos estágios de leitura e de cálculo.
+    render_workers : int
+        Processos do estágio de renderização (cada tarefa ainda usa seus 'render_workers'
+        internos para os artefatos).
+    queue_size : int
+        Capacidade das filas leitura -> cálculo e cálculo -> renderização. Com as filas
+        cheias, o estágio anterior espera, limitando as tarefas carregadas em memória.
+
+    Returns:
+    --------
+    tuple
+        ({índice_da_tarefa: (status, result_entry)}, estatísticas) no formato de
+        main.run_tasks_in_pool; as estatísticas têm, por estágio, tarefas, tempos e
+        utilização e, por fila, a profundidade máxima e média.
+    """
+    load_workers, compute_workers, render_workers, queue_size = (
+        max(1, int(value)) for value in (load_workers, compute_workers, render_workers, queue_size))
+    results = {}
+    results_lock = threading.Lock()
+    stage_stats = {"load": StageStats(load_workers), "compute": StageStats(compute_workers),
+                   "render": StageStats(render_workers)}
+    pending_tasks = queue.Queue()
+    for prepared_task in prepared_tasks:
+        pending_tasks.put(prepared_task)
+    loaded_queue = MonitoredQueue(queue_size)
+    computed_queue = MonitoredQueue(queue_size)
+    pipeline_start = time.perf_counter()
+
+    def fail_task(task_index, task_params, stage_name):
+        print(f"  ERRO: Tarefa '{task_params['task_id']}' falhou no estágio '{stage_name}' do pipeline.")
+        stage_stats[stage_name].add(failed=1)
+        with results_lock:
+            results[task_index] = ("failed", None)
+
+    def load_worker():
+        while True:
+            try:
+                task_index, task_params = pending_tasks.get_nowait()
+            except queue.Empty:
+                return
+            print(f"  [pipeline] Lendo tarefa '{task_params['task_id']}'...")
+            set_current_task(task_params["task_id"])
+            t_start = time.perf_counter()
+            try:
+                with span("pipeline_load", category="pipeline"):
+                    loaded_ok, df_loaded = load_model_stage(task_params["model_file"], task_params["model_type"],
+                                                            cache_dir=task_params["cache_dir"],
+                                                            streaming=task_params["streaming"],
+                                                            precision=task_params["precision"])
+            except Exception as e:
+                print(f"  ERRO INESPERADO na leitura da tarefa '{task_params['task_id']}': {e}")
+                loaded_ok, df_loaded = False, None
+            finally:
+                stage_stats["load"].add(busy_s=time.perf_counter() - t_start)
+                set_current_task(None)
+            if not loaded_ok:
+                fail_task(task_index, task_params, "load")
+                continue
+            stage_stats["load"].add(items=1)
+            loaded_queue.put((task_index, task_params, df_loaded), stage_stats["load"])
+            del df_loaded
+
+    def compute_worker():
+        while True:
+            item = loaded_queue.get(stage_stats["compute"])
+            if item is _STAGE_DONE:
+                return
+            task_index, task_params, df_loaded = item
+            item = None
+            print(f"  [pipeline] Calculando métricas da tarefa '{task_params['task_id']}'...")
+            set_current_task(task_params["task_id"])
+            t_start = time.perf_counter()
+            try:
+                with span("pipeline_compute", category="pipeline"):
+                    computed = compute_model_stage(task_params["model_type"], task_params["model_file"], df_loaded,
+                                                   task_params["visualization_pos"],
+                                                   metrics_backend=task_params["metrics_backend"],
+                                                   cache_dir=task_params["cache_dir"],
+                                                   streaming=task_params["streaming"],
+                                                   chunk_size=task_params["chunk_size"],
+                                                   spatial_metrics=task_params["spatial_metrics"],
+                                                   precision=task_params["precision"],
+                                                   visualization_select=task_params["visualization_select"],
+                                                   select_metric=task_params["visualization_select_metric"],
+                                                   select_day=task_params["visualization_select_day"])
+            except Exception as e:
+                print(f"  ERRO INESPERADO no cálculo da tarefa '{task_params['task_id']}': {e}")
+                import traceback
+                traceback.print_exc()
+                computed = None
+            finally:
+                del df_loaded
+                stage_stats["compute"].add(busy_s=time.perf_counter() - t_start)
+                set_current_task(None)
+            if computed is None:
+                fail_task(task_index, task_params, "compute")
+                continue
+            stage_stats["compute"].add(items=1)
+            computed_queue.put((task_index, task_params, computed), stage_stats["compute"])
+            del computed
+
+    def render_dispatcher(executor):
+        # Um slot por processo: a próxima tarefa só sai da fila quando há processo livre, então a
+        # profundidade da fila cálculo -> renderização mostra quanto o estágio de renderização atrasa
+        render_slots = threading.BoundedSemaphore(render_workers)
+
+        def on_render_done(future, task_index, task_params, aggregated_metrics):
+            render_slots.release()
+            try:
+                elapsed, error = future.result()
+            except Exception as e: # Inclui BrokenProcessPool (worker encerrado, ex: OOM)
+                print(f"  ERRO: Processo de renderização encerrado durante a tarefa '{task_params['task_id']}': {e}")
+                fail_task(task_index, task_params, "render")
+                return
+            stage_stats["render"].add(items=1, busy_s=elapsed)
+            if error is not None:
+                print(f"  AVISO: Renderização da tarefa '{task_params['task_id']}' terminou com erro: {error}")
+            print(f"  Tarefa '{task_params['task_id']}' processada com sucesso.")
+            with results_lock:
+                results[task_index] = ("success", {"task_id": task_params["task_id"],
+                                                   "model_type": task_params["model_type"],
+                                                   "metrics_data": aggregated_metrics})
+
+        while True:
+            render_slots.acquire()
+            item = computed_queue.get(stage_stats["render"])
+            if item is _STAGE_DONE:
+                return
+            task_index, task_params, (aggregated_metrics, visualization_samples, spatial_accumulator) = item
+            item = None
+            print(f"  [pipeline] Renderizando tarefa '{task_params['task_id']}'...")
+            try:
+                future = executor.submit(_run_render_stage, task_params, visualization_samples, spatial_accumulator)
+            except Exception as e:
+                render_slots.release()
+                print(f"  ERRO: Não foi possível despachar a renderização da tarefa '{task_params['task_id']}': {e}")
+                fail_task(task_index, task_params, "render")
+                continue
+            future.add_done_callback(lambda done, task_index=task_index, task_params=task_params,
+                                     aggregated_metrics=aggregated_metrics:
+                                     on_render_done(done, task_index, task_params, aggregated_metrics))
+
+    load_threads = [threading.Thread(target=load_worker, name=f"pipeline-load-{k}") for k in range(load_workers)]
+    compute_threads = [threading.Thread(target=compute_worker, name=f"pipeline-compute-{k}") for k in range(compute_workers)]
+    with ProcessPoolExecutor(max_workers=render_workers, mp_context=_render_pool_context()) as executor:
+        dispatcher_thread = threading.Thread(target=render_dispatcher, args=(executor,), name="pipeline-render")
+        for thread in load_threads + compute_threads + [dispatcher_thread]:
+            thread.start()
+        for thread in load_threads:
+            thread.join()
+        for _ in compute_threads:
+            loaded_queue.put(_STAGE_DONE)
+        for thread in compute_threads:
+            thread.join()
+        computed_queue.put(_STAGE_DONE)
+        dispatcher_thread.join()
+    # Saindo do 'with', o pool espera as renderizações em andamento (e seus callbacks)
+
+    wall_s = time.perf_counter() - pipeline_start
+    pipeline_stats = {
+        "wall_s": wall_s,
+        "tasks": len(prepared_tasks),
+        "stages": {stage_name: stage_stats[stage_name].summary(wall_s) for stage_name in PIPELINE_STAGES},
+        "queues": {"load_to_compute": loaded_queue.summary(), "compute_to_render": computed_queue.summary()},
+    }
+    return results, pipeline_stats
+
+def write_pipeline_stats(pipeline_stats, reports_output_dir, filename=PIPELINE_STATS_FILENAME):
+    """Grava as estatísticas do pipeline em JSON e imprime utilização e filas. Retorna o caminho."""
+    stats_path = os.path.join(reports_output_dir, filename)
+    with open(stats_path, 'w') as f:
+        json.dump(pipeline_stats, f, indent=2)
+
+    print(f"  Pipeline: {pipeline_stats['tasks']} tarefa(s) em {pipeline_stats['wall_s']:.1f}s")
+    for stage_name, stage in pipeline_stats["stages"].items():
+        print(f"    {stage_name}: {stage['workers']} worker(s), {stage['items']} tarefa(s), {stage['failed']} falha(s), "
+              f"utilização {stage['utilization']:.0%} (ocupado {stage['busy_s']:.1f}s, esperando entrada "
+              f"{stage['wait_s']:.1f}s, bloqueado na saída {stage['blocked_s']:.1f}s)")
+    for queue_name, queue_stats in pipeline_stats["queues"].items():
+        print(f"    fila {queue_name}: profundidade máxima {queue_stats['max_depth']}/{queue_stats['maxsize']}, "
+              f"média {queue_stats['mean_depth']:.2f}")
+    busiest_stage = max(pipeline_stats["stages"], key=lambda stage_name: pipeline_stats["stages"][stage_name]["utilization"])
+    print(f"    Estágio mais ocupado (candidato a mais workers): {busiest_stage}")
+    print(f"  Estatísticas do pipeline salvas em: {stats_path}")
+    return stats_path
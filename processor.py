@@ -1,32 +1,162 @@
 # processor.py
 import os
+from contextlib import contextmanager
 import pandas as pd
 import numpy as np
-from metrics import posprocessDataframe, calculate_model_metrics
-from visualizer import generate_visualizations # Assumindo que visualizer.py está atualizado
+from metrics import (posprocessDataframe, calculate_model_metrics, get_metrics_backend, OnlineMetricsAggregator,
+                     stack_sample_metrics, SpatialErrorAccumulator, accumulate_spatial_errors)
+from forecast_cache import ForecastCache
+from chunked_forecast import ChunkedForecastReader, is_chunked_forecast, CHUNKED_READ_ERRORS
+from grid_registry import deduplicate_grid_columns, get_grid
+from instrumentation import instrumented
+from visualizer import generate_sample_visualizations, DEFAULT_RENDER_WORKERS, DEFAULT_RENDERER
+from sample_index import select_samples, DEFAULT_SELECTION_METRIC
+from animation_writers import DEFAULT_ANIMATION_FORMAT
 
 # DEFINIR A CONSTANTE GLOBALMENTE NO TOPO DO ARQUIVO
 NUM_DAYS_METRICS = 7 
+# Amostras por bloco no modo streaming (cada bloco ocupa ~chunk x 127440 x 7 x 8 bytes por array)
+DEFAULT_STREAM_CHUNK_SIZE = 16
+# Precisão de 'y_rol'/'y_rol_pred' da leitura à renderização. Em "float32" (o tipo que os modelos
+# emitem) cada amostra ocupa metade da memória; as somas das métricas continuam em float64.
+PRECISION_DTYPES = {"float64": np.float64, "float32": np.float32}
+DEFAULT_PRECISION = "float64"
 
-def process_model(model_type, file_path, output_dir, pos=0):
+def resolve_precision(precision):
+    """Valida a precisão; desconhecida vira o padrão, com aviso."""
+    precision = (precision or DEFAULT_PRECISION).lower()
+    if precision not in PRECISION_DTYPES:
+        print(f"    Aviso: precisão '{precision}' desconhecida (opções: {', '.join(PRECISION_DTYPES)}). Usando '{DEFAULT_PRECISION}'.")
+        return DEFAULT_PRECISION
+    return precision
+
+@instrumented()
+def process_model(model_type, file_path, output_dir, pos=0, metrics_backend=None, cache_dir=None,
+                  streaming=False, chunk_size=DEFAULT_STREAM_CHUNK_SIZE, render_workers=DEFAULT_RENDER_WORKERS,
+                  renderer=DEFAULT_RENDERER, spatial_metrics=False, animation_format=DEFAULT_ANIMATION_FORMAT,
+                  precision=DEFAULT_PRECISION, color_limits=None, visualization_select=None,
+                  select_metric=DEFAULT_SELECTION_METRIC, select_day=None):
     """
     Processa um modelo, calcula métricas e gera visualizações.
     'pos' do JSON é usado para selecionar a amostra do df (se houver múltiplas)
     e também como o 'day_for_main_viz' para generate_visualizations.
+    'metrics_backend' seleciona o backend das métricas diárias (ver metrics.get_metrics_backend).
+    'cache_dir' ativa o cache em disco dos arrays redimensionados (ver forecast_cache.py).
+    'streaming' processa as amostras em blocos de 'chunk_size' (ver stream_model_metrics),
+    mantendo em memória apenas os agregados e a amostra de visualização.
+    'render_workers' é o número de processos que renderizam os artefatos em paralelo.
+    'renderer' escolhe o renderizador dos GIFs e do grid ("cartopy" ou "fast_raster").
+    'spatial_metrics' acumula viés, MAE e RMSE por ponto de grade e por dia sobre todas as
+    amostras (SpatialErrorAccumulator) e gera os mapas de erro espacial.
+    'animation_format' é o formato das animações ("gif", "webp", "apng" ou "mp4", ver animation_writers.py).
+    'precision' é a precisão dos campos ("float64" ou "float32", ver PRECISION_DTYPES); o cache
+    em disco guarda uma entrada por precisão.
+    'color_limits' fixa (vmin, vmax) dos mapas, ex: a escala comum do lote (ver colorscale.py).
+    'visualization_select' (ex: ["best", "median", "worst", 3]) troca a amostra 'pos' pelas
+    amostras escolhidas pelas métricas por amostra ('select_metric', na média dos dias ou no
+    dia 'select_day', 0-based), todas renderizadas em uma única passada (ver sample_index.py).
+    'file_path' também pode ser um arquivo no formato em blocos (ver chunked_forecast.py): nesse
+    caso o modo streaming é sempre usado e as amostras escolhidas são lidas diretamente.
     """
     print(f"Iniciando processamento do modelo {model_type}...")
     print(f"  Lendo modelo de: {file_path}")
     print(f"  Diretório de saída da tarefa: {output_dir}")
     print(f"  Posição/Dia de destaque para visualização principal: {pos + 1} (índice {pos})")
 
-    df_loaded = load_model_data(file_path, model_type)
-
-    if df_loaded is None or df_loaded.empty:
+    # Os três estágios (leitura, cálculo, renderização) também são usados separadamente pelo
+    # executor em pipeline (pipeline.py), que sobrepõe os estágios de tarefas diferentes
+    precision = resolve_precision(precision)
+    loaded_ok, df_loaded = load_model_stage(file_path, model_type, cache_dir=cache_dir, streaming=streaming,
+                                            precision=precision)
+    computed = None
+    if loaded_ok:
+        computed = compute_model_stage(model_type, file_path, df_loaded, pos, metrics_backend=metrics_backend,
+                                       cache_dir=cache_dir, streaming=streaming, chunk_size=chunk_size,
+                                       spatial_metrics=spatial_metrics, precision=precision,
+                                       visualization_select=visualization_select, select_metric=select_metric,
+                                       select_day=select_day)
+    del df_loaded
+    if computed is None:
         print(f"Falha ao carregar/processar dados para o modelo {model_type} do arquivo {file_path}.")
         print(f"Abortando processamento da tarefa para {model_type}.")
-        return None 
+        return None
+
+    aggregated_metrics, visualization_samples, spatial_accumulator = computed
+    render_model_stage(model_type, output_dir, pos, visualization_samples,
+                       spatial_accumulator=spatial_accumulator, render_workers=render_workers, renderer=renderer,
+                       animation_format=animation_format, color_limits=color_limits)
+
+    print(f"\nProcessamento do modelo {model_type} concluído! Resultados em: {output_dir}")
+    return aggregated_metrics
+
+@instrumented()
+def load_model_stage(file_path, model_type_info="modelo", cache_dir=None, streaming=False, precision=DEFAULT_PRECISION):
+    """
+    Estágio de leitura (E/S) de process_model. Retorna (ok, df_loaded): df_loaded é o
+    DataFrame de read_model_frame, ainda sem as métricas diárias. No modo streaming os blocos
+    são lidos no estágio de cálculo, então aqui apenas a entrada do cache em disco é
+    populada (se 'cache_dir' for informado) e df_loaded é None.
+    Arquivos no formato em blocos (chunked_forecast.py) são sempre processados em streaming,
+    sem cache: os blocos já são lidos seletivamente do próprio arquivo.
+    """
+    if is_chunked_forecast(file_path):
+        print(f"    Arquivo no formato em blocos: métricas em streaming e leitura direta das amostras de visualização.")
+        return True, None
+    if streaming:
+        if cache_dir:
+            try:
+                if open_cached_model_arrays(file_path, cache_dir, precision=precision) is None:
+                    return False, None
+            except Exception as e_cache:
+                print(f"    AVISO: Falha ao preparar o cache em {cache_dir}: {e_cache}. Leitura adiada para o cálculo.")
+        return True, None
+
+    print(f"    Carregando dados para {model_type_info} do arquivo: {file_path}")
+    df_loaded = read_model_frame(file_path, cache_dir=cache_dir, precision=precision)
+    return df_loaded is not None and not df_loaded.empty, df_loaded
+
+@instrumented()
+def compute_model_stage(model_type, file_path, df_loaded, pos, metrics_backend=None, cache_dir=None, streaming=False,
+                        chunk_size=DEFAULT_STREAM_CHUNK_SIZE, spatial_metrics=False, precision=DEFAULT_PRECISION,
+                        visualization_select=None, select_metric=DEFAULT_SELECTION_METRIC, select_day=None):
+    """
+    Estágio de cálculo de process_model: métricas diárias e agregadas, seleção das amostras de
+    visualização e, com 'spatial_metrics', o acumulador de erro espacial.
+    Retorna (aggregated_metrics, amostras_para_visualização, spatial_accumulator) ou None em
+    caso de falha; amostras_para_visualização é uma lista de (rótulo, amostra, índice_efetivo),
+    com rótulo None para a amostra 'pos' (sem 'visualization_select').
+    """
+    spatial_accumulator = SpatialErrorAccumulator() if spatial_metrics else None
+    if streaming or is_chunked_forecast(file_path):
+        print(f"  Modo streaming: blocos de {chunk_size} amostras.")
+        aggregated_metrics, single_sample_data_for_viz, effective_pos_for_sample_selection = stream_model_metrics(
+            file_path, model_type, pos, metrics_backend=metrics_backend, cache_dir=cache_dir, chunk_size=chunk_size,
+            spatial_accumulator=spatial_accumulator, precision=precision)
+        if aggregated_metrics is None:
+            return None
+        selected_positions = choose_visualization_samples(aggregated_metrics, visualization_select, select_metric, select_day)
+        if selected_positions:
+            # As amostras escolhidas só são conhecidas depois da passada: uma segunda leitura
+            # copia apenas as linhas escolhidas (leitura direta no cache ou no formato em blocos)
+            rows = fetch_sample_rows(file_path, model_type, [position for _, position in selected_positions],
+                                     aggregated_metrics['per_sample'], cache_dir=cache_dir, chunk_size=chunk_size,
+                                     precision=precision)
+            selected_positions = [(label, position) for label, position in selected_positions if position in rows]
+            visualization_samples = [(label, rows[position], position) for label, position in selected_positions]
+    else:
+        df_loaded = add_daily_metrics(df_loaded, file_path, metrics_backend=metrics_backend)
+        if df_loaded is None or df_loaded.empty:
+            return None
 
-    aggregated_metrics = calculate_model_metrics(df_loaded) 
+        aggregated_metrics = calculate_model_metrics(df_loaded) 
+        single_sample_data_for_viz, effective_pos_for_sample_selection = select_visualization_sample(df_loaded, pos)
+        selected_positions = choose_visualization_samples(aggregated_metrics, visualization_select, select_metric, select_day)
+        if selected_positions:
+            visualization_samples = [(label, df_loaded.iloc[position], position) for label, position in selected_positions]
+        if spatial_accumulator is not None:
+            accumulate_spatial_errors(df_loaded, accumulator=spatial_accumulator)
+    if not selected_positions:
+        visualization_samples = [(None, single_sample_data_for_viz, effective_pos_for_sample_selection)]
 
     print("\n===== MÉTRICAS AGREGADAS (Média sobre amostras, por dia) =====")
     if aggregated_metrics and isinstance(aggregated_metrics, dict) and \
@@ -34,16 +164,118 @@ def process_model(model_type, file_path, output_dir, pos=0):
        len(aggregated_metrics['rmse']) > 0 and len(aggregated_metrics['r2']) > 0:
         for day_idx in range(min(NUM_DAYS_METRICS, len(aggregated_metrics['rmse']))): # Usar NUM_DAYS_METRICS aqui também
             print(f"Dia {day_idx+1}:")
-            print(f"  RMSE Médio: {aggregated_metrics['rmse'][day_idx]:.4f}")
-            print(f"  R² Médio: {aggregated_metrics['r2'][day_idx]:.4f}")
+            print(f"  RMSE Médio: {aggregated_metrics['rmse'][day_idx]:.4f}{_format_spread(aggregated_metrics, 'rmse', day_idx)}")
+            print(f"  R² Médio: {aggregated_metrics['r2'][day_idx]:.4f}{_format_spread(aggregated_metrics, 'r2', day_idx)}")
             if 'mse' in aggregated_metrics and len(aggregated_metrics['mse']) > day_idx:
                  print(f"  MSE Médio: {aggregated_metrics['mse'][day_idx]:.4f}")
     else:
         print("AVISO: Métricas agregadas não foram calculadas corretamente ou estão ausentes.")
+    return aggregated_metrics, visualization_samples, spatial_accumulator
+
+def choose_visualization_samples(aggregated_metrics, visualization_select, select_metric=DEFAULT_SELECTION_METRIC,
+                                 select_day=None):
+    """
+    [(rótulo, posição)] das amostras escolhidas por 'visualization_select' a partir de
+    aggregated_metrics['per_sample'] (ver sample_index.select_samples); lista vazia se não
+    houver seleção configurada ou nenhuma amostra puder ser escolhida (usa-se então 'pos').
+    """
+    if not visualization_select:
+        return []
+    per_sample = aggregated_metrics.get('per_sample') or {}
+    try:
+        selected_positions = select_samples(per_sample, visualization_select, metric=select_metric, day=select_day)
+    except (KeyError, IndexError) as e:
+        print(f"  AVISO: Seleção de amostras indisponível ({e}). Usando a posição configurada.")
+        return []
+    if not selected_positions:
+        print("  AVISO: Nenhuma amostra selecionada por 'visualization_select'. Usando a posição configurada.")
+        return []
+    day_str = f"dia {select_day + 1}" if select_day is not None else "média dos dias"
+    print(f"  Amostras selecionadas por {select_metric.upper()} ({day_str}): "
+          + ", ".join(f"{label} = {position}" for label, position in selected_positions))
+    return selected_positions
 
+@instrumented()
+def render_model_stage(model_type, output_dir, pos, visualization_samples, spatial_accumulator=None, render_workers=DEFAULT_RENDER_WORKERS, renderer=DEFAULT_RENDERER,
+                       animation_format=DEFAULT_ANIMATION_FORMAT, color_limits=None):
+    """
+    Estágio de renderização/gravação de process_model: mapas de erro espacial (se houver
+    acumulador) e visualizações das amostras selecionadas ('visualization_samples', lista de
+    (rótulo, amostra, índice_efetivo) de compute_model_stage) em 'output_dir'.
+    """
     os.makedirs(output_dir, exist_ok=True)
+    visualization_samples = [(label, sample_row, effective_pos) for label, sample_row, effective_pos in visualization_samples
+                             if sample_row is not None and not sample_row.empty]
+    single_sample_data_for_viz = visualization_samples[0][1] if visualization_samples else None
+    spatial_error_maps = save_spatial_error_maps(spatial_accumulator, single_sample_data_for_viz, model_type, output_dir)
 
+    # 'pos' (vindo do JSON) também é o 'day_for_main_viz' (0-6)
+    # Garantir que este 'pos' seja válido como um índice de dia para as visualizações.
+    # Esta verificação já é feita no visualizer.py, mas pode ser útil aqui também.
+    # if not (0 <= pos < NUM_DAYS_METRICS):
+    #     print(f"  AVISO: Dia de destaque '{pos}' é inválido. Ajustando para 0.")
+    #     pos = 0 
+            
+    if not visualization_samples:
+        print(f"  ERRO: Não foi possível obter dados da amostra para visualização. Visualizações não serão geradas.")
+    else:
+        sample_descriptions = ", ".join(str(effective_pos) if label is None else f"{effective_pos} ({label})"
+                                        for label, _, effective_pos in visualization_samples)
+        print(f"\n  Gerando visualizações para a(s) amostra(s) de índice {sample_descriptions} (dia de destaque para visualizações principais: {pos+1})...")
+        print(f"\n  Iniciando geração de visualizações para {model_type}, destacando dia {pos + 1}, em: {output_dir}")
+        try:
+            generate_sample_visualizations([(label, sample_row) for label, sample_row, _ in visualization_samples],
+                                           model_type, output_dir, day_for_main_viz=pos,
+                                           render_workers=render_workers, renderer=renderer,
+                                           spatial_error_maps=spatial_error_maps, animation_format=animation_format,
+                                           color_limits=color_limits)
+        except Exception as e_vis:
+            print(f"  ERRO ao gerar visualizações para {model_type}: {e_vis}")
+            import traceback
+            traceback.print_exc()
+
+def save_spatial_error_maps(spatial_accumulator, sample_row, model_type, output_dir):
+    """
+    Converte o acumulador de erro espacial em mapas (dias, ny, nx) na grade da amostra de
+    visualização, grava-os em <model_type>_erro_espacial.npz (com lat/lon) e imprime o
+    resumo por dia. Retorna os mapas (ou None se desativado/sem dados).
+    """
+    if spatial_accumulator is None or sample_row is None or sample_row.get('lon') is None:
+        return None
+    spatial_error_maps = spatial_accumulator.maps(sample_row['lon'].shape)
+    if spatial_error_maps is None:
+        return None
+
+    print(f"\n===== ERRO ESPACIAL (por ponto de grade, {spatial_error_maps['count']} amostras) =====")
+    for day_idx in range(spatial_error_maps['bias'].shape[0]):
+        print(f"Dia {day_idx+1}: viés médio {np.mean(spatial_error_maps['bias'][day_idx]):.4f}, "
+              f"MAE médio {np.mean(spatial_error_maps['mae'][day_idx]):.4f}, "
+              f"RMSE máximo {np.max(spatial_error_maps['rmse'][day_idx]):.4f}")
+    maps_path = os.path.join(output_dir, f"{model_type}_erro_espacial.npz")
+    try:
+        np.savez_compressed(maps_path, lat=sample_row['lat'], lon=sample_row['lon'],
+                            **{map_key: spatial_error_maps[map_key] for map_key in ('bias', 'mae', 'rmse', 'count')})
+        print(f"  Mapas de erro espacial salvos em: {maps_path}")
+    except OSError as e:
+        print(f"  AVISO: Não foi possível salvar os mapas de erro espacial: {e}")
+    return spatial_error_maps
+
+def _format_spread(aggregated_metrics, metric_key, day_idx):
+    """Texto com desvio padrão e IC de 95% da média de uma métrica/dia, se disponíveis em 'stats'."""
+    metric_stats = aggregated_metrics.get('stats', {}).get(metric_key)
+    if not metric_stats:
+        return ""
+    return (f" (DP: {metric_stats['std'][day_idx]:.4f}, "
+            f"IC95%: [{metric_stats['ci95_low'][day_idx]:.4f}, {metric_stats['ci95_high'][day_idx]:.4f}])")
+
+@instrumented()
+def select_visualization_sample(df_loaded, pos):
+    """
+    Seleciona a linha do DataFrame usada nas visualizações.
+    Retorna (amostra, índice_efetivo); usa a amostra 0 se 'pos' for inválida.
+    """
     single_sample_data_for_viz = None
+    effective_pos_for_sample_selection = None
     if not df_loaded.empty:
         # Validar 'pos' contra o número de dias REALMENTE disponíveis após o reshape
         # No entanto, a 'pos' do JSON é para selecionar a linha/amostra, não o dia.
@@ -57,35 +289,309 @@ def process_model(model_type, file_path, output_dir, pos=0):
             effective_pos_for_sample_selection = 0
         
         single_sample_data_for_viz = df_loaded.iloc[effective_pos_for_sample_selection]
-        
-        # 'pos' (vindo do JSON) também é o 'day_for_main_viz' (0-6)
-        # Garantir que este 'pos' seja válido como um índice de dia para as visualizações.
-        # Esta verificação já é feita no visualizer.py, mas pode ser útil aqui também.
-        # if not (0 <= pos < NUM_DAYS_METRICS):
-        #     print(f"  AVISO: Dia de destaque '{pos}' é inválido. Ajustando para 0.")
-        #     pos = 0 
-            
-    if single_sample_data_for_viz is None or single_sample_data_for_viz.empty:
-        print(f"  ERRO: Não foi possível obter dados da amostra para visualização. Visualizações não serão geradas.")
+    return single_sample_data_for_viz, effective_pos_for_sample_selection
+
+@instrumented()
+def stream_model_metrics(file_path, model_type_info, pos, metrics_backend=None, cache_dir=None,
+                         chunk_size=DEFAULT_STREAM_CHUNK_SIZE, spatial_accumulator=None, precision=DEFAULT_PRECISION):
+    """
+    Calcula as métricas diárias em blocos de amostras (ver iter_model_chunks), mantendo
+    apenas os agregados por dia, as métricas de cada amostra ('per_sample') e a amostra
+    de índice 'pos' para as visualizações.
+    Retorna (aggregated_metrics, amostra_para_visualização, índice_efetivo), com as
+    mesmas médias por dia de calculate_model_metrics, ou (None, None, None) em caso de falha.
+    Com 'spatial_accumulator' (SpatialErrorAccumulator), os erros por ponto de grade são
+    acumulados na mesma passada.
+    """
+    compute_daily_metrics = get_metrics_backend(metrics_backend)
+    aggregator = OnlineMetricsAggregator()
+    sample_metric_blocks = [] # Métricas por amostra de cada bloco (n x dias, pequenas), para 'per_sample'
+    sample_dates = []
+    sample_for_viz = None
+    first_sample = None
+
+    try:
+        for start, chunk_frame, y_true_block, y_pred_block in iter_model_chunks(file_path, model_type_info, chunk_size, cache_dir,
+                                                                                precision=precision):
+            daily_metrics = compute_daily_metrics(y_true_block, y_pred_block, chunk_size=chunk_size)
+            aggregator.update(daily_metrics)
+            if spatial_accumulator is not None:
+                spatial_accumulator.update(y_true_block, y_pred_block)
+            sample_metric_blocks.append({metric_col_name: np.array(metric_block)
+                                         for metric_col_name, metric_block in daily_metrics.items()})
+            if 'data' in chunk_frame.columns:
+                sample_dates.extend(chunk_frame['data'])
+
+            if start == 0:
+                first_sample = _build_sample_row(chunk_frame, 0, y_true_block, y_pred_block, daily_metrics)
+            if start <= pos < start + len(chunk_frame):
+                sample_for_viz = _build_sample_row(chunk_frame, pos - start, y_true_block, y_pred_block, daily_metrics)
+    except Exception as e_stream:
+        print(f"    ERRO INESPERADO ao processar em streaming o arquivo {file_path}: {e_stream}")
+        import traceback
+        traceback.print_exc()
+        return None, None, None
+
+    if aggregator.count == 0:
+        return None, None, None
+    print(f"    Métricas diárias calculadas em streaming. Total de {aggregator.count} amostras válidas.")
+
+    effective_pos_for_sample_selection = pos
+    if sample_for_viz is None:
+        print(f"  AVISO: Posição de amostra '{pos}' é inválida para o conjunto carregado (tamanho {aggregator.count}). Usando a primeira amostra (índice 0).")
+        sample_for_viz = first_sample
+        effective_pos_for_sample_selection = 0
+    aggregated_metrics = aggregator.summary()
+    aggregated_metrics['stats'] = aggregator.statistics()
+    aggregated_metrics['per_sample'] = stack_sample_metrics(sample_metric_blocks, sample_dates or None)
+    return aggregated_metrics, sample_for_viz, effective_pos_for_sample_selection
+
+def _build_sample_row(chunk_frame, local_idx, y_true_block, y_pred_block, daily_metrics):
+    """Monta uma linha (pandas.Series) no formato de load_model_data, copiando os arrays do bloco."""
+    row_values = chunk_frame.iloc[local_idx].to_dict()
+    row_values['y_rol'] = np.array(y_true_block[local_idx])
+    row_values['y_rol_pred'] = np.array(y_pred_block[local_idx])
+    for metric_col_name, metric_block in daily_metrics.items():
+        row_values[metric_col_name] = np.array(metric_block[local_idx])
+    return pd.Series(row_values, name=chunk_frame.index[local_idx])
+
+def fetch_sample_rows(file_path, model_type_info, positions, per_sample, cache_dir=None,
+                      chunk_size=DEFAULT_STREAM_CHUNK_SIZE, precision=DEFAULT_PRECISION):
+    """
+    Relê apenas as amostras de 'positions' e as monta como em stream_model_metrics, com as
+    métricas diárias tiradas de 'per_sample' (sem recalcular). Com o cache ou no formato em
+    blocos, cada amostra é uma leitura direta (read_sample_row); sem cache, o pickle é
+    percorrido com iter_model_chunks até a última posição pedida.
+    Retorna {posição: pandas.Series}.
+    """
+    metric_columns = [(metric_key, metric_col_name)
+                      for metric_key, metric_col_name in (('mse', 'mse'), ('rmse', 'rmse'), ('r2', 'r2_score'))
+                      if metric_key in per_sample]
+    if cache_dir or is_chunked_forecast(file_path):
+        with open_model_arrays(file_path, cache_dir, precision=precision) as opened:
+            if opened is None:
+                return {}
+            frame, arrays = opened
+            return {position: read_sample_row(frame, arrays, position,
+                                              {metric_col_name: per_sample[metric_key][position]
+                                               for metric_key, metric_col_name in metric_columns})
+                    for position in positions if 0 <= position < len(frame)}
+
+    wanted = set(positions)
+    rows = {}
+    for start, chunk_frame, y_true_block, y_pred_block in iter_model_chunks(file_path, model_type_info, chunk_size, cache_dir,
+                                                                            precision=precision):
+        stop = start + len(chunk_frame)
+        local_positions = [position for position in wanted if start <= position < stop]
+        if not local_positions:
+            continue
+        daily_metrics = {metric_col_name: per_sample[metric_key][start:stop] for metric_key, metric_col_name in metric_columns}
+        for position in local_positions:
+            rows[position] = _build_sample_row(chunk_frame, position - start, y_true_block, y_pred_block, daily_metrics)
+        wanted.difference_update(local_positions)
+        if not wanted:
+            break
+    return rows
+
+def read_sample_row(frame, arrays, position, daily_metrics):
+    """
+    Monta a amostra 'position' (pandas.Series no formato de _build_sample_row) a partir de
+    (frame, arrays) de open_model_arrays, lendo só essa linha de cada array; lat/lon
+    apontam para a grade canônica. 'daily_metrics' = {coluna: métricas diárias da amostra}.
+    """
+    row_values = frame.iloc[position].to_dict()
+    for col_name, block in arrays.items():
+        row_values[col_name] = block[position] if col_name in ('lat', 'lon') else np.array(block[position])
+    if row_values.get('lat') is not None and row_values.get('lon') is not None:
+        grid = get_grid(row_values['lat'], row_values['lon'])
+        row_values['lat'], row_values['lon'] = grid.lat, grid.lon
+    for metric_col_name, metric_values in daily_metrics.items():
+        row_values[metric_col_name] = np.array(metric_values)
+    return pd.Series(row_values, name=frame.index[position])
+
+def open_cached_model_arrays(file_path, cache_dir, precision=DEFAULT_PRECISION):
+    """
+    Abre a entrada de file_path no cache em disco, populando-a a partir do pickle se
+    necessário. Retorna (frame, arrays) como ForecastCache.open_arrays (arrays em memmap
+    (n_amostras, ...), só com amostras válidas, na 'precision' pedida) ou None se o
+    arquivo não tiver dados. Para abrir também arquivos no formato em blocos, use open_model_arrays.
+    """
+    forecast_cache = ForecastCache(cache_dir, precision=precision)
+    opened = forecast_cache.open_arrays(file_path)
+    if opened is None:
+        df = read_model_pickle(file_path, precision=precision)
+        if df is None or df.empty:
+            return None
+        forecast_cache.store(file_path, df)
+        del df
+        opened = forecast_cache.open_arrays(file_path)
     else:
-        print(f"\n  Gerando visualizações para a amostra de índice {effective_pos_for_sample_selection} (dia de destaque para visualizações principais: {pos+1})...")
-        try:
-            generate_visualizations(single_sample_data_for_viz, model_type, output_dir, day_for_main_viz=pos)
-        except Exception as e_vis:
-            print(f"  ERRO ao gerar visualizações para {model_type}: {e_vis}")
-            import traceback
-            traceback.print_exc()
+        print(f"    Arrays reabertos do cache em disco ({cache_dir}); pickle não decodificado.")
+    frame, arrays, _ = opened
+    return frame, arrays
 
-    print(f"\nProcessamento do modelo {model_type} concluído! Resultados em: {output_dir}")
-    return aggregated_metrics
+@contextmanager
+def open_model_arrays(file_path, cache_dir, precision=DEFAULT_PRECISION):
+    """
+    Gerenciador de contexto que fornece (frame, arrays) de file_path, ou None se não houver dados.
+    Um arquivo no formato em blocos é aberto diretamente, sem cache: os arrays são ChunkedArray
+    (chunked_forecast.py), que descomprimem só os blocos indexados, válidos até a saída do
+    bloco 'with', quando o arquivo é fechado; um arquivo ilegível vira None, com aviso.
+    Pickles usam o cache em disco (open_cached_model_arrays).
+    """
+    if not is_chunked_forecast(file_path):
+        yield open_cached_model_arrays(file_path, cache_dir, precision=precision)
+        return
+
+    print(f"    Arquivo no formato em blocos; blocos lidos sob demanda de {file_path}.")
+    reader, opened = None, None
+    try:
+        reader = ChunkedForecastReader(file_path)
+        frame, arrays, _ = reader.open_arrays(dtype=PRECISION_DTYPES[precision])
+        opened = (frame, arrays) if len(frame) else None
+    except CHUNKED_READ_ERRORS as e_chunked:
+        print(f"    ERRO CRÍTICO ao ler o arquivo em blocos {file_path}: {e_chunked}")
+    try:
+        yield opened
+    finally:
+        if reader is not None:
+            reader.close()
 
-def load_model_data(file_path, model_type_info="modelo"):
+def iter_model_chunks(file_path, model_type_info="modelo", chunk_size=DEFAULT_STREAM_CHUNK_SIZE, cache_dir=None,
+                      precision=DEFAULT_PRECISION):
+    """
+    Gera (start, chunk_frame, y_true_block, y_pred_block) para blocos de até 'chunk_size'
+    amostras válidas: 'chunk_frame' tem as demais colunas (data, lat, lon, ...) e os
+    blocos têm formato (c, N, dias).
+    Com 'cache_dir', os blocos são fatias dos memmaps do cache (o pickle só é decodificado
+    uma vez, para popular o cache); no formato em blocos (chunked_forecast.py), cada bloco
+    descomprime só os blocos do arquivo dessas amostras. Sem cache, o pickle é lido e cada amostra é
+    redimensionada apenas quando seu bloco é processado, liberando o array original;
+    nesse caso os blocos reutilizam o mesmo buffer e não devem ser guardados pelo chamador.
+    """
+    print(f"    Carregando dados em blocos para {model_type_info} do arquivo: {file_path}")
+
+    if cache_dir or is_chunked_forecast(file_path):
+        with open_model_arrays(file_path, cache_dir, precision=precision) as opened:
+            if opened is None:
+                return
+            frame, arrays = opened
+            y_true_all, y_pred_all = arrays['y_rol'], arrays['y_rol_pred']
+            other_arrays = {col_name: block for col_name, block in arrays.items() if col_name not in ('y_rol', 'y_rol_pred')}
+            for start in range(0, len(frame), chunk_size):
+                stop = min(start + chunk_size, len(frame))
+                chunk_frame = frame.iloc[start:stop].copy()
+                for col_name, block in other_arrays.items():
+                    chunk_frame[col_name] = list(block[start:stop])
+                deduplicate_grid_columns(chunk_frame)
+                yield start, chunk_frame, y_true_all[start:stop], y_pred_all[start:stop]
+        return
+
+    df = read_raw_model_pickle(file_path)
+    if df is None or df.empty:
+        return
+
+    valid_rows = np.flatnonzero(df['y_rol'].notna().to_numpy() & df['y_rol_pred'].notna().to_numpy())
+    frame_columns = [col_name for col_name in df.columns if col_name not in ('y_rol', 'y_rol_pred')]
+    col_positions = {col_name: df.columns.get_loc(col_name) for col_name in ('y_rol', 'y_rol_pred')}
+    dtype = PRECISION_DTYPES[precision]
+    buffers = {col_name: np.empty((min(chunk_size, len(valid_rows)), 354*360, NUM_DAYS_METRICS), dtype=dtype)
+               for col_name in col_positions}
+
+    for start in range(0, len(valid_rows), chunk_size):
+        rows = valid_rows[start:start + chunk_size]
+        for col_name, col_position in col_positions.items():
+            for k, row in enumerate(rows):
+                buffers[col_name][k] = np.asarray(df.iat[row, col_position], dtype=dtype).reshape(354*360, NUM_DAYS_METRICS)
+                df.iat[row, col_position] = None # Libera o array original assim que é convertido
+        yield start, df.iloc[rows][frame_columns], buffers['y_rol'][:len(rows)], buffers['y_rol_pred'][:len(rows)]
+
+@instrumented()
+def load_model_data(file_path, model_type_info="modelo", metrics_backend=None, cache_dir=None, precision=DEFAULT_PRECISION):
     """
     Carrega e prepara os dados de um modelo a partir de um arquivo .pkl.
     Adiciona colunas de métricas diárias (rmse, mse, r2_score) ao DataFrame.
+    Se 'cache_dir' for informado, os arrays já redimensionados são lidos/gravados
+    no cache em disco (forecast_cache.ForecastCache), evitando decodificar o
+    pickle novamente quando o arquivo não mudou.
     """
     print(f"    Carregando dados para {model_type_info} do arquivo: {file_path}")
+    df = read_model_frame(file_path, cache_dir=cache_dir, precision=precision)
+    if df is None or df.empty:
+        return df
+    return add_daily_metrics(df, file_path, metrics_backend=metrics_backend)
+
+@instrumented()
+def read_model_frame(file_path, cache_dir=None, precision=DEFAULT_PRECISION):
+    """
+    Lê o DataFrame de um modelo com 'y_rol'/'y_rol_pred' redimensionadas (na 'precision' pedida), do cache em disco
+    (se 'cache_dir' for informado e a entrada for válida) ou do pickle, gravando o cache.
+    Um arquivo no formato em blocos (chunked_forecast.py) é lido por inteiro, sem cache.
+    Retorna None em caso de erro (ou o DataFrame vazio, se o arquivo não tiver amostras).
+    """
+    if is_chunked_forecast(file_path):
+        try:
+            with ChunkedForecastReader(file_path) as reader:
+                df = reader.load(dtype=PRECISION_DTYPES[precision])
+        except CHUNKED_READ_ERRORS as e_chunked:
+            print(f"    ERRO CRÍTICO ao ler o arquivo em blocos {file_path}: {e_chunked}")
+            return None
+        deduplicate_grid_columns(df)
+        return df
+
+    forecast_cache = None
+    df = None
+    if cache_dir:
+        try:
+            forecast_cache = ForecastCache(cache_dir, precision=precision)
+            df = forecast_cache.load(file_path)
+            if df is not None:
+                deduplicate_grid_columns(df) # Entradas gravadas antes da grade compartilhada têm uma cópia por amostra
+                print(f"    Arrays reabertos do cache em disco ({cache_dir}); pickle não decodificado.")
+        except FileNotFoundError:
+            print(f"    ERRO CRÍTICO: Arquivo de modelo {file_path} não encontrado.")
+            return None
+        except Exception as e_cache:
+            print(f"    AVISO: Falha ao consultar o cache em {cache_dir}: {e_cache}. Lendo o pickle.")
+            df = None
+
+    if df is None:
+        df = read_model_pickle(file_path, precision=precision)
+        if df is None or df.empty:
+            return df
+        if forecast_cache is not None:
+            try:
+                forecast_cache.store(file_path, df)
+                print(f"    Arrays redimensionados gravados no cache em disco ({cache_dir}).")
+            except Exception as e_cache:
+                print(f"    AVISO: Falha ao gravar o cache em {cache_dir}: {e_cache}")
+    return df
+
+def add_daily_metrics(df, file_path, metrics_backend=None):
+    """Cópia de df com as colunas de métricas diárias (posprocessDataframe); None em caso de falha."""
+    try:
+        df_with_daily_metrics = posprocessDataframe(df.copy(), backend=metrics_backend) 
+        
+        if df_with_daily_metrics is None or df_with_daily_metrics.empty:
+            print("    ERRO CRÍTICO: Falha durante o posprocessDataframe ou resultou em DataFrame vazio.")
+            return None
+
+        print(f"    Dados carregados e métricas diárias calculadas. Total de {len(df_with_daily_metrics)} amostras válidas.")
+        return df_with_daily_metrics
 
+    except Exception as e_general:
+        print(f"    ERRO INESPERADO ao processar dados do arquivo {file_path}: {e_general}")
+        import traceback
+        traceback.print_exc()
+        return None
+
+@instrumented()
+def read_raw_model_pickle(file_path):
+    """
+    Lê o DataFrame de um arquivo .pkl, normaliza os nomes de colunas, cria 'data' e valida
+    'y_rol'/'y_rol_pred' (sem redimensioná-las). Retorna None em caso de erro
+    (ou o DataFrame vazio, se o arquivo não tiver amostras).
+    """
     try:
         df = pd.read_pickle(file_path)
         if not isinstance(df, pd.DataFrame):
@@ -117,10 +623,36 @@ def load_model_data(file_path, model_type_info="modelo"):
             if df[col_name].isnull().all():
                  print(f"    ERRO CRÍTICO: Coluna '{col_name}' contém apenas valores None.")
                  return None
+
+        # Cada amostra traz sua cópia de lat/lon; todas passam a apontar para a grade canônica
+        num_grids = deduplicate_grid_columns(df)
+        if num_grids:
+            print(f"    Grade lat/lon compartilhada: {num_grids} grade(s) distinta(s) em {len(df)} amostras.")
+        return df
+
+    except Exception as e_general:
+        print(f"    ERRO INESPERADO ao processar dados do arquivo {file_path}: {e_general}")
+        import traceback
+        traceback.print_exc()
+        return None
+
+@instrumented()
+def read_model_pickle(file_path, precision=DEFAULT_PRECISION):
+    """
+    Lê o DataFrame de um arquivo .pkl e redimensiona 'y_rol'/'y_rol_pred' para (N, dias),
+    convertidas para 'precision' (sem cópia se o array já estiver nesse tipo).
+    Retorna None em caso de erro (ou o DataFrame vazio, se o arquivo não tiver amostras).
+    """
+    df = read_raw_model_pickle(file_path)
+    if df is None or df.empty:
+        return df
+
+    try:
         try:
             # AQUI é onde NUM_DAYS_METRICS é usado
-            df['y_rol'] = df['y_rol'].apply(lambda x: np.array(x, dtype=float).reshape(354*360, NUM_DAYS_METRICS) if x is not None else None)
-            df['y_rol_pred'] = df['y_rol_pred'].apply(lambda x: np.array(x, dtype=float).reshape(354*360, NUM_DAYS_METRICS) if x is not None else None)
+            dtype = PRECISION_DTYPES[precision]
+            df['y_rol'] = df['y_rol'].apply(lambda x: np.asarray(x, dtype=dtype).reshape(354*360, NUM_DAYS_METRICS) if x is not None else None)
+            df['y_rol_pred'] = df['y_rol_pred'].apply(lambda x: np.asarray(x, dtype=dtype).reshape(354*360, NUM_DAYS_METRICS) if x is not None else None)
         except Exception as e_reshape:
             print(f"    ERRO CRÍTICO durante o reshape: {e_reshape}")
             if not df.empty:
@@ -133,15 +665,7 @@ def load_model_data(file_path, model_type_info="modelo"):
         if df.empty:
             print(f"    AVISO: DataFrame ficou vazio após remover linhas com falha no reshape/dados ausentes em y_rol/y_rol_pred.")
             return None
-
-        df_with_daily_metrics = posprocessDataframe(df.copy()) 
-        
-        if df_with_daily_metrics is None or df_with_daily_metrics.empty:
-            print("    ERRO CRÍTICO: Falha durante o posprocessDataframe ou resultou em DataFrame vazio.")
-            return None
-
-        print(f"    Dados carregados e métricas diárias calculadas. Total de {len(df_with_daily_metrics)} amostras válidas.")
-        return df_with_daily_metrics
+        return df
 
     except Exception as e_general:
         print(f"    ERRO INESPERADO ao processar dados do arquivo {file_path}: {e_general}")
@@ -2,18 +2,41 @@
 import matplotlib.pyplot as plt
 import numpy as np
 import os
+from instrumentation import instrumented
 
 NUM_DAYS_METRICS = 7 # Número de dias para os quais as métricas são calculadas
 
+def _resolve_tasks_metrics(all_tasks_metrics_data, metrics_store, task_ids):
+    """
+    Resultados a relatar: 'all_tasks_metrics_data' se informado; senão os resultados mais
+    recentes de 'task_ids' (ou de todas as tarefas) lidos de 'metrics_store', que pode ser
+    um MetricsStore aberto ou o caminho do arquivo SQLite (ver metrics_store.py).
+    """
+    if all_tasks_metrics_data is not None or metrics_store is None:
+        return all_tasks_metrics_data
+    if isinstance(metrics_store, (str, os.PathLike)):
+        from metrics_store import MetricsStore
+        with MetricsStore(metrics_store) as store:
+            return store.latest_task_results(task_ids=task_ids)
+    return metrics_store.latest_task_results(task_ids=task_ids)
+
+@instrumented()
 def plot_cumulative_metric_graph(metric_key, 
                                  metric_label, 
                                  all_tasks_metrics_data, 
                                  days_array, 
                                  output_directory, 
-                                 filename_prefix="cumulative_"):
+                                 filename_prefix="cumulative_",
+                                 metrics_store=None,
+                                 task_ids=None,
+                                 bootstrap_summary=None):
     """
     Plota e salva um gráfico da métrica acumulada por dia para todos os modelos.
+    Com all_tasks_metrics_data=None, lê os resultados de 'metrics_store' (ver _resolve_tasks_metrics).
+    Com 'bootstrap_summary' (ver bootstrap.compute_bootstrap_summary), desenha a faixa do IC
+    bootstrap da métrica acumulada de cada modelo.
     """
+    all_tasks_metrics_data = _resolve_tasks_metrics(all_tasks_metrics_data, metrics_store, task_ids) or []
     plt.style.use('seaborn-v0_8-pastel') 
     plt.figure(figsize=(12, 7)) 
 
@@ -32,6 +55,11 @@ def plot_cumulative_metric_graph(metric_key,
             
             plt.plot(days_array, cumulative_values, marker='o', linestyle='-', 
                      linewidth=2.5, markersize=7, label=task_id, color=colors(i % colors.N))
+            task_interval = (bootstrap_summary or {}).get("intervals", {}).get(task_id, {}).get(metric_key)
+            if task_interval is not None:
+                plt.fill_between(days_array, task_interval["cumulative_ci_low"][:NUM_DAYS_METRICS],
+                                 task_interval["cumulative_ci_high"][:NUM_DAYS_METRICS],
+                                 color=colors(i % colors.N), alpha=0.2, linewidth=0)
             plot_successful = True
         else:
             print(f"Aviso: Dados ausentes/insuficientes para '{metric_key}' na tarefa '{task_id}'. Não será plotado no gráfico de {metric_label} acumulado.")
@@ -68,11 +96,18 @@ def plot_cumulative_metric_graph(metric_key,
     return filepath
 
 
-def create_metrics_summary_table(all_tasks_metrics_data, output_image_path):
+@instrumented()
+def create_metrics_summary_table(all_tasks_metrics_data, output_image_path, metrics_store=None, task_ids=None,
+                                 bootstrap_summary=None):
     """
     Cria uma tabela resumida TRANSPOSTA, com estilo similar à imagem [1]
     (cabeçalhos horizontais, linhas divisórias proeminentes).
+    Valores diários trazem "± meia-largura do IC de 95%" quando 'metrics_data' tem 'stats'.
+    Com 'bootstrap_summary' (ver bootstrap.compute_bootstrap_summary), trazem o IC bootstrap
+    "[inf, sup]" e cada métrica ganha a linha de posto, com o p-valor do teste pareado contra o 1º.
+    Com all_tasks_metrics_data=None, lê os resultados de 'metrics_store' (ver _resolve_tasks_metrics).
     """
+    all_tasks_metrics_data = _resolve_tasks_metrics(all_tasks_metrics_data, metrics_store, task_ids)
     if not all_tasks_metrics_data:
         print("Nenhum dado de métrica fornecido para gerar a tabela de resumo.")
         return
@@ -93,6 +128,8 @@ def create_metrics_summary_table(all_tasks_metrics_data, output_image_path):
         for day_idx in range(NUM_DAYS_METRICS):
             row_labels_and_data_source.append((f"{display_name} Dia {day_idx+1}", key, day_idx))
         row_labels_and_data_source.append((f"{display_name} Média", key, "mean"))
+        if bootstrap_summary and bootstrap_summary.get("ranking", {}).get(key):
+            row_labels_and_data_source.append((f"{display_name} Posto (p vs. 1º)", key, "rank"))
 
     table_data = []
     for row_label, metric_key_or_type, aggregation_type in row_labels_and_data_source:
@@ -110,9 +147,26 @@ def create_metrics_summary_table(all_tasks_metrics_data, output_image_path):
                     if isinstance(aggregation_type, int):
                         if aggregation_type < len(daily_values):
                             value_to_append = f"{daily_values[aggregation_type]:.4f}"
+                            # IC bootstrap quando disponível; senão meia-largura do IC de 95% das estatísticas online
+                            metric_stats = metrics.get("stats", {}).get(metric_key_or_type)
+                            task_interval = (bootstrap_summary or {}).get("intervals", {}).get(
+                                task_data.get("task_id"), {}).get(metric_key_or_type)
+                            if task_interval is not None:
+                                value_to_append += f" [{task_interval['ci_low'][aggregation_type]:.4f}, " \
+                                                   f"{task_interval['ci_high'][aggregation_type]:.4f}]"
+                            elif metric_stats and metric_stats.get("count", 0) > 1:
+                                half_width = (metric_stats["ci95_high"][aggregation_type] - metric_stats["ci95_low"][aggregation_type]) / 2
+                                value_to_append += f" ±{half_width:.4f}"
                     elif aggregation_type == "mean":
                         mean_val = np.mean(daily_values)
                         value_to_append = f"{mean_val:.4f}"
+                    elif aggregation_type == "rank":
+                        for rank_entry in bootstrap_summary["ranking"][metric_key_or_type]:
+                            if rank_entry["task_id"] == task_data.get("task_id"):
+                                value_to_append = f"{rank_entry['rank']}º"
+                                if rank_entry["p_vs_best"] is not None:
+                                    p_value = rank_entry["p_vs_best"]
+                                    value_to_append += " (p<0.001)" if p_value < 0.001 else f" (p={p_value:.3f})"
                 current_row_values.append(value_to_append)
         table_data.append(current_row_values)
 
@@ -127,7 +181,9 @@ def create_metrics_summary_table(all_tasks_metrics_data, output_image_path):
     avg_char_width_for_header = 0.10 
     longest_task_id_len = max(len(tid) for tid in task_ids_for_header) if task_ids_for_header else 10
     
-    model_col_width_abs = max(1.6, longest_task_id_len * avg_char_width_for_header) 
+    model_col_width_abs = max(1.9, longest_task_id_len * avg_char_width_for_header) # Espaço para "valor ±IC"
+    if bootstrap_summary and bootstrap_summary.get("intervals"):
+        model_col_width_abs = max(model_col_width_abs, 2.9) # Espaço para "valor [inf, sup]"
     first_col_width_abs = 2.8 # Largura para "Métrica / Dia" (aumentada ligeiramente)
 
     fig_width = first_col_width_abs + (num_cols - 1) * model_col_width_abs
@@ -243,3 +299,49 @@ def create_metrics_summary_table(all_tasks_metrics_data, output_image_path):
         print(f"Erro ao salvar a imagem da tabela (estilo imagem [1]): {e}")
     finally:
         plt.close(fig)
+
+
+@instrumented()
+def plot_pairwise_comparison(comparison, output_image_path):
+    """
+    Plota, a partir do resultado de comparison.compare_models, duas matrizes modelo x modelo
+    (média dos dias): a distância (RMSD) entre as previsões e a fração das amostras em que o
+    modelo da linha tem RMSE menor que o da coluna.
+    """
+    model_keys = [model["task_id"] for model in comparison["models"]]
+    num_models = len(model_keys)
+    rmsd_matrix = np.zeros((num_models, num_models))
+    win_matrix = np.full((num_models, num_models), np.nan)
+    for pair in comparison["pairwise"]:
+        a_idx, b_idx = model_keys.index(pair["model_a"]), model_keys.index(pair["model_b"])
+        rmsd_matrix[a_idx, b_idx] = rmsd_matrix[b_idx, a_idx] = np.mean(pair["rmsd"])
+        win_matrix[a_idx, b_idx] = np.mean(pair["fraction_a_better"])
+        win_matrix[b_idx, a_idx] = np.mean(pair["fraction_b_better"]) # Empates não contam para nenhum dos dois
+
+    panel_size = max(5, 0.8 * num_models + 2)
+    fig, axes = plt.subplots(1, 2, figsize=(2 * panel_size + 1, panel_size))
+    panels = [(rmsd_matrix, "RMSD entre Previsões", 'viridis', None, None, "{:.4f}"),
+              (win_matrix, "Fração de Amostras com RMSE Menor (linha x coluna)", 'RdBu', 0.0, 1.0, "{:.0%}")]
+    for ax, (matrix, title, cmap, vmin, vmax, value_format) in zip(axes, panels):
+        image = ax.imshow(matrix, cmap=cmap, vmin=vmin, vmax=vmax)
+        ax.set_xticks(range(num_models))
+        ax.set_xticklabels(model_keys, rotation=45, ha='right', fontsize=9)
+        ax.set_yticks(range(num_models))
+        ax.set_yticklabels(model_keys, fontsize=9)
+        ax.set_title(title, fontsize=12, weight='bold')
+        for r_idx in range(num_models):
+            for c_idx in range(num_models):
+                if r_idx != c_idx and np.isfinite(matrix[r_idx, c_idx]):
+                    ax.text(c_idx, r_idx, value_format.format(matrix[r_idx, c_idx]), ha='center', va='center', fontsize=8)
+        fig.colorbar(image, ax=ax, fraction=0.046, pad=0.04)
+    fig.suptitle(f"Comparação Pareada entre Modelos ({comparison['n_samples']} datas comuns)", fontsize=14, weight='bold')
+
+    try:
+        fig.savefig(output_image_path, dpi=150, bbox_inches='tight')
+        print(f"Comparação pareada entre modelos salva em: {output_image_path}")
+    except Exception as e:
+        print(f"Erro ao salvar a comparação pareada entre modelos: {e}")
+        output_image_path = None
+    finally:
+        plt.close(fig)
+    return output_image_path
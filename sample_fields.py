@@ -0,0 +1,128 @@
+# sample_fields.py
+import os
+import json
+import numpy as np
+import pandas as pd
+from grid_registry import get_grid
+
+# Campos de uma amostra reorganizados por dia (dias, ny, nx): real, previsão e diferença
+# absoluta são calculados uma única vez e compartilhados pelo grid, pelos três GIFs e por
+# qualquer outro gráfico da amostra, em vez de cada artefato fatiar y_rol[:, dia] (coluna
+# com passo, copiada) e redimensionar o mesmo dia várias vezes.
+FIELD_KINDS = ("real", "pred", "diff")
+FIELDS_FILENAME = "campos.npy" # (3, dias, ny, nx), na ordem de FIELD_KINDS
+LAT_FILENAME = "lat.npy"
+LON_FILENAME = "lon.npy"
+METADATA_FILENAME = "meta.json"
+COLOR_PERCENTILES = (5, 95) # vmin/vmax padrão dos campos real e previsto
+
+def _day_major(flat_values, shape):
+    """(N, dias) -> (dias, ny, nx) contíguo, com uma única cópia (transposição)."""
+    if flat_values is None:
+        return None
+    values = np.asarray(flat_values)
+    return np.ascontiguousarray(values.T).reshape((values.shape[1],) + tuple(shape))
+
+class SampleFields:
+    """
+    Campos por dia de uma amostra: 'real', 'pred' e 'diff' (dias, ny, nx), a grade 'lat'/'lon',
+    a data base 'date' e a escala de cores padrão (vmin, vmax = percentis 5 e 95 do real).
+    'lat'/'lon' são os arrays da grade canônica 'grid' (grid_registry.Grid), compartilhada
+    com as demais amostras e com a extensão e as bordas das células já calculadas.
+    Construído com from_sample_row(). save() grava os campos em disco e devolve uma instância
+    apoiada em memmaps; instâncias assim são serializadas (pickle) apenas pelo caminho, de modo
+    que os workers de renderização reabrem os mesmos arquivos sem copiar os arrays.
+    """
+
+    def __init__(self, real, pred, diff, lat, lon, date=None, vmin=0.0, vmax=1.0, path=None):
+        self.real = real
+        self.pred = pred
+        self.diff = diff
+        self.grid = get_grid(lat, lon) if lat is not None and lon is not None else None
+        self.lat = self.grid.lat if self.grid is not None else lat
+        self.lon = self.grid.lon if self.grid is not None else lon
+        self.date = date
+        self.vmin = vmin
+        self.vmax = vmax
+        self.path = path
+
+    @classmethod
+    def from_sample_row(cls, sample_row):
+        """Monta os campos a partir de uma linha (pandas.Series) com y_rol, y_rol_pred, lat, lon e data."""
+        lat = sample_row.get('lat')
+        lon = sample_row.get('lon')
+        shape = lon.shape if lon is not None else None
+        y_real = sample_row.get('y_rol')
+        y_pred = sample_row.get('y_rol_pred')
+        real = _day_major(y_real, shape) if shape is not None else None
+        pred = _day_major(y_pred, shape) if shape is not None else None
+        diff = None
+        if real is not None and pred is not None:
+            num_days = min(real.shape[0], pred.shape[0])
+            diff = np.abs(real[:num_days] - pred[:num_days])
+        if y_real is not None and np.size(y_real) > 0:
+            vmin, vmax = np.percentile(y_real, COLOR_PERCENTILES)
+        else:
+            vmin, vmax = 0.0, 1.0
+        date = sample_row.get('data')
+        return cls(real, pred, diff, lat, lon, date=None if pd.isna(date) else date, vmin=float(vmin), vmax=float(vmax))
+
+    @property
+    def shape(self):
+        return self.lon.shape if self.lon is not None else None
+
+    @property
+    def num_days(self):
+        return self.real.shape[0] if self.real is not None else 0
+
+    def field(self, kind, day_idx):
+        """Campo 2D do dia day_idx para 'real', 'pred' ou 'diff' (None se ausente): uma visão, sem cópia."""
+        values = getattr(self, kind)
+        if values is None or day_idx >= values.shape[0]:
+            return None
+        return values[day_idx]
+
+    def save(self, directory):
+        """
+        Grava os campos em 'directory' (um .npy (3, dias, ny, nx), lat, lon e metadados) e
+        retorna uma nova instância com os arrays abertos via np.load(mmap_mode='r').
+        Requer real, pred, lat e lon presentes.
+        """
+        os.makedirs(directory, exist_ok=True)
+        num_days = self.diff.shape[0]
+        fields = np.lib.format.open_memmap(os.path.join(directory, FIELDS_FILENAME), mode='w+',
+                                           dtype=np.result_type(self.real, self.pred),
+                                           shape=(len(FIELD_KINDS), num_days) + self.shape)
+        for kind_idx, kind in enumerate(FIELD_KINDS):
+            fields[kind_idx] = getattr(self, kind)[:num_days]
+        fields.flush()
+        del fields
+        np.save(os.path.join(directory, LAT_FILENAME), np.asarray(self.lat))
+        np.save(os.path.join(directory, LON_FILENAME), np.asarray(self.lon))
+        with open(os.path.join(directory, METADATA_FILENAME), 'w') as f:
+            json.dump({"date": self.date.isoformat() if self.date is not None else None,
+                       "vmin": self.vmin, "vmax": self.vmax}, f)
+        return SampleFields.open(directory)
+
+    @classmethod
+    def open(cls, directory):
+        """Reabre campos gravados por save() como memmaps somente leitura."""
+        fields = np.load(os.path.join(directory, FIELDS_FILENAME), mmap_mode='r')
+        with open(os.path.join(directory, METADATA_FILENAME), 'r') as f:
+            metadata = json.load(f)
+        return cls(fields[0], fields[1], fields[2],
+                   np.load(os.path.join(directory, LAT_FILENAME), mmap_mode='r'),
+                   np.load(os.path.join(directory, LON_FILENAME), mmap_mode='r'),
+                   date=pd.Timestamp(metadata["date"]) if metadata["date"] else None,
+                   vmin=metadata["vmin"], vmax=metadata["vmax"], path=directory)
+
+    def __reduce__(self):
+        if self.path is not None:
+            return (SampleFields.open, (self.path,))
+        return (SampleFields, (self.real, self.pred, self.diff, self.lat, self.lon, self.date, self.vmin, self.vmax))
+
+def resolve_sample_fields(df_single_row, pos=0, sample_fields=None):
+    """Campos recebidos prontos ('sample_fields') ou montados a partir da linha 'pos' de df_single_row."""
+    if sample_fields is not None:
+        return sample_fields
+    return SampleFields.from_sample_row(df_single_row.iloc[pos])
@@ -0,0 +1,147 @@
+# sample_index.py
+import numpy as np
+from bootstrap import LOWER_IS_BETTER
+
+# Seleção automática das amostras visualizadas a partir das métricas por amostra ('per_sample'
+# do resumo de process_model, ver metrics.stack_sample_metrics). "visualization_select" no
+# job_config.json é uma lista de seletores: "best"/"worst" (a melhor/pior amostra),
+# "best:3"/"worst:3" (as 3 melhores/piores), "median", "p90" (amostra no percentil 90 da
+# métrica) ou um inteiro (posição explícita da amostra). O ranking usa a métrica
+# "visualization_select_metric" ("rmse" ou "r2") na média dos dias ou, com
+# "visualization_select_day" (1 a 7), em um dia de previsão específico.
+SELECTION_METRICS = ("rmse", "r2")
+DEFAULT_SELECTION_METRIC = "rmse"
+SELECTION_LABELS = {"best": "melhor", "worst": "pior", "median": "mediana"}
+
+class SampleMetricIndex:
+    """
+    Índice das amostras de uma tarefa por uma métrica (n, dias). best()/worst() devolvem
+    as k melhores/piores posições (np.argpartition, O(n) + ordenação só das k escolhidas) e
+    quantile() a posição da amostra no quantil q dos valores; 'day' (índice 0-based) restringe
+    o ranking a um dia de previsão, None usa a média dos dias. Amostras com a métrica NaN
+    ficam fora do ranking.
+    """
+
+    def __init__(self, per_sample, metric=DEFAULT_SELECTION_METRIC):
+        if metric not in per_sample:
+            raise KeyError(f"Métrica '{metric}' ausente das métricas por amostra.")
+        self.metric = metric
+        self.values = np.atleast_2d(np.asarray(per_sample[metric], dtype=np.float64))
+        self.lower_is_better = LOWER_IS_BETTER.get(metric, True)
+
+    def __len__(self):
+        return self.values.shape[0]
+
+    def scores(self, day=None):
+        """(posições válidas, valores da métrica) no dia 'day' ou na média dos dias."""
+        if day is None:
+            with np.errstate(invalid='ignore'):
+                day_values = self.values.mean(axis=1)
+        else:
+            day_values = self.values[:, day]
+        positions = np.flatnonzero(np.isfinite(day_values))
+        return positions, day_values[positions]
+
+    def _ranked(self, k, day, best):
+        positions, values = self.scores(day)
+        if positions.size == 0:
+            return np.zeros(0, dtype=np.intp)
+        # "Maldade": menor é melhor depois de inverter o sinal das métricas em que maior é melhor
+        badness = values if self.lower_is_better else -values
+        if not best:
+            badness = -badness
+        k = min(k, positions.size)
+        chosen = np.argpartition(badness, k - 1)[:k] if k < positions.size else np.arange(positions.size)
+        return positions[chosen[np.argsort(badness[chosen], kind='stable')]]
+
+    def best(self, k=1, day=None):
+        """Posições das k melhores amostras, da melhor para a k-ésima."""
+        return self._ranked(k, day, best=True)
+
+    def worst(self, k=1, day=None):
+        """Posições das k piores amostras, da pior para a k-ésima pior."""
+        return self._ranked(k, day, best=False)
+
+    def quantile(self, q, day=None):
+        """Posição da amostra no quantil q (0 a 1) dos valores da métrica, ou None se não houver amostras."""
+        positions, values = self.scores(day)
+        if positions.size == 0:
+            return None
+        kth = int(round(min(max(q, 0.0), 1.0) * (positions.size - 1)))
+        return int(positions[np.argpartition(values, kth)[kth]])
+
+def parse_selectors(visualization_select):
+    """
+    Converte a lista de "visualization_select" em seletores (tipo, parâmetro, rótulo):
+    ("best"/"worst", k, rótulo), ("quantile", q, rótulo) ou ("position", n, rótulo).
+    Itens inválidos são ignorados com aviso.
+    """
+    if isinstance(visualization_select, (str, int)):
+        visualization_select = [visualization_select]
+    selectors = []
+    for item in visualization_select or []:
+        if isinstance(item, bool):
+            item = str(item)
+        if isinstance(item, int):
+            selectors.append(("position", item, f"amostra{item}"))
+            continue
+        name, _, param = str(item).strip().lower().partition(":")
+        try:
+            if name in ("best", "worst"):
+                k = int(param) if param else 1
+                if k < 1:
+                    raise ValueError(k)
+                selectors.append((name, k, SELECTION_LABELS[name]))
+            elif name == "median" and not param:
+                selectors.append(("quantile", 0.5, SELECTION_LABELS[name]))
+            elif name.startswith("p") and not param and 0 <= float(name[1:]) <= 100:
+                selectors.append(("quantile", float(name[1:]) / 100, f"p{float(name[1:]):g}"))
+            else:
+                raise ValueError(item)
+        except ValueError:
+            print(f"  AVISO: Seletor de visualização '{item}' inválido (use best, worst, best:k, worst:k, "
+                  f"median, pNN ou a posição da amostra). Ignorado.")
+    return selectors
+
+def select_samples(per_sample, visualization_select, metric=DEFAULT_SELECTION_METRIC, day=None):
+    """
+    Posições das amostras escolhidas pelos seletores de 'visualization_select', na ordem dos
+    seletores: lista de (rótulo, posição), sem posições repetidas (a primeira ocorrência fica).
+    Seletores best/worst com k > 1 geram os rótulos <rótulo>1..<rótulo>k.
+    """
+    selectors = parse_selectors(visualization_select)
+    if not selectors:
+        return []
+    index = SampleMetricIndex(per_sample, metric)
+    num_samples = len(index)
+    chosen = []
+    for kind, param, label in selectors:
+        if kind == "position":
+            if 0 <= param < num_samples:
+                chosen.append((label, param))
+            else:
+                print(f"  AVISO: Posição de amostra {param} fora do intervalo (0 a {num_samples - 1}). Ignorada.")
+        elif kind == "quantile":
+            position = index.quantile(param, day)
+            if position is not None:
+                chosen.append((label, position))
+        else:
+            ranked = index.best(param, day) if kind == "best" else index.worst(param, day)
+            chosen.extend((label if param == 1 else f"{label}{rank + 1}", int(position))
+                          for rank, position in enumerate(ranked))
+
+    selected, seen_positions = [], set()
+    for label, position in chosen:
+        if position in seen_positions:
+            continue
+        seen_positions.add(position)
+        selected.append((label, position))
+    return selected
+
+def primary_label(visualization_select):
+    """Rótulo da primeira amostra escolhida por 'visualization_select' (ex: a usada nas montagens), ou None."""
+    selectors = parse_selectors(visualization_select)
+    if not selectors:
+        return None
+    kind, param, label = selectors[0]
+    return f"{label}1" if kind in ("best", "worst") and param > 1 else label
@@ -0,0 +1,36 @@
+# test_metrics.py
+import numpy as np
+import pandas as pd
+import pytest
+from metrics import compute_daily_metrics_batch, posprocessDataframe_reference
+
+pytest.importorskip("torch")
+pytest.importorskip("sklearn")
+
+# Paridade do motor vetorizado (compute_daily_metrics_batch) com a implementação original
+# linha a linha (posprocessDataframe_reference, via torch/sklearn), em frames sintéticos.
+NUM_SAMPLES = 5
+NUM_POINTS = 2000
+NUM_DAYS = 7
+FLOAT32_RTOL = 1e-6 # MSE/RMSE: a referência calcula em float32
+R2_ATOL = 1e-12
+
+def _synthetic_frame(seed):
+    """Frame com 'y_rol'/'y_rol_pred' (N, dias) de campos com escala por dia e erro crescente."""
+    rng = np.random.default_rng(seed)
+    day_scale = np.linspace(1.0, 3.0, NUM_DAYS)
+    y_true = [rng.standard_normal((NUM_POINTS, NUM_DAYS)) * day_scale for _ in range(NUM_SAMPLES)]
+    y_pred = [y + rng.standard_normal(y.shape) * 0.1 * np.arange(1, NUM_DAYS + 1) for y in y_true]
+    return pd.DataFrame({"y_rol": y_true, "y_rol_pred": y_pred})
+
+@pytest.mark.parametrize("chunk_size", [1, 2, NUM_SAMPLES])
+def test_compute_daily_metrics_batch_matches_reference(chunk_size):
+    df = _synthetic_frame(seed=7)
+    reference = posprocessDataframe_reference(df.copy())
+    metrics = compute_daily_metrics_batch(list(df['y_rol']), list(df['y_rol_pred']), chunk_size=chunk_size)
+
+    for metric_name in ("mse", "rmse", "r2_score"):
+        assert metrics[metric_name].shape == (NUM_SAMPLES, NUM_DAYS)
+    np.testing.assert_allclose(metrics['mse'], np.stack(reference['mse']), rtol=FLOAT32_RTOL)
+    np.testing.assert_allclose(metrics['rmse'], np.stack(reference['rmse']), rtol=FLOAT32_RTOL)
+    np.testing.assert_allclose(metrics['r2_score'], np.stack(reference['r2_score']), rtol=0, atol=R2_ATOL)
@@ -5,14 +5,110 @@ import matplotlib.colors as mcolors
 import cartopy.crs as ccrs
 import cartopy.feature as cfeature
 from datetime import timedelta
-from matplotlib.animation import FuncAnimation
-from PIL import Image
+from PIL import Image, ImageDraw, ImageFont
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import time
 import glob
 import os
+import shutil
+import tempfile
+from instrumentation import instrumented, current_task, set_current_task
+from sample_fields import SampleFields, resolve_sample_fields
+from grid_registry import get_grid
+from animation_writers import (DEFAULT_ANIMATION_FORMAT, DEFAULT_FRAME_DURATION_MS, ANIMATION_EXTENSIONS,
+                               animation_format_from_path, animation_path, canvas_frame, find_ffmpeg,
+                               open_animation_writer, resolve_animation_format, retained_frame_bytes)
 
 NUM_DAYS_METRICS = 7 # Número de dias para os quais as métricas são calculadas
 
+# Estilos do fundo cartográfico (terra abaixo do campo; costa e fronteiras acima)
+BASEMAP_STYLES = {
+    "gif": {"land": {"facecolor": "lightgrey"}, "coastline": {}, "borders": {"linestyle": ":"}},
+    "grid": {"land": {"facecolor": "lightgray"}, "coastline": {"linewidth": 0.5}, "borders": {"linestyle": ":", "linewidth": 0.5}},
+}
+GRID_SAVE_DPI = 150 # dpi do PNG do grid (o fundo é rasterizado nesta resolução)
+# Cache em memória (válido por todo o processo, ou seja, entre tarefas do mesmo lote) das
+# camadas do fundo já rasterizadas: (estilo, extensão, largura_px, altura_px, dpi) -> (terra, costa+fronteiras)
+_BASEMAP_CACHE = {}
+DEFAULT_RENDER_WORKERS = 1 # 1 = artefatos renderizados em série no próprio processo
+# Renderizadores dos GIFs e do grid: "cartopy" (matplotlib + cartopy) ou "fast_raster" (NumPy + Pillow, ver fast_raster.py)
+RENDERERS = ("cartopy", "fast_raster")
+DEFAULT_RENDERER = "cartopy"
+# Pool de renderização mantido entre tarefas no processo principal (os workers preservam o _BASEMAP_CACHE): (n_workers, pool)
+_RENDER_POOL = None
+# Colunas do grid de erro espacial por ponto de grade: (chave do mapa, título, colormap)
+SPATIAL_ERROR_COLUMNS = [("bias", "Viés (Prev. - Real)", "coolwarm"), ("mae", "MAE", "viridis"), ("rmse", "RMSE", "viridis")]
+SPATIAL_ERROR_SCALE_PERCENTILE = 98 # Limite das escalas de cor (evita que poucos pontos extremos achatem o mapa)
+
+def get_grid_extent(lon, lat):
+    """
+    Extensão (lon_min, lon_max, lat_min, lat_max) ocupada pela grade regular, incluindo
+    meia célula em cada borda (como o pcolormesh com shading='auto'/'nearest').
+    Calculada uma vez por grade (grid_registry.Grid.extent).
+    """
+    return get_grid(lat, lon).extent
+
+def _axes_pixel_size(ax, dpi):
+    """Tamanho (largura, altura) em pixels da área de desenho do eixo, já com o aspecto aplicado."""
+    ax.apply_aspect()
+    position = ax.get_position()
+    fig_width, fig_height = ax.figure.get_size_inches()
+    return int(round(position.width * fig_width * dpi)), int(round(position.height * fig_height * dpi))
+
+def _render_basemap_layers(style, extent, width_px, height_px, dpi):
+    """
+    Rasteriza uma vez, em uma figura descartável do mesmo tamanho em pixels do eixo de destino,
+    a camada de terra (RGBA) e a camada de costa + fronteiras (RGBA transparente).
+    """
+    style_kw = BASEMAP_STYLES[style]
+    fig = plt.figure(figsize=(width_px / dpi, height_px / dpi), dpi=dpi)
+    fig.patch.set_alpha(0)
+    ax = fig.add_axes([0, 0, 1, 1], projection=ccrs.PlateCarree())
+    ax.set_extent(extent, crs=ccrs.PlateCarree())
+    ax.patch.set_visible(False)
+    ax.spines['geo'].set_visible(False)
+
+    land_artist = ax.add_feature(cfeature.LAND, zorder=0, **style_kw["land"])
+    fig.canvas.draw()
+    land_layer = np.array(fig.canvas.buffer_rgba())
+    land_artist.remove()
+
+    ax.coastlines(**style_kw["coastline"])
+    ax.add_feature(cfeature.BORDERS, **style_kw["borders"])
+    fig.canvas.draw()
+    lines_layer = np.array(fig.canvas.buffer_rgba())
+    plt.close(fig)
+    return land_layer, lines_layer
+
+def get_basemap_layers(style, extent, width_px, height_px, dpi):
+    """
+    Retorna (terra, costa+fronteiras) como arrays RGBA (altura_px, largura_px, 4) para o
+    estilo e a extensão dados, rasterizando-os apenas na primeira vez (_BASEMAP_CACHE).
+    """
+    cache_key = (style, tuple(round(v, 6) for v in extent), int(width_px), int(height_px), int(dpi))
+    if cache_key not in _BASEMAP_CACHE:
+        _BASEMAP_CACHE[cache_key] = _render_basemap_layers(style, extent, width_px, height_px, dpi)
+    return _BASEMAP_CACHE[cache_key]
+
+def add_cached_basemap(ax, style, extent, dpi):
+    """
+    Fixa a extensão do eixo e adiciona o fundo cartográfico como duas imagens (terra com
+    zorder 0 e costa/fronteiras com zorder 2), reaproveitando rasters já gerados para a
+    mesma extensão, tamanho em pixels e dpi. Substitui coastlines()/BORDERS/LAND por eixo.
+    """
+    ax.set_extent(extent, crs=ccrs.PlateCarree())
+    width_px, height_px = _axes_pixel_size(ax, dpi)
+    land_layer, lines_layer = get_basemap_layers(style, extent, width_px, height_px, dpi)
+
+    image_kw = dict(extent=extent, origin='upper', transform=ccrs.PlateCarree(), interpolation='nearest')
+    ax.imshow(land_layer, zorder=0, **image_kw)
+    ax.imshow(lines_layer, zorder=2, **image_kw)
+    ax.set_extent(extent, crs=ccrs.PlateCarree()) # imshow pode alterar os limites do eixo
+
 # FUNÇÃO PARA PLOTAR MÉTRICAS DIÁRIAS (MODIFICADA)
+@instrumented()
 def plot_daily_metric_for_model(daily_metric_values, 
                                 metric_name_display, 
                                 metric_key_filename, 
@@ -73,12 +169,110 @@ def plot_daily_metric_for_model(daily_metric_values,
         plt.close()
 
 
+def _init_render_worker():
+    """Inicializador dos processos de renderização: força o backend não interativo Agg."""
+    import matplotlib
+    matplotlib.use("Agg", force=True)
+
+def _get_render_pool(render_workers):
+    """Retorna o pool de renderização do processo, recriando-o se o número de workers mudou."""
+    global _RENDER_POOL
+    if _RENDER_POOL is not None and _RENDER_POOL[0] != render_workers:
+        shutdown_render_pool()
+    if _RENDER_POOL is None:
+        _RENDER_POOL = (render_workers, ProcessPoolExecutor(max_workers=render_workers, initializer=_init_render_worker))
+    return _RENDER_POOL[1]
+
+def shutdown_render_pool():
+    """Encerra o pool de renderização do processo, se existir."""
+    global _RENDER_POOL
+    if _RENDER_POOL is not None:
+        _RENDER_POOL[1].shutdown(wait=True, cancel_futures=True)
+        _RENDER_POOL = None
+
+def _run_render_job(artifact_name, render_func, render_kwargs, task_id=None):
+    """
+    Renderiza um artefato e retorna (nome, segundos, mensagem de erro ou None).
+    'task_id' associa os spans de instrumentação do worker à tarefa que pediu o artefato.
+    """
+    if task_id is not None:
+        set_current_task(task_id)
+    t_start = time.perf_counter()
+    error = None
+    try:
+        render_func(**render_kwargs)
+    except Exception as e:
+        error = str(e)
+    finally:
+        plt.close('all')
+    return artifact_name, time.perf_counter() - t_start, error
+
+def run_render_jobs(render_jobs, render_workers=DEFAULT_RENDER_WORKERS):
+    """
+    Executa os artefatos independentes de uma tarefa e retorna quando todos foram gravados.
+
+    Parameters:
+    -----------
+    render_jobs : list of (str, callable, dict)
+        (nome do artefato, função de plotagem de nível de módulo, argumentos nomeados).
+        Os argumentos precisam ser serializáveis (pickle) quando render_workers > 1.
+    render_workers : int
+        Número de processos de renderização. Com 1 (ou um único artefato) tudo roda em série
+        no processo atual. Se o pool não puder ser usado, os artefatos restantes rodam em série.
+
+    Returns:
+    --------
+    dict
+        Nome do artefato -> tempo de renderização em segundos.
+    """
+    render_timings = {}
+    pending_jobs = list(render_jobs)
+    n_workers = min(max(int(render_workers or 1), 1), len(pending_jobs))
+
+    if n_workers > 1:
+        try:
+            render_pool = _get_render_pool(n_workers)
+            futures = [(job, render_pool.submit(_run_render_job, *job, current_task())) for job in pending_jobs]
+            pending_jobs = []
+            for job, future in futures:
+                try:
+                    artifact_name, elapsed, error = future.result()
+                except BrokenProcessPool:
+                    pending_jobs.append(job)
+                    continue
+                render_timings[artifact_name] = elapsed
+                if error:
+                    print(f"    Erro ao renderizar '{artifact_name}': {error}")
+            if pending_jobs:
+                print(f"    Aviso: pool de renderização interrompido. {len(pending_jobs)} artefato(s) serão renderizados em série.")
+                shutdown_render_pool()
+            elif multiprocessing.parent_process() is not None:
+                # Dentro de um worker do pool de tarefas o pool não é mantido: um processo filho
+                # não consegue encerrar os próprios workers durante a finalização e travaria.
+                shutdown_render_pool()
+        except Exception as e:
+            print(f"    Aviso: não foi possível usar o pool de renderização ({e}). Renderizando em série.")
+            pending_jobs = [job for job in render_jobs if job[0] not in render_timings]
+
+    for job in pending_jobs:
+        artifact_name, elapsed, error = _run_render_job(*job)
+        render_timings[artifact_name] = elapsed
+        if error:
+            print(f"    Erro ao renderizar '{artifact_name}': {error}")
+    return render_timings
+
+
 # FUNÇÃO PRINCIPAL MODIFICADA
-def generate_visualizations(df_metrics_and_data, model_type, output_dir, day_for_main_viz=0):
+@instrumented()
+def generate_visualizations(df_metrics_and_data, model_type, output_dir, day_for_main_viz=0,
+                            render_workers=DEFAULT_RENDER_WORKERS, renderer=DEFAULT_RENDERER, spatial_error_maps=None,
+                            animation_format=DEFAULT_ANIMATION_FORMAT, color_limits=None):
     """
     Gera todas as visualizações para um modelo, incluindo gráficos de métricas diárias.
     O DataFrame de entrada agora é esperado como uma única linha (ou a linha relevante já selecionada)
     contendo os arrays de métricas diárias e os dados de visualização.
+    Os artefatos (3 GIFs, grid e 3 gráficos diários) são independentes e são despachados
+    por run_render_jobs, em paralelo quando render_workers > 1.
 
     Parameters:
     -----------
@@ -94,160 +288,215 @@ def generate_visualizations(df_metrics_and_data, model_type, output_dir, day_for
     day_for_main_viz : int
         Dia específico (0 a 6) a ser destacado nas visualizações principais (GIFs, grid).
         Os gráficos de métricas diárias sempre mostrarão todos os 7 dias.
+    render_workers : int
+        Número de processos usados para renderizar os artefatos (padrão: 1, em série).
+    renderer : str
+        Renderizador dos GIFs e do grid: "cartopy" (padrão) ou "fast_raster", que pinta a
+        grade regular diretamente com NumPy/Pillow. Os gráficos diários não mudam.
+    spatial_error_maps : dict or None
+        Mapas de viés/MAE/RMSE por ponto de grade sobre todas as amostras
+        (metrics.SpatialErrorAccumulator.maps); se informados, gera também o grid de erro espacial.
+    color_limits : (float, float) or None
+        (vmin, vmax) dos campos real e previsto em todos os renderizadores, ex: a escala comum
+        do lote (colorscale.compute_batch_color_scale); None usa a escala da própria amostra.
+
+    Returns:
+    --------
+    dict or None
+        Nome do artefato -> tempo de renderização em segundos (None se não houver dados).
     """
     # O 'position' do JSON agora é 'day_for_main_viz' e se refere ao dia a ser
     # destacado nos GIFs e grids, não a uma linha de múltiplas amostras.
     # Assumimos que df_metrics_and_data JÁ É a amostra única a ser processada
-    # ou que o processor.py já selecionou a linha correta se df fosse multi-linhas.
-    # Para simplificar aqui, vamos assumir que df_metrics_and_data é uma pandas.Series
-    # representando a única amostra (ou a linha já selecionada pelo processor.py).
+    # (a linha já selecionada pelo processor.py), representada como pandas.Series.
 
     print(f"\n  Iniciando geração de visualizações para {model_type}, destacando dia {day_for_main_viz + 1}, em: {output_dir}")
 
     if df_metrics_and_data is None or df_metrics_and_data.empty:
         print("    Dados de entrada (df_metrics_and_data) vazios ou não fornecidos. Nenhuma visualização será gerada.")
-        return
-    
-    # 'df_metrics_and_data' agora é a nossa 'sample_data'
-    sample_data = df_metrics_and_data
-
-    # --- GERAÇÃO DOS GRÁFICOS DE MÉTRICAS DIÁRIAS ---
-    # Estes gráficos mostram a evolução das métricas ao longo dos 7 dias para esta execução do modelo.
-    print("    Gerando gráficos de métricas diárias (RMSE, MSE, R²)...")
-    metrics_to_plot_config = {
-        "rmse": "RMSE",
-        "mse": "MSE",
-        "r2_score": "R²"
-    }
-
-    for metric_key_in_df, metric_display_label in metrics_to_plot_config.items():
-        if metric_key_in_df in sample_data and sample_data[metric_key_in_df] is not None:
-            daily_values = sample_data[metric_key_in_df]
-            
-            plot_daily_metric_for_model(
-                daily_metric_values=daily_values,
-                metric_name_display=metric_display_label,
-                metric_key_filename=metric_key_in_df.replace('_score', ''),
-                model_type_label=model_type,
-                output_dir=output_dir
-                # position_index não é mais necessário aqui
-            )
-        else:
-            print(f"    Aviso: Coluna de métrica '{metric_key_in_df}' não encontrada ou vazia nos dados.")
-    
-    # --- VISUALIZAÇÕES EXISTENTES (GIFs, Grid) ---
-    # Estas visualizações podem usar 'day_for_main_viz' para destacar um dia específico.
-    
-    # Gerar grid de imagens - esta função plotará 6 dias, usando 'day_for_main_viz' implicitamente se
-    # a lógica interna de plot_images_in_grid for sobre frames e não uma posição de amostra.
-    # A 'position' passada para plot_images_in_grid aqui é 0 porque estamos tratando 'sample_data' como a única amostra.
-    print("    Gerando grid de imagens...")
-    required_cols_grid = ['y_rol', 'y_rol_pred', 'lat', 'lon', 'data']
-    if all(col in sample_data and sample_data[col] is not None for col in required_cols_grid):
-        vmin = np.percentile(sample_data['y_rol'], 5) if sample_data['y_rol'].size > 0 else 0
-        vmax = np.percentile(sample_data['y_rol'], 95) if sample_data['y_rol'].size > 0 else 1
-        # O nome do arquivo do grid agora só tem o model_type e o 'day_for_main_viz' (antigo 'position')
-        grid_path = os.path.join(output_dir, f"{model_type}_grid_dia{day_for_main_viz + 1}.png")
-        # A função plot_images_in_grid precisa ser ciente de que 'pos' (seu 3º argumento)
-        # deve ser usado em conjunto com day_for_main_viz se ela opera sobre um DataFrame multi-linhas,
-        # ou simplesmente usa os dados de sample_data e plota frames/dias.
-        # Para este contexto, passamos df=sample_data.to_frame().T para simular um df de 1 linha, e pos=0.
-        # A lógica de 'rows' em plot_images_in_grid define quantos dias plotar.
-        plot_images_in_grid(sample_data.to_frame().T, rows=NUM_DAYS_METRICS, cols=3, pos=0, 
-                            prefix=model_type, output_path=grid_path, vmin=vmin, vmax=vmax, 
-                            day_to_highlight=day_for_main_viz) # Passando o dia a destacar se a função suportar
+        return None
+    return generate_sample_visualizations([(None, df_metrics_and_data)], model_type, output_dir,
+                                          day_for_main_viz=day_for_main_viz, render_workers=render_workers,
+                                          renderer=renderer, spatial_error_maps=spatial_error_maps,
+                                          animation_format=animation_format, color_limits=color_limits)
+
+@instrumented()
+def generate_sample_visualizations(samples, model_type, output_dir, day_for_main_viz=0,
+                                   render_workers=DEFAULT_RENDER_WORKERS, renderer=DEFAULT_RENDERER, spatial_error_maps=None,
+                                   animation_format=DEFAULT_ANIMATION_FORMAT, color_limits=None):
+    """
+    Gera as visualizações de uma ou mais amostras da mesma tarefa em uma única passada: os
+    artefatos de todas as amostras (e o grid de erro espacial, uma vez) entram na mesma fila
+    de run_render_jobs, compartilhando os workers e o cache do fundo cartográfico.
+    'samples' é uma lista de (rótulo, pandas.Series): artefatos de rótulo None têm os nomes
+    de sempre (<model_type>_...), os demais <model_type>_<rótulo>_... (ver sample_index.py).
+    Os demais parâmetros são os de generate_visualizations.
+    """
+    render_jobs = []
+    spatial_jobs, daily_jobs = [], [] # Os artefatos mais caros (grid, GIFs) entram primeiro na fila
+    shared_fields_dirs = [] # Campos gravados em disco (memmap) para os workers de renderização
+
+    if renderer == "fast_raster":
+        import fast_raster # Importado aqui: fast_raster depende deste módulo
+        gif_func, grid_func = fast_raster.write_forecast_gif, fast_raster.write_forecast_grid
+        spatial_error_func = fast_raster.write_spatial_error_grid
     else:
-        print("    Aviso: Colunas necessárias para plot_images_in_grid ausentes ou dados None. Grid não gerado.")
-    
-    # Gerar GIFs para diferentes visualizações
-    print("    Gerando GIFs...")
-    required_cols_gif = ['y_rol', 'y_rol_pred', 'lat', 'lon', 'data']
-    if all(col in sample_data and sample_data[col] is not None for col in required_cols_gif):
-        for prefix_gif in ['', '_diff', '_pred']:
-            col_for_gif = f'y_rol{prefix_gif}' if prefix_gif in ['', '_pred'] else 'y_rol'
-            if prefix_gif == '_diff' or (col_for_gif in sample_data and sample_data[col_for_gif] is not None):
-                # Nome do GIF agora reflete o dia principal da visualização (se aplicável ao GIF)
-                gif_base_name = f"{model_type}_dia{day_for_main_viz + 1}{prefix_gif}"
-                # Passamos df=sample_data.to_frame().T e pos=0.
-                # O day_for_main_viz pode ser usado dentro de get_gif_forecasting se ele precisar focar um frame.
-                get_gif_forecasting(sample_data.to_frame().T, os.path.join(output_dir, gif_base_name), 
-                                    prefix=prefix_gif, pos=0, hour=24, day_to_highlight=day_for_main_viz)
+        if renderer != DEFAULT_RENDERER:
+            print(f"    Aviso: renderizador '{renderer}' desconhecido (opções: {', '.join(RENDERERS)}). Usando '{DEFAULT_RENDERER}'.")
+        gif_func, grid_func = get_gif_forecasting, plot_images_in_grid
+        spatial_error_func = plot_spatial_error_maps
+    animation_format = resolve_animation_format(animation_format)
+
+    samples = [(label, sample_data) for label, sample_data in samples if sample_data is not None and not sample_data.empty]
+    for label, sample_data in samples:
+        artifact_prefix = model_type if label is None else f"{model_type}_{label}"
+        # --- VISUALIZAÇÕES ESPACIAIS (Grid, GIFs) ---
+        # Estas visualizações usam 'day_for_main_viz' para destacar um dia específico.
+        print(f"    Preparando grid de imagens e GIFs{'' if label is None else f' ({label})'}...")
+        required_cols_spatial = ['y_rol', 'y_rol_pred', 'lat', 'lon', 'data']
+        if all(col in sample_data and sample_data[col] is not None for col in required_cols_spatial):
+            # Real, previsão e diferença por dia (dias, ny, nx) calculados uma vez para o grid e os 3 GIFs
+            sample_fields = SampleFields.from_sample_row(sample_data)
+            if color_limits is not None:
+                sample_fields.vmin, sample_fields.vmax = (float(limit) for limit in color_limits)
+            if int(render_workers or 1) > 1:
+                # Os workers reabrem os campos como memmaps em vez de receber cópias serializadas
+                try:
+                    shared_fields_dirs.append(tempfile.mkdtemp(prefix="campos_amostra_"))
+                    sample_fields = sample_fields.save(shared_fields_dirs[-1])
+                except OSError as e:
+                    print(f"    Aviso: não foi possível gravar os campos da amostra em disco ({e}). Enviando cópias aos workers.")
+            vmin, vmax = sample_fields.vmin, sample_fields.vmax
+            # O nome do arquivo do grid só tem o model_type (e o rótulo) e o 'day_for_main_viz' (antigo 'position')
+            grid_path = os.path.join(output_dir, f"{artifact_prefix}_grid_dia{day_for_main_viz + 1}.png")
+            # A lógica de 'rows' em plot_images_in_grid define quantos dias plotar.
+            render_jobs.append((os.path.basename(grid_path), grid_func,
+                                dict(df_single_row=None, rows=NUM_DAYS_METRICS, cols=3, pos=0,
+                                     prefix=artifact_prefix, output_path=grid_path, vmin=vmin, vmax=vmax,
+                                     day_to_highlight=day_for_main_viz, sample_fields=sample_fields)))
+
+            for prefix_gif in ['', '_diff', '_pred']:
+                # Nome do GIF reflete o dia principal da visualização
+                gif_base_name = f"{artifact_prefix}_dia{day_for_main_viz + 1}{prefix_gif}"
+                render_jobs.append((os.path.basename(animation_path(gif_base_name, 24, animation_format)), gif_func,
+                                    dict(df_single_row=None, output_path_base=os.path.join(output_dir, gif_base_name),
+                                         prefix=prefix_gif, pos=0, hour=24, day_to_highlight=day_for_main_viz,
+                                         sample_fields=sample_fields, animation_format=animation_format)))
+        else:
+            print("    Aviso: Colunas necessárias para o grid e os GIFs ausentes ou dados None. Grid e GIFs não gerados.")
+
+        # --- GRÁFICOS DE MÉTRICAS DIÁRIAS ---
+        # Estes gráficos mostram a evolução das métricas ao longo dos 7 dias para esta amostra.
+        print("    Preparando gráficos de métricas diárias (RMSE, MSE, R²)...")
+        metrics_to_plot_config = {
+            "rmse": "RMSE",
+            "mse": "MSE",
+            "r2_score": "R²"
+        }
+
+        for metric_key_in_df, metric_display_label in metrics_to_plot_config.items():
+            if metric_key_in_df in sample_data and sample_data[metric_key_in_df] is not None:
+                metric_key_filename = metric_key_in_df.replace('_score', '')
+                daily_jobs.append((f"{artifact_prefix}_daily_{metric_key_filename}.png", plot_daily_metric_for_model,
+                                   dict(daily_metric_values=sample_data[metric_key_in_df],
+                                        metric_name_display=metric_display_label,
+                                        metric_key_filename=metric_key_filename,
+                                        model_type_label=artifact_prefix,
+                                        output_dir=output_dir)))
             else:
-                print(f"    Aviso: Coluna {col_for_gif} ausente para GIF com prefixo '{prefix_gif}'. GIF não gerado.")
-    else:
-         print("    Aviso: Colunas necessárias para get_gif_forecasting ausentes ou dados None. GIFs não gerados.")
+                print(f"    Aviso: Coluna de métrica '{metric_key_in_df}' não encontrada ou vazia nos dados.")
 
-    print(f"  Visualizações para {model_type} (destacando dia {day_for_main_viz + 1}) concluídas.")
+    # --- ERRO ESPACIAL (todas as amostras, um único grid por tarefa) ---
+    if spatial_error_maps is not None and samples:
+        sample_data = samples[0][1]
+        if sample_data.get('lat') is not None and sample_data.get('lon') is not None:
+            spatial_error_path = os.path.join(output_dir, f"{model_type}_erro_espacial.png")
+            spatial_jobs.append((os.path.basename(spatial_error_path), spatial_error_func,
+                                 dict(error_maps=spatial_error_maps, lat=sample_data['lat'], lon=sample_data['lon'],
+                                      model_type=model_type, output_path=spatial_error_path)))
+        else:
+            print("    Aviso: lat/lon ausentes. Mapas de erro espacial não gerados.")
+    render_jobs.extend(spatial_jobs + daily_jobs)
+
+    n_workers = min(max(int(render_workers or 1), 1), max(len(render_jobs), 1))
+    print(f"    Renderizando {len(render_jobs)} artefato(s) com {n_workers} processo(s)...")
+    t_start = time.perf_counter()
+    try:
+        render_timings = run_render_jobs(render_jobs, render_workers=n_workers)
+    finally:
+        for shared_fields_dir in shared_fields_dirs:
+            shutil.rmtree(shared_fields_dir, ignore_errors=True)
+    total_seconds = time.perf_counter() - t_start
+
+    print("    Tempos de renderização por artefato:")
+    for artifact_name, elapsed in sorted(render_timings.items(), key=lambda item: -item[1]):
+        print(f"      {artifact_name}: {elapsed:.2f}s")
+    print(f"    Total: {total_seconds:.2f}s de parede ({sum(render_timings.values()):.2f}s somados)")
 
+    print(f"  Visualizações para {model_type} (destacando dia {day_for_main_viz + 1}) concluídas.")
+    return render_timings
 
-def get_gif_forecasting(df_single_row, output_path_base, prefix="", pos=0, hour=24, day_to_highlight=0):
+@instrumented()
+def get_gif_forecasting(df_single_row, output_path_base, prefix="", pos=0, hour=24, day_to_highlight=0,
+                        sample_fields=None, animation_format=DEFAULT_ANIMATION_FORMAT):
     """
     Gera um GIF. df_single_row é um DataFrame com uma única linha.
     'pos' é sempre 0. 'day_to_highlight' pode ser usado para focar um frame.
+    O fundo cartográfico e o pcolormesh são criados uma única vez; a cada frame
+    apenas os dados da malha (QuadMesh.set_array) e o título são atualizados, e o buffer
+    do canvas vai direto para o writer de 'animation_format' (ver animation_writers.py).
+    'sample_fields' (SampleFields) dispensa df_single_row: os campos por dia já prontos.
     """
     fig, ax = plt.subplots(figsize=(10, 8), subplot_kw={'projection': ccrs.PlateCarree()})
     
-    sample_row = df_single_row.iloc[pos] # pos será 0
+    fields = resolve_sample_fields(df_single_row, pos, sample_fields) # pos será 0
     
-    if sample_row['y_rol'] is not None and sample_row['y_rol'].size > 0:
-        vmin = np.percentile(sample_row['y_rol'], 5)
-        vmax = np.percentile(sample_row['y_rol'], 95)
-    else: 
-        vmin, vmax = 0, 1 
+    if fields.real is None:
         print(f"Aviso em get_gif_forecasting: y_rol é None ou vazio. Usando vmin/vmax padrão.")
+    vmin, vmax = fields.vmin, fields.vmax
 
-    add_colorbar = [True] 
-    
     # Frames para o GIF (todos os dias)
     num_frames_gif = NUM_DAYS_METRICS
 
+    lon = fields.lon
+    lat = fields.lat
+    if lon is None or lat is None:
+        print(f"    Erro ao salvar GIF {output_path_base}: Dados de lon/lat ausentes.")
+        plt.close(fig)
+        return None
+    shape = lon.shape
+
+    if prefix == '_diff':
+        current_cmap = 'coolwarm'
+        current_vmin, current_vmax = -2, 2 # Para diferença
+    else:
+        current_cmap = 'jet'
+        current_vmin, current_vmax = vmin, vmax
+    field_kind = {'_diff': 'diff', '_pred': 'pred'}.get(prefix, 'real')
+
+    def frame_data(frame_idx):
+        """Campo do frame (ou None se os dados estiverem ausentes)."""
+        return fields.field(field_kind, frame_idx)
+
+    initial_data = frame_data(0)
+    lon_edges, lat_edges = fields.grid.mesh_edges # Bordas das células já calculadas para a grade
+    mesh = ax.pcolormesh(lon_edges, lat_edges, initial_data if initial_data is not None else np.full(shape, np.nan),
+                         cmap=current_cmap, vmin=current_vmin, vmax=current_vmax, shading='flat', transform=ccrs.PlateCarree())
+    cbar = plt.colorbar(mesh, ax=ax, orientation='vertical', pad=0.05, shrink=0.8)
+    cbar.set_label('Intensidade')
+    # O fundo é adicionado depois da colorbar, quando a posição final do eixo já é conhecida
+    add_cached_basemap(ax, "gif", fields.grid.extent, fig.dpi)
+
     def update(frame_idx): # frame_idx vai de 0 a num_frames_gif - 1
-        ax.clear()
-        ax.coastlines()
-        ax.add_feature(cfeature.BORDERS, linestyle=':')
-        ax.add_feature(cfeature.LAND, facecolor='lightgrey', zorder=0)
-        
-        lon = sample_row['lon']
-        lat = sample_row['lat']
-        
-        if lon is None or lat is None:
-            ax.set_title(f'Erro: Dados de lon/lat ausentes (Frame {frame_idx+1})')
+        data_to_plot = frame_data(frame_idx)
+        if data_to_plot is None:
+            mesh.set_array(np.full(shape, np.nan))
+            col_label = 'diff' if prefix == '_diff' else f'y_rol{prefix}'
+            ax.set_title(f'Erro: Dados ausentes para {col_label} (Frame {frame_idx+1})')
             return
-        shape = lon.shape
-
-        scatter = None
-        data_to_plot = None
-        
-        if prefix == '_diff':
-            if sample_row['y_rol_pred'] is not None and sample_row['y_rol'] is not None and \
-               sample_row['y_rol_pred'].shape[1] > frame_idx and sample_row['y_rol'].shape[1] > frame_idx:
-                y_pred = sample_row['y_rol_pred'][:, frame_idx]
-                y_real = sample_row['y_rol'][:, frame_idx]
-                data_to_plot = np.abs(y_real - y_pred).reshape(shape)
-                current_cmap = 'coolwarm'
-                current_vmin, current_vmax = -2, 2 # Para diferença
-            else:
-                ax.set_title(f'Erro: Dados ausentes para diff (Frame {frame_idx+1})')
-                return
-        else:
-            col_name = f'y_rol{prefix}' 
-            if col_name in sample_row and sample_row[col_name] is not None and sample_row[col_name].shape[1] > frame_idx:
-                data_to_plot = sample_row[col_name][:, frame_idx].reshape(shape)
-                current_cmap = 'jet'
-                current_vmin, current_vmax = vmin, vmax
-            else:
-                ax.set_title(f'Erro: Dados ausentes para {col_name} (Frame {frame_idx+1})')
-                return
-        
-        if data_to_plot is not None:
-             scatter = ax.pcolormesh(lon, lat, data_to_plot, cmap=current_cmap, vmin=current_vmin, vmax=current_vmax, shading='auto', transform=ccrs.PlateCarree())
+        mesh.set_array(data_to_plot)
         
-        if add_colorbar[0] and scatter:
-            cbar = plt.colorbar(scatter, ax=ax, orientation='vertical', pad=0.05, shrink=0.8)
-            cbar.set_label('Intensidade')
-            add_colorbar[0] = False # Adiciona colorbar apenas uma vez
-        
-        date_val = sample_row['data'] # Data base
+        date_val = fields.date # Data base
         if date_val is not None:
             current_frame_date = date_val + timedelta(hours=hour * frame_idx)
             current_frame_date_str = current_frame_date.strftime("%Y-%m-%d %H:%M:%S")
@@ -259,11 +508,13 @@ def get_gif_forecasting(df_single_row, output_path_base, prefix="", pos=0, hour=
         else:
             ax.set_title(f'Erro: Data base ausente (Frame {frame_idx+1})')
             
-    anim = FuncAnimation(fig, update, frames=num_frames_gif, interval=300)
-    
-    gif_file = f"{output_path_base}_{hour}h.gif"
+    gif_file = animation_path(output_path_base, hour, animation_format)
     try:
-        anim.save(gif_file, writer='pillow', fps=2)
+        writer = open_animation_writer(gif_file, animation_format, duration_ms=DEFAULT_FRAME_DURATION_MS)
+        for frame_idx in range(num_frames_gif):
+            update(frame_idx)
+            writer.add_frame(canvas_frame(fig))
+        writer.close()
         print(f"    GIF salvo: {gif_file}")
     except Exception as e:
         print(f"    Erro ao salvar GIF {gif_file}: {e}")
@@ -272,11 +523,14 @@ def get_gif_forecasting(df_single_row, output_path_base, prefix="", pos=0, hour=
     return gif_file
 
 
-def plot_images_in_grid(df_single_row, rows, cols, pos, prefix, output_path, vmin=None, vmax=None, hour=24, day_to_highlight=0):
+@instrumented()
+def plot_images_in_grid(df_single_row, rows, cols, pos, prefix, output_path, vmin=None, vmax=None, hour=24, day_to_highlight=0,
+                        sample_fields=None):
     """
     Plota uma grade de imagens. 'rows' é o número de dias a mostrar.
     df_single_row é um DataFrame de uma linha. 'pos' é sempre 0.
     'day_to_highlight' indica o dia a ser destacado.
+    'sample_fields' (SampleFields) dispensa df_single_row: os campos por dia já prontos.
     """
     # 'rows' aqui é o número de dias que você quer mostrar no grid.
     # Se rows > NUM_DAYS_METRICS, limitaremos aos dias disponíveis.
@@ -288,23 +542,19 @@ def plot_images_in_grid(df_single_row, rows, cols, pos, prefix, output_path, vmi
     )
     fig.subplots_adjust(wspace=-0.6 if cols > 1 else 0, hspace=0.4 if num_days_to_plot_in_grid > 1 else 0) # Ajustado hspace
 
-    sample_row = df_single_row.iloc[pos] # pos é 0
-    lon = sample_row['lon']
-    lat = sample_row['lat']
+    fields = resolve_sample_fields(df_single_row, pos, sample_fields) # pos é 0
+    lon = fields.lon
+    lat = fields.lat
     
     if lon is None or lat is None:
         print(f"    Aviso: Dados de lon/lat ausentes para plot_images_in_grid. Grid não gerado.")
         plt.close(fig)
         return None
-    shape = lon.shape
+    grid_extent = fields.grid.extent
+    lon_edges, lat_edges = fields.grid.mesh_edges
 
-    if vmin is None or vmax is None:
-        if sample_row['y_rol'] is not None and sample_row['y_rol'].size > 0:
-            vmin_calc = np.percentile(sample_row['y_rol'], 5)
-            vmax_calc = np.percentile(sample_row['y_rol'], 95)
-        else: vmin_calc, vmax_calc = 0, 1
-        vmin = vmin if vmin is not None else vmin_calc
-        vmax = vmax if vmax is not None else vmax_calc
+    vmin = vmin if vmin is not None else fields.vmin
+    vmax = vmax if vmax is not None else fields.vmax
 
     pcm_for_colorbar = None
     for i_day in range(num_days_to_plot_in_grid): # i_day é o índice do dia (0 a NUM_DAYS_METRICS-1)
@@ -316,37 +566,31 @@ def plot_images_in_grid(df_single_row, rows, cols, pos, prefix, output_path, vmi
             else: ax = axes[i_day, j_type]
 
             ax.clear()
-            ax.coastlines(linewidth=0.5, zorder=2)
-            ax.add_feature(cfeature.BORDERS, linestyle=':', linewidth=0.5, zorder=2)
-            ax.add_feature(cfeature.LAND, facecolor='lightgray', zorder=0)
+            add_cached_basemap(ax, "grid", grid_extent, GRID_SAVE_DPI)
             
             data_to_plot = None
             title_part_str = ""
 
             if j_type == 0:
                 title_part_str = "Real"
-                if sample_row['y_rol'] is not None and sample_row['y_rol'].shape[1] > i_day:
-                    data_to_plot = sample_row['y_rol'][:, i_day].reshape(shape)
+                data_to_plot = fields.field('real', i_day)
             elif j_type == 1:
                 title_part_str = "Previsão"
-                if sample_row['y_rol_pred'] is not None and sample_row['y_rol_pred'].shape[1] > i_day:
-                    data_to_plot = sample_row['y_rol_pred'][:, i_day].reshape(shape)
+                data_to_plot = fields.field('pred', i_day)
             elif j_type == 2:
                 title_part_str = "Diferença Abs."
-                if sample_row['y_rol'] is not None and sample_row['y_rol_pred'] is not None and \
-                   sample_row['y_rol'].shape[1] > i_day and sample_row['y_rol_pred'].shape[1] > i_day:
-                    data_to_plot = np.abs(sample_row['y_rol'][:, i_day] - sample_row['y_rol_pred'][:, i_day]).reshape(shape)
+                data_to_plot = fields.field('diff', i_day)
             
             if data_to_plot is not None:
                 current_vmin_plot, current_vmax_plot = (-2, 2) if j_type == 2 else (vmin, vmax)
                 current_cmap_plot = 'coolwarm' if j_type == 2 else 'jet'
                 
-                pcm = ax.pcolormesh(lon, lat, data_to_plot, vmin=current_vmin_plot, vmax=current_vmax_plot, cmap=current_cmap_plot, shading='auto', transform=ccrs.PlateCarree())
+                pcm = ax.pcolormesh(lon_edges, lat_edges, data_to_plot, vmin=current_vmin_plot, vmax=current_vmax_plot, cmap=current_cmap_plot, shading='flat', transform=ccrs.PlateCarree())
                 if j_type != 2: pcm_for_colorbar = pcm # Usar Real ou Pred para a colorbar principal
             else:
                 ax.text(0.5, 0.5, 'Dados Indisp.', ha='center', va='center', transform=ax.transAxes, fontsize=8)
 
-            date_val = sample_row['data'] # Data base
+            date_val = fields.date # Data base
             if date_val is not None:
                 current_plot_date = date_val + timedelta(hours=hour * i_day)
                 current_plot_date_str = current_plot_date.strftime("%Y-%m-%d %H:%M")
@@ -366,48 +610,196 @@ def plot_images_in_grid(df_single_row, rows, cols, pos, prefix, output_path, vmi
     
     # Título principal do Grid
     fig.suptitle(f'Comparativo Diário - {prefix} (Dia Destaque: {day_to_highlight+1})', fontsize=16, weight='bold', y=0.99)
-    plt.savefig(output_path, bbox_inches='tight', dpi=150)
+    plt.savefig(output_path, bbox_inches='tight', dpi=GRID_SAVE_DPI)
     plt.close(fig)
     
     print(f"    Grid de imagens salvo: {output_path}")
     return output_path
 
-# combine_gifs (sem alterações, apenas incluído para completude do arquivo)
-def combine_gifs(pattern, output_path, duration_ms=1000):
-    all_gifs = sorted(glob.glob(pattern))
+def spatial_error_scales(error_maps):
+    """
+    Escalas de cor dos mapas de erro espacial: (limite simétrico do viés, máximo comum de
+    MAE/RMSE), pelo percentil SPATIAL_ERROR_SCALE_PERCENTILE dos pontos finitos.
+    """
+    abs_bias = np.abs(error_maps['bias'])
+    bias_limit = np.nanpercentile(abs_bias, SPATIAL_ERROR_SCALE_PERCENTILE) if np.isfinite(abs_bias).any() else 1.0
+    error_vmax = np.nanpercentile(error_maps['rmse'], SPATIAL_ERROR_SCALE_PERCENTILE) if np.isfinite(error_maps['rmse']).any() else 1.0
+    return float(bias_limit) or 1.0, float(error_vmax) or 1.0
+
+@instrumented()
+def plot_spatial_error_maps(error_maps, lat, lon, model_type, output_path):
+    """
+    Plota um grid dias x (viés, MAE, RMSE) com os erros por ponto de grade acumulados sobre
+    todas as amostras (ver metrics.SpatialErrorAccumulator.maps). O viés usa escala simétrica
+    e MAE/RMSE uma escala comum a partir de zero (ver spatial_error_scales).
+    """
+    num_days = min(error_maps['bias'].shape[0], NUM_DAYS_METRICS)
+    cols = len(SPATIAL_ERROR_COLUMNS)
+    fig, axes = plt.subplots(num_days, cols, figsize=(cols * 5, num_days * 4.5), squeeze=False,
+                             subplot_kw={'projection': ccrs.PlateCarree()})
+    fig.subplots_adjust(wspace=-0.6, hspace=0.4 if num_days > 1 else 0)
+    grid = get_grid(lat, lon)
+    grid_extent = grid.extent
+    lon_edges, lat_edges = grid.mesh_edges
+    bias_limit, error_vmax = spatial_error_scales(error_maps)
+
+    meshes = {}
+    for i_day in range(num_days):
+        for j_type, (map_key, title_part_str, cmap_name) in enumerate(SPATIAL_ERROR_COLUMNS):
+            ax = axes[i_day, j_type]
+            add_cached_basemap(ax, "grid", grid_extent, GRID_SAVE_DPI)
+            panel_vmin, panel_vmax = (-bias_limit, bias_limit) if map_key == "bias" else (0, error_vmax)
+            meshes[map_key] = ax.pcolormesh(lon_edges, lat_edges, error_maps[map_key][i_day], vmin=panel_vmin, vmax=panel_vmax,
+                                            cmap=cmap_name, shading='flat', transform=ccrs.PlateCarree())
+            ax.set_title(f'{title_part_str}, Dia {i_day+1}', fontsize=9)
+            ax.set_xticks([])
+            ax.set_yticks([])
+
+    for map_key, cbar_label, cbar_rect in [("bias", "Viés", [0.93, 0.55, 0.015, 0.3]), ("rmse", "MAE / RMSE", [0.93, 0.15, 0.015, 0.3])]:
+        cbar = fig.colorbar(meshes[map_key], cax=fig.add_axes(cbar_rect), orientation='vertical')
+        cbar.set_label(cbar_label, fontsize=11)
+        cbar.ax.tick_params(labelsize=9)
+
+    fig.suptitle(f'Erro por Ponto de Grade - {model_type} ({error_maps["count"]} amostras)', fontsize=16, weight='bold', y=0.99)
+    plt.savefig(output_path, bbox_inches='tight', dpi=GRID_SAVE_DPI)
+    plt.close(fig)
+    print(f"    Mapas de erro espacial salvos: {output_path}")
+    return output_path
+
+COMBINE_MODES = ("concat", "montage")
+MONTAGE_LABEL_HEIGHT = 24 # Faixa com o rótulo de cada animação no modo montagem
+DEFAULT_COMBINE_MAX_BUFFERED_BYTES = 512 * 1024**2 # Acima disso, combine_gifs grava em mp4 (se houver ffmpeg)
+
+def _iter_animation_frames(image):
+    """Frames de uma animação já aberta, decodificados um por vez (o mesmo objeto a cada frame)."""
+    frame_idx = 0
+    while True:
+        try:
+            image.seek(frame_idx)
+        except EOFError:
+            return
+        yield image
+        frame_idx += 1
+
+def _read_animation_headers(paths):
+    """Primeira passada: só os cabeçalhos (tamanho e número de frames), sem decodificar os pixels."""
+    headers = []
+    for path in paths:
+        try:
+            with Image.open(path) as image:
+                headers.append((path, image.size, getattr(image, "n_frames", 1)))
+        except Exception as e:
+            print(f"Erro ao processar o GIF {path}: {e}")
+    return headers
+
+def _concat_frames(headers, frame_size):
+    """Frames das animações encadeados, cada um decodificado e redimensionado só quando pedido."""
+    for path, _, _ in headers:
+        try:
+            with Image.open(path) as image:
+                for frame in _iter_animation_frames(image):
+                    yield frame.convert("RGB").resize(frame_size, Image.Resampling.LANCZOS)
+        except Exception as e:
+            print(f"Erro ao processar o GIF {path}: {e}")
+
+def _montage_frames(headers, frame_size, num_columns, labels_by_path, copy_frames):
+    """
+    Frames da montagem: a cada instante, o frame de cada animação é colado no seu painel.
+    O mesmo painel é reaproveitado entre instantes; com copy_frames, cada frame entregue é uma
+    cópia (para writers que guardam a imagem recebida sem convertê-la).
+    """
+    num_rows = -(-len(headers) // num_columns)
+    tile_w, tile_h = frame_size[0], frame_size[1] + MONTAGE_LABEL_HEIGHT
+    montage = Image.new("RGB", (tile_w * num_columns, tile_h * num_rows), "white")
+    draw = ImageDraw.Draw(montage)
+    label_font = ImageFont.load_default(size=16)
+    for tile_idx, (path, _, _) in enumerate(headers):
+        label = labels_by_path.get(path, os.path.splitext(os.path.basename(path))[0])
+        x0, y0 = (tile_idx % num_columns) * tile_w, (tile_idx // num_columns) * tile_h
+        draw.text((x0 + tile_w // 2, y0 + MONTAGE_LABEL_HEIGHT // 2), label, fill="black", anchor="mm", font=label_font)
+
+    images = [Image.open(path) for path, _, _ in headers]
+    try:
+        for frame_idx in range(max(n_frames for _, _, n_frames in headers)):
+            for tile_idx, (image, (_, _, n_frames)) in enumerate(zip(images, headers)):
+                if frame_idx < n_frames: # Animação mais curta: o painel mantém o último frame
+                    image.seek(frame_idx)
+                    x0, y0 = (tile_idx % num_columns) * tile_w, (tile_idx // num_columns) * tile_h
+                    montage.paste(image.convert("RGB").resize(frame_size, Image.Resampling.LANCZOS),
+                                  (x0, y0 + MONTAGE_LABEL_HEIGHT))
+            yield montage.copy() if copy_frames else montage
+    finally:
+        for image in images:
+            image.close()
+
+@instrumented()
+def combine_gifs(pattern, output_path, duration_ms=1000, mode="concat", columns=None, labels=None,
+                 max_buffered_bytes=DEFAULT_COMBINE_MAX_BUFFERED_BYTES):
+    """
+    Combina animações (GIFs, ou qualquer animação legível pelo Pillow) em uma única.
+    'pattern' é um padrão glob ou uma lista de caminhos. Uma primeira passada lê apenas os
+    cabeçalhos para definir o tamanho final e o número de frames; depois os frames são
+    decodificados e redimensionados um de cada vez, sob demanda do writer (animation_writers.py,
+    formato pela extensão de output_path), sem manter os frames originais em memória.
+    Só o mp4 grava os frames de forma incremental: GIF, WebP e APNG são gravados pelo Pillow de
+    uma vez, que guarda todos os frames de saída até o fim. Se essa memória estimada passar de
+    'max_buffered_bytes' e houver ffmpeg, a saída vira um .mp4 (mesmo nome), com aviso.
+    mode="concat": os frames das animações são encadeados, todos no menor tamanho.
+    mode="montage": a cada instante, o frame de cada animação vira um painel de uma grade de
+    'columns' colunas (padrão: todas lado a lado), com o rótulo de 'labels' (padrão: nome do
+    arquivo); animações mais curtas repetem o último frame.
+    Retorna o caminho gravado, ou None.
+    """
+    all_gifs = sorted(glob.glob(pattern)) if isinstance(pattern, str) else list(pattern)
     if not all_gifs:
         print(f"Nenhum GIF encontrado com padrão: {pattern}")
         return None
-    all_frames = []
-    for gif_file in all_gifs:
-        try:
-            with Image.open(gif_file) as frames:
-                frame_idx = 0
-                while True:
-                    try:
-                        frames.seek(frame_idx)
-                        frame = frames.copy().convert("RGB")
-                        all_frames.append(frame)
-                        frame_idx += 1
-                    except EOFError:
-                        break 
-        except Exception as e:
-            print(f"Erro ao processar o GIF {gif_file}: {e}")
-            continue 
-    if not all_frames:
+    if mode not in COMBINE_MODES:
+        print(f"Modo '{mode}' desconhecido (opções: {', '.join(COMBINE_MODES)}).")
+        return None
+
+    labels_by_path = dict(zip(all_gifs, labels)) if labels is not None else {}
+    headers = _read_animation_headers(all_gifs)
+    if not headers:
         print("Nenhum frame coletado dos GIFs.")
         return None
-    min_width = min(f.width for f in all_frames)
-    min_height = min(f.height for f in all_frames)
-    min_size = (min_width, min_height)
-    all_frames = [f.resize(min_size, Image.Resampling.LANCZOS) for f in all_frames]
-    all_frames[0].save(
-        output_path,
-        save_all=True,
-        append_images=all_frames[1:],
-        duration=duration_ms,
-        loop=0
-    )
-    print(f"GIF combinado salvo: {output_path}")
+    min_size = (min(size[0] for _, size, _ in headers), min(size[1] for _, size, _ in headers))
+    if mode == "concat":
+        output_size, num_frames = min_size, sum(n_frames for _, _, n_frames in headers)
+    else:
+        num_columns = max(1, min(columns or len(headers), len(headers)))
+        output_size = (min_size[0] * num_columns, (min_size[1] + MONTAGE_LABEL_HEIGHT) * -(-len(headers) // num_columns))
+        num_frames = max(n_frames for _, _, n_frames in headers)
+
+    output_format = animation_format_from_path(output_path)
+    buffered_bytes = retained_frame_bytes(output_format, output_size, num_frames)
+    if buffered_bytes > max_buffered_bytes:
+        if find_ffmpeg() is not None:
+            output_path = os.path.splitext(output_path)[0] + ANIMATION_EXTENSIONS["mp4"]
+            print(f"AVISO: {num_frames} frames de {output_size[0]}x{output_size[1]} ocupariam ~{buffered_bytes / 1024**2:.0f} MB "
+                  f"até a gravação em '{output_format}'; gravando em mp4 (sem acumular frames): {output_path}")
+            output_format = "mp4"
+        else:
+            print(f"AVISO: {num_frames} frames de {output_size[0]}x{output_size[1]} ocuparão ~{buffered_bytes / 1024**2:.0f} MB "
+                  f"até a gravação em '{output_format}' (sem ffmpeg para gravar em mp4, que não acumula frames).")
+
+    if mode == "concat":
+        frames = _concat_frames(headers, min_size)
+    else:
+        # O GIF converte cada frame para paleta ao recebê-lo (nova imagem); os demais formatos guardam o recebido
+        frames = _montage_frames(headers, min_size, num_columns, labels_by_path, copy_frames=output_format != "gif")
+
+    frame_count = 0
+    def counted_frames():
+        nonlocal frame_count
+        for frame in frames:
+            frame_count += 1
+            yield frame
+
+    writer = open_animation_writer(output_path, output_format, duration_ms=duration_ms)
+    if writer.write_frames(counted_frames()) is None:
+        print("Nenhum frame coletado dos GIFs.")
+        return None
+    print(f"GIF combinado salvo: {output_path} ({frame_count} frames, modo {mode})")
     return output_path
 